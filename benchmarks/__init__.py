@@ -0,0 +1,4 @@
+"""
+Benchmarks of the pulse pipeline, run against synthetic networks in a throwaway database.
+See the `benchmark_ingest` management command.
+"""
@@ -0,0 +1,228 @@
+import datetime as dt
+import random
+import time
+from typing import Dict, List
+
+import numpy as np
+from django.db import connection, transaction
+from django.test import Client
+
+from fl_meters.models import Pulse, ZoneCoordinate, QuarterHourlyZoneConsumption, DailyZoneConsumption, \
+    MonthlyZoneConsumption, YearlyZoneConsumption, DailyZoneLoss, MonthlyZoneLoss, YearlyZoneLoss, LossRecord, \
+    QuarterHourlyTSMInflow, DailyTSMInflow, MonthlyTSMInflow, YearlyTSMInflow, DailyTSMLossRecord, \
+    MonthlyTSMLossRecord, YearlyTSMLossRecord, DailyMeterConsumption
+from fl_meters.tools import get_now
+from .ingest import QueryCounter
+from .network import Network, generate_network
+
+""" SYNTHETIC DATASETS """
+
+# (zones, customer meters per zone, days of history) of each dataset the endpoints are measured against
+DATASET_SIZES = {
+    'small': {'zones': 5, 'customers_per_zone': 20, 'days': 30},
+    'medium': {'zones': 20, 'customers_per_zone': 50, 'days': 365},
+    'large': {'zones': 50, 'customers_per_zone': 40, 'days': 730},
+}
+
+
+def _months(since: dt.date, until: dt.date) -> List[dt.date]:
+    months = [since.replace(day=1)]
+    while months[-1] < until.replace(day=1):
+        months.append((months[-1] + dt.timedelta(days=32)).replace(day=1))
+    return months
+
+
+def _bulk_create(model, objs) -> int:
+    objs = list(objs)
+    model.objects.bulk_create(objs)
+    return len(objs)
+
+
+@transaction.atomic
+def seed_dataset(network: Network, days: int, until: dt.datetime = None, seed=0) -> Dict[str, int]:
+    """
+    Fills the rollups of a generated network with `days` of history up to `until`: the quarter-hourly, daily,
+    monthly and yearly consumption and losses of its zones and transmission lines, the daily consumption of its
+    meters, and the latest pulses of each meter. Rows are bulk inserted, with random values.
+
+    :return: The number of rows seeded in each table.
+    """
+    rng = random.Random(seed)
+    until = (until or get_now()).replace(minute=0, second=0, microsecond=0)
+    since = until - dt.timedelta(days=days)
+    quarters = [since + dt.timedelta(minutes=15 * idx) for idx in range(days * 96)]
+    dates = [(since + dt.timedelta(days=idx)).date() for idx in range(1, days + 1)]
+    months = _months(dates[0], dates[-1])
+    years = sorted({month.year for month in months})
+    amount = lambda scale: round(rng.uniform(0, scale), 3)
+
+    seeded = {}
+    for zone in network.zones:
+        ZoneCoordinate.objects.bulk_create(
+            ZoneCoordinate(zone=zone, latitude=rng.uniform(31, 32), longitude=rng.uniform(35, 36)) for _ in range(8))
+        for model, field, periods, scale in (
+                (QuarterHourlyZoneConsumption, 'datetime', quarters, 10), (DailyZoneConsumption, 'date', dates, 960),
+                (MonthlyZoneConsumption, 'date', months, 29000), (YearlyZoneConsumption, 'year', years, 350000)):
+            seeded[model.__name__] = seeded.get(model.__name__, 0) + _bulk_create(
+                model, (model(zone_id=zone, consumption=amount(scale), **{field: period}) for period in periods))
+        for model, field, periods, scale in (
+                (DailyZoneLoss, 'date', dates, 100), (MonthlyZoneLoss, 'date', months, 3000),
+                (YearlyZoneLoss, 'year', years, 36000)):
+            seeded[model.__name__] = seeded.get(model.__name__, 0) + _bulk_create(
+                model, (model(zone=zone, loss=amount(scale), **{field: period}) for period in periods))
+        seeded['LossRecord'] = seeded.get('LossRecord', 0) + _bulk_create(
+            LossRecord, (LossRecord(zone=zone, date=date, amount=amount(100)) for date in dates))
+
+    for line in network.transmission_lines:
+        for model, field, periods, scale in (
+                (QuarterHourlyTSMInflow, 'datetime', quarters, 30), (DailyTSMInflow, 'date', dates, 2900),
+                (MonthlyTSMInflow, 'date', months, 87000), (YearlyTSMInflow, 'year', years, 1000000)):
+            seeded[model.__name__] = seeded.get(model.__name__, 0) + _bulk_create(
+                model, (model(transmission_line=line, consumption=amount(scale), **{field: period})
+                        for period in periods))
+        for model, field, periods, scale in (
+                (DailyTSMLossRecord, 'date', dates, 30), (MonthlyTSMLossRecord, 'date', months, 900),
+                (YearlyTSMLossRecord, 'year', years, 11000)):
+            seeded[model.__name__] = seeded.get(model.__name__, 0) + _bulk_create(
+                model, (model(transmission_line=line, loss=amount(scale), **{field: period}) for period in periods))
+
+    seeded['DailyMeterConsumption'] = _bulk_create(DailyMeterConsumption, (
+        DailyMeterConsumption(meter=meter, date=date, consumption=amount(5))
+        for meter in network.flow_meters for date in dates))
+    # readings of the last hour; bulk inserted, so without their analytics
+    seeded['Pulse'] = _bulk_create(Pulse, (
+        Pulse(meter=meter, time=quarter, reading=str(idx * 7), raw_reading=idx * 7, normalized_reading=idx * 7)
+        for meter in network.flow_meters for idx, quarter in enumerate(quarters[-4:])))
+    return seeded
+
+
+""" READ-ENDPOINT BENCHMARK """
+
+
+class QueryBudget:
+    """
+    The most queries a request to an endpoint should run: `fixed` queries, plus as many per entity of the dataset as
+    given by keyword, named after the keys of `Network.size`. Budgets are targets: an endpoint known to run more, an
+    N+1 not fixed yet, is marked as an expected failure rather than given a budget that grows with the data.
+    """
+
+    def __init__(self, fixed: int, **per_entity: int):
+        self.fixed = fixed
+        self.per_entity = per_entity
+
+    def allowed(self, size: Dict[str, int]) -> int:
+        return self.fixed + sum(count * size[entity] for entity, count in self.per_entity.items())
+
+
+class Endpoint:
+    """
+    A read endpoint and its query budget. `expected_failure` says why the endpoint doesn't meet its budget yet: its
+    violations are reported apart, and meeting the budget is one, so that the mark is dropped once it's fixed.
+    """
+
+    def __init__(self, name: str, url: str, budget: QueryBudget, params: dict = None, expected_failure: str = None):
+        self.name = name
+        self.url = url
+        self.budget = budget
+        self.params = params or {}
+        self.expected_failure = expected_failure
+
+
+ENDPOINTS = [
+    Endpoint('daily_reports_data', '/api/daily-reports-data/', QueryBudget(2),
+             expected_failure="N+1: two queries per zone and day of the week"),
+    Endpoint('overview_report_data', '/api/stats/overview', QueryBudget(10),
+             expected_failure="N+1: a query per zone and per day narrated, and per transmission line and month "
+                              "narrated"),
+    Endpoint('consumption_of_hours_ago', '/api/consumption-hours-ago/', QueryBudget(1), {'hours': 24},
+             expected_failure="N+1: a query per hour"),
+    Endpoint('MetersList', '/api/meters-list/', QueryBudget(1)),
+    Endpoint('ZonesList', '/api/zones/', QueryBudget(2)),
+    Endpoint('BulkMetersConsumption', '/api/bulk-meters-consumption/', QueryBudget(3),
+             expected_failure="N+1: the last two pulses of each bulk meter"),
+]
+
+
+def dataset_size(network: Network) -> Dict[str, int]:
+    size = network.size()
+    size['bulk_meters'] = sum(meter.meter_model.bulk_meter for meter in network.flow_meters)
+    return size
+
+
+def measure_endpoint(client: Client, endpoint: Endpoint, repeat=3) -> Dict:
+    """ Requests an endpoint `repeat` times, and reports the wall time, queries and bytes of its responses. """
+    timings, queries = [], []
+    counter = QueryCounter()
+    response = None
+    with connection.execute_wrapper(counter):
+        for _ in range(repeat):
+            counter.count = 0
+            started = time.perf_counter()
+            response = client.get(endpoint.url, endpoint.params)
+            timings.append(time.perf_counter() - started)
+            queries.append(counter.count)
+
+    timings_ms = np.array(timings) * 1000
+    return {
+        'status': response.status_code,
+        'wall_ms': {
+            'p50': round(float(np.percentile(timings_ms, 50)), 3),
+            'max': round(float(timings_ms.max()), 3),
+        },
+        'queries': max(queries),
+        'bytes': len(response.content),
+    }
+
+
+def run_endpoint_benchmark(sizes: Dict[str, dict] = None, endpoints: List[Endpoint] = None, repeat=3,
+                           seed=0) -> Dict:
+    """
+    Seeds a dataset of each of `sizes` and measures every endpoint against it. Each dataset is rolled back once
+    measured, so the database is left as it was.
+
+    :return: A JSON-serializable result: the measures of each endpoint at each size, the `violations`, the
+             endpoints that failed to respond or ran more queries than their budget, and the `expected_violations`,
+             those of endpoints marked as expected failures. Such an endpoint meeting its budget is a violation.
+    """
+    sizes = sizes or DATASET_SIZES
+    endpoints = endpoints or ENDPOINTS
+    result = {'benchmark': 'endpoints', 'started_at': dt.datetime.now(dt.timezone.utc).isoformat(),
+              'repeat': repeat, 'sizes': {}, 'violations': [], 'expected_violations': []}
+
+    client = Client()
+    for size_name, options in sizes.items():
+        with transaction.atomic():
+            network_options = {key: value for key, value in options.items() if key != 'days'}
+            started = time.perf_counter()
+            network = generate_network(seed=seed, **network_options)
+            seeded = seed_dataset(network, options['days'], seed=seed)
+            size = dataset_size(network)
+            measured = result['sizes'][size_name] = {
+                'dataset': {**size, 'days': options['days'], 'rows': seeded},
+                'seed_seconds': round(time.perf_counter() - started, 3),
+                'endpoints': {},
+            }
+
+            for endpoint in endpoints:
+                try:
+                    measures = measure_endpoint(client, endpoint, repeat)
+                except Exception as e:
+                    measures = {'status': None, 'error': f"{type(e).__name__}: {e}"}
+                measures['budget'] = endpoint.budget.allowed(size)
+                measures['expected_failure'] = endpoint.expected_failure
+                measured['endpoints'][endpoint.name] = measures
+
+                if measures['status'] != 200:
+                    result['violations'].append(
+                        f"{endpoint.name} ({size_name}): responded {measures.get('error', measures['status'])}")
+                elif measures['queries'] > measures['budget']:
+                    violations = result['expected_violations' if endpoint.expected_failure else 'violations']
+                    violations.append(f"{endpoint.name} ({size_name}): {measures['queries']} queries, "
+                                      f"over its budget of {measures['budget']}")
+                elif endpoint.expected_failure:
+                    result['violations'].append(
+                        f"{endpoint.name} ({size_name}): {measures['queries']} queries, within its budget of "
+                        f"{measures['budget']} though marked as an expected failure")
+            transaction.set_rollback(True)
+
+    return result
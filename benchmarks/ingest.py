@@ -0,0 +1,167 @@
+import datetime as dt
+import platform
+import subprocess
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List
+
+import django
+import numpy as np
+import pytz
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+
+from fl_meters.models import Pulse, PressurePulse, ChlorineSensorPulse
+from fl_meters.signals import on_flow_meter_pulse, on_pressure_transmitter_pulse, on_chlorine_sensor_pulse
+from .network import generate_network
+from .stream import pulse_stream, StreamFaults, FLOW, PRESSURE, CHLORINE, KINDS
+
+""" INGEST BENCHMARK """
+
+# `ingest` saves pulses alone, `analytics` saves them along with the analytics they trigger
+PATHS = ('ingest', 'analytics')
+
+PULSE_MODELS = {
+    FLOW: (Pulse, 'meter_id'),
+    PRESSURE: (PressurePulse, 'transmitter_id'),
+    CHLORINE: (ChlorineSensorPulse, 'sensor_id'),
+}
+ANALYTICS_RECEIVERS = {
+    Pulse: on_flow_meter_pulse,
+    PressurePulse: on_pressure_transmitter_pulse,
+    ChlorineSensorPulse: on_chlorine_sensor_pulse,
+}
+
+
+@contextmanager
+def analytics_disabled():
+    """ Saves pulses without running their analytics. """
+    for model, receiver in ANALYTICS_RECEIVERS.items():
+        post_save.disconnect(receiver, sender=model)
+    try:
+        yield
+    finally:
+        for model, receiver in ANALYTICS_RECEIVERS.items():
+            post_save.connect(receiver, sender=model)
+
+
+class QueryCounter:
+    """ Database execute wrapper counting the queries run through a connection. """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def save_pulse(row: Dict) -> None:
+    """ Saves a row of `pulse_stream` the way a single pulse is saved by the API, analytics included. """
+    model, device_field = PULSE_MODELS[row['kind']]
+    model(**{device_field: row['device_id'], 'time': row['time'], 'reading': row['reading']}).save()
+
+
+def summarize(latencies: List[float], queries: List[int], elapsed: float) -> Dict:
+    """ Summarizes per-pulse latencies, in seconds, and query counts. """
+    if not latencies:
+        return {'pulses': 0}
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'pulses': len(latencies),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'mean': round(float(latencies_ms.mean()), 3),
+            'p50': round(float(np.percentile(latencies_ms, 50)), 3),
+            'p99': round(float(np.percentile(latencies_ms, 99)), 3),
+            'max': round(float(latencies_ms.max()), 3),
+        },
+        'queries_per_pulse': {
+            'mean': round(float(np.mean(queries)), 2),
+            'p99': float(np.percentile(queries, 99)),
+            'max': int(np.max(queries)),
+        },
+    }
+
+
+def measure(rows: List[Dict]) -> Dict:
+    """
+    Saves the rows one at a time and measures each. A pulse whose save fails is counted as an error, by exception
+    type, and left out of the latencies.
+    """
+    latencies, queries = defaultdict(list), defaultdict(list)
+    errors = Counter()
+    counter = QueryCounter()
+    started = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        for row in rows:
+            counter.count = 0
+            pulse_started = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    save_pulse(row)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+                continue
+            latencies[row['kind']].append(time.perf_counter() - pulse_started)
+            queries[row['kind']].append(counter.count)
+    elapsed = time.perf_counter() - started
+
+    result = summarize([latency for kind in KINDS for latency in latencies[kind]],
+                       [count for kind in KINDS for count in queries[kind]], elapsed)
+    result['elapsed'] = round(elapsed, 3)
+    result['errors'] = dict(errors)
+    result['by_kind'] = {kind: summarize(latencies[kind], queries[kind], sum(latencies[kind]))
+                         for kind in KINDS if latencies[kind]}
+    return result
+
+
+def _revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_ingest_benchmark(zones=10, customers_per_zone=5, transmission_lines=2, pressure_per_zone=1,
+                         chlorine_per_zone=1, days=1, since=None, faults: StreamFaults = None, seed=0,
+                         paths=PATHS) -> Dict:
+    """
+    Generates a network and streams `days` of its pulses through each of `paths`. Every path runs against a network
+    of its own, rolled back once measured, so the database is left as it was.
+
+    :return: A JSON-serializable result: the parameters of the run, and the throughput, per-pulse latency and
+             queries per pulse of each path, overall and by kind of device.
+    """
+    since = since or dt.datetime(2020, 3, 1, tzinfo=pytz.utc)
+    faults = faults if faults is not None else StreamFaults()
+    network_options = {'zones': zones, 'customers_per_zone': customers_per_zone,
+                       'transmission_lines': transmission_lines, 'pressure_per_zone': pressure_per_zone,
+                       'chlorine_per_zone': chlorine_per_zone}
+
+    result = {
+        'benchmark': 'ingest',
+        'started_at': dt.datetime.now(pytz.utc).isoformat(),
+        'revision': _revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'parameters': {**network_options, 'days': days, 'since': since.isoformat(), 'seed': seed,
+                       'faults': faults.as_dict()},
+        'paths': {},
+    }
+
+    for path in paths:
+        with transaction.atomic():
+            network = generate_network(seed=seed, **network_options)
+            stats = Counter()
+            rows = list(pulse_stream(network, since, days * 96, faults, seed, stats))
+            with analytics_disabled() if path == 'ingest' else nullcontext():
+                measured = measure(rows)
+            result['paths'][path] = {'network': network.size(), 'faults': dict(stats), **measured}
+            transaction.set_rollback(True)
+
+    return result
+
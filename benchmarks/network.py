@@ -0,0 +1,81 @@
+import random
+from typing import List
+
+from django.db import transaction
+
+from fl_meters.models import Zone, Meter, MeterModel, TransmissionLine, Location, Customer, PressureTransmitter, \
+    TransmitterModel, ZoneHasPressureTransmitter, ChlorineSensor, DeviceModel
+
+""" SYNTHETIC NETWORKS """
+
+
+class Network:
+    """ The devices of a generated network, by kind. Readings of every device are simulated by `pulse_stream`. """
+
+    def __init__(self):
+        self.zones: List[Zone] = []
+        self.transmission_lines: List[TransmissionLine] = []
+        self.flow_meters: List[Meter] = []
+        self.pressure_transmitters: List[PressureTransmitter] = []
+        self.chlorine_sensors: List[ChlorineSensor] = []
+
+    def size(self) -> dict:
+        return {
+            'zones': len(self.zones),
+            'transmission_lines': len(self.transmission_lines),
+            'flow_meters': len(self.flow_meters),
+            'pressure_transmitters': len(self.pressure_transmitters),
+            'chlorine_sensors': len(self.chlorine_sensors),
+        }
+
+
+@transaction.atomic
+def generate_network(zones=10, customers_per_zone=5, transmission_lines=2, pressure_per_zone=1, chlorine_per_zone=1,
+                     digits=6, seed=0) -> Network:
+    """
+    Creates a utility network shaped like the ones in production: a chain of zones, each fed by the zone before it
+    through a boundary meter that is the input of one zone and the output of the other, the first zone fed by a
+    source meter. Every zone has customer meters, and pressure transmitters and chlorine sensors of its own.
+    Transmission lines stand apart, each with an input and an output meter.
+
+    :param digits: Digits of every meter, so readings roll over after `10 ** digits`.
+    """
+    rng = random.Random(seed)
+    network = Network()
+    meter_model = MeterModel.objects.create(manufacturer='Benchmark', model_number='BM-1', digits=digits)
+    customer_model = MeterModel.objects.create(manufacturer='Benchmark', model_number='CM-1', digits=digits,
+                                               bulk_meter=False)
+    transmitter_model = TransmitterModel.objects.create(manufacturer='Benchmark', model_number='BP-1')
+    sensor_model = DeviceModel.objects.create(manufacturer='Benchmark', model_number='BC-1', description='')
+
+    previous_zone = None
+    for idx in range(zones):
+        zone = Zone.objects.create(name=f"zone-{idx}")
+        network.zones.append(zone)
+        # the first zone is fed by the source; every other zone by the zone before it, like `mtr2` in the tests
+        network.flow_meters.append(Meter.objects.create(meter_model=meter_model, input_for=zone,
+                                                        output_for=previous_zone))
+        previous_zone = zone
+
+        for _ in range(customers_per_zone):
+            location = Location.objects.create(description=f"{zone.name} customer", zone=zone)
+            meter = Meter.objects.create(meter_model=customer_model, location=location)
+            Customer.objects.create(meter=meter, name=f"customer-{meter.id}", customer_type=rng.choice([2, 3, 4]))
+            network.flow_meters.append(meter)
+
+        for _ in range(pressure_per_zone):
+            transmitter = PressureTransmitter.objects.create(meter_model=transmitter_model)
+            ZoneHasPressureTransmitter.objects.create(zone=zone, transmitter=transmitter, use_for_azp=True)
+            network.pressure_transmitters.append(transmitter)
+
+        for _ in range(chlorine_per_zone):
+            location = Location.objects.create(description=f"{zone.name} chlorine", zone=zone)
+            network.chlorine_sensors.append(ChlorineSensor.objects.create(model=sensor_model, location=location))
+
+    for _ in range(transmission_lines):
+        line = TransmissionLine.objects.create(volume=rng.randint(50, 500))
+        network.transmission_lines.append(line)
+        network.flow_meters.append(Meter.objects.create(meter_model=meter_model, tsm_input=line))
+        network.flow_meters.append(Meter.objects.create(meter_model=meter_model, tsm_output=line))
+
+    return network
@@ -0,0 +1,101 @@
+import datetime as dt
+import heapq
+import random
+from collections import Counter
+from decimal import Decimal
+from typing import Dict, Iterator, List
+
+from .network import Network
+
+""" PULSE STREAMS """
+
+FLOW, PRESSURE, CHLORINE = 'flow', 'pressure', 'chlorine'
+KINDS = (FLOW, PRESSURE, CHLORINE)
+
+INTERVAL = dt.timedelta(minutes=15)
+
+
+class StreamFaults:
+    """
+    Rates at which the readings of a stream go wrong, each the probability of a single reading being affected.
+
+    :param missing: The reading is never sent.
+    :param duplicated: The reading is sent twice in a row.
+    :param late: The reading arrives up to `max_delay` intervals after it was taken.
+    :param out_of_order: The reading arrives just before the previous reading of its device.
+    """
+
+    def __init__(self, missing=0.01, duplicated=0.005, late=0.01, out_of_order=0.005, max_delay=8):
+        self.missing = missing
+        self.duplicated = duplicated
+        self.late = late
+        self.out_of_order = out_of_order
+        self.max_delay = max_delay
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def _device_readings(kind, rng: random.Random, digits: int):
+    """ Yields the successive readings of a device: meter indexes that roll over, or levels around a mean. """
+    if kind == FLOW:
+        modulo = 10 ** digits
+        reading = rng.randrange(modulo)
+        rate = rng.uniform(0.5, 30)  # average consumption per interval
+        while True:
+            yield str(reading)
+            reading = (reading + max(0, round(rng.gauss(rate, rate / 3)))) % modulo
+    else:
+        mean, spread = (45, 8) if kind == PRESSURE else (Decimal('0.8'), Decimal('0.2'))
+        while True:
+            yield str(round(Decimal(rng.gauss(float(mean), float(spread))), 3))
+
+
+def pulse_stream(network: Network, since: dt.datetime, intervals: int, faults: StreamFaults = None, seed=0,
+                 stats: Counter = None) -> Iterator[Dict]:
+    """
+    Yields the pulses every device of a network sends over `intervals` quarters of an hour from `since`, in the
+    order they arrive rather than the order they were taken in, with `faults` injected.
+
+    :param stats: Counter the number of readings affected by each fault is added to.
+    :return: Rows with the `kind` of device, its `device_id`, and the `time` and `reading` of the pulse.
+    """
+    faults = faults if faults is not None else StreamFaults()
+    stats = stats if stats is not None else Counter()
+    rng = random.Random(seed)
+    devices = [(FLOW, meter.id, meter.meter_model.digits) for meter in network.flow_meters] + \
+              [(PRESSURE, transmitter.id, None) for transmitter in network.pressure_transmitters] + \
+              [(CHLORINE, sensor.id, None) for sensor in network.chlorine_sensors]
+    readings = [_device_readings(kind, random.Random(rng.random()), digits) for kind, _, digits in devices]
+
+    # pulses wait in a heap ordered by arrival, and are sent an interval after it, once the pulses that overtake them
+    # have been queued too
+    arriving: List[tuple] = []
+    sequence = 0
+    for interval in range(intervals):
+        time = since + interval * INTERVAL
+        for (kind, device_id, _), device_readings in zip(devices, readings):
+            row = {'kind': kind, 'device_id': device_id, 'time': time, 'reading': next(device_readings)}
+            arrival, order = time, 0
+            draw = rng.random()
+            if draw < faults.missing:
+                stats['missing'] += 1
+                continue
+            draw -= faults.missing
+            if draw < faults.late:
+                stats['late'] += 1
+                arrival += rng.randint(1, faults.max_delay) * INTERVAL
+            elif draw - faults.late < faults.out_of_order:
+                stats['out_of_order'] += 1
+                arrival, order = time - INTERVAL, -1  # overtakes the previous reading, unless that one is late
+            copies = 2 if rng.random() < faults.duplicated else 1
+            stats['duplicated'] += copies - 1
+            for _ in range(copies):
+                sequence += 1
+                heapq.heappush(arriving, (arrival, order, sequence, row))
+
+        while arriving and arriving[0][0] <= time - INTERVAL:
+            yield heapq.heappop(arriving)[-1]
+
+    while arriving:
+        yield heapq.heappop(arriving)[-1]
@@ -10,6 +10,7 @@
     path('reports/daily', views.daily_reports, name="daily_reports"),
     path('reports/monthly', views.monthly_reports, name="monthly_reports"),
     path('reports/overview', views.overview_reports, name='reports_overview'),
+    path('reports/water-balance', views.water_balance_reports, name='water_balance_reports'),
 
     path('viewmodel', views.DashboardJson.as_view(), name="viewmodel"),
 
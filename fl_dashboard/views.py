@@ -11,6 +11,7 @@
 
 from fl_meters.models import Zone, LossRecord, Notification
 from fl_meters.tools import get_day_opening, get_day_start
+from fl_meters.water_balance import water_balance
 from . import models
 from .tools import *
 
@@ -69,19 +70,11 @@ def daily_reports(request):
 @login_required
 def monthly_reports(request):
     today = get_now()
-    from datetime import datetime
-    beginning_of_month = datetime(today.year, today.month, 1).replace(tzinfo=utc)
-
-    month_consumption = 1  # prevents division by zero exception in new systems
-    month_nrw = 0
-    all_zones = Zone.objects.all()
-    for zone in all_zones:
-        month_record = MonthlyZoneConsumption.objects.filter(zone_id=zone, date=beginning_of_month).first()
-        month_consumption += month_record.consumption if month_record is not None else 0
-        month_nrw += reduce(
-            lambda acc, record: record.amount + acc,
-            LossRecord.objects.filter(zone=zone, date__gte=beginning_of_month),
-            0)
+    balance = water_balance(today.date(), today.date())['total']
+
+    month_consumption = balance['system_input'] or 1  # prevents division by zero exception in new systems
+    # until the month is billed, only real losses are known
+    month_nrw = balance['non_revenue_water'] if balance['non_revenue_water'] is not None else balance['real_losses']
 
     context = {
         'month_consumption': round(month_consumption, 2),
@@ -93,6 +86,16 @@ def monthly_reports(request):
     }
     return render(request, template_name='fl_dashboard/dashboard/monthly_reports.html', context=context)
 
+@login_required
+def water_balance_reports(request):
+    today = get_now()
+    context = {
+        'year': today.year,
+        'month': today.month,
+        'list_of_months': list(range(1, 13))
+    }
+    return render(request, template_name='fl_dashboard/dashboard/reports/water_balance.html', context=context)
+
 @login_required
 def alerts(request):
     Notification.objects.filter(user=request.user).delete()
@@ -93,6 +93,14 @@ class MeterModelAdmin(admin.ModelAdmin):
 admin.site.register(models.MonthlyTSMLossRecord)
 admin.site.register(models.YearlyTSMLossRecord)
 
+admin.site.register(models.QuarterHourlyMeterConsumption)
+admin.site.register(models.DailyMeterConsumption)
+admin.site.register(models.MonthlyMeterConsumption)
+admin.site.register(models.MeterFlowRate)
+admin.site.register(models.HourlyMeterFlowRate)
+admin.site.register(models.DailyMeterFlowRate)
+
+
 class ZoneCoordinatesInline(admin.TabularInline):
     model = models.ZoneCoordinate
     template = 'admin/zone_inline.html'
@@ -156,3 +164,25 @@ class PressurePulseAdmin(admin.ModelAdmin):
 
 
 admin.site.register(models.TransmitterModel)
+
+
+@admin.register(models.Annotation)
+class AnnotationAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'metric', 'entity_id', 'kind', 'since', 'until']
+    list_filter = ('metric', 'kind')
+
+
+@admin.register(models.SlowRequest)
+class SlowRequestAdmin(admin.ModelAdmin):
+    list_display = ['endpoint', 'method', 'status', 'duration_ms', 'db_ms', 'queries', 'duplicated_queries',
+                    'recorded_at']
+    list_filter = ('method', 'status')
+    search_fields = ('endpoint', 'path')
+    readonly_fields = ['endpoint', 'method', 'path', 'status', 'duration_ms', 'db_ms', 'queries',
+                       'duplicated_queries', 'duplicates', 'recorded_at']
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.register(models.WaterBalanceRevision)
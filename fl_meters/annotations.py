@@ -0,0 +1,48 @@
+import datetime as dt
+from typing import Dict, List
+
+from django.conf import settings
+
+from .models import Annotation, ANNOTATION_TYPES
+
+""" SERIES ANNOTATIONS """
+
+ANNOTATION_KINDS = dict(ANNOTATION_TYPES)
+
+
+def add_annotation(metric: int, entity_id: int, kind: int, since: dt.datetime, until: dt.datetime,
+                   description='', value=None) -> Annotation:
+    """
+    Annotates the points of an entity's series from `since` to `until`. Annotations of the same kind and value that
+    overlap the range, or are a single period away from it, are merged into one, so a run of points is always
+    stored as a single range.
+    """
+    step = dt.timedelta(minutes=settings.RIE)
+    touching = list(Annotation.objects.filter(metric=metric, entity_id=entity_id, kind=kind, value=value,
+                                              since__lte=until + step, until__gte=since - step).order_by('since'))
+    if not touching:
+        return Annotation.objects.create(metric=metric, entity_id=entity_id, kind=kind, since=since, until=until,
+                                         description=description, value=value)
+
+    annotation, *merged = touching
+    annotation.since = min(since, annotation.since)
+    annotation.until = max(until, *(other.until for other in touching))
+    annotation.save(update_fields=['since', 'until'])
+    if merged:
+        Annotation.objects.filter(id__in=[other.id for other in merged]).delete()
+    return annotation
+
+
+def annotations_of(metric: int, since: dt.datetime, until: dt.datetime, entity_ids: List[int] = None,
+                   exclude_entity_ids: List[int] = None) -> List[Dict]:
+    """
+    Returns the annotations of a metric overlapping a time range, of the given entities, or of all of them but the
+    excluded ones, in a single query on the `(metric, until, entity_id)` index.
+    """
+    annotations = Annotation.objects.filter(metric=metric, until__gte=since, since__lte=until)
+    if entity_ids is not None:
+        annotations = annotations.filter(entity_id__in=entity_ids)
+    if exclude_entity_ids:
+        annotations = annotations.exclude(entity_id__in=exclude_entity_ids)
+    return [{**annotation, 'kind': ANNOTATION_KINDS[annotation['kind']]} for annotation in annotations
+            .order_by('since', 'id').values('entity_id', 'kind', 'since', 'until', 'value', 'description')]
@@ -0,0 +1,74 @@
+import datetime as dt
+from typing import Dict, Iterator, Tuple
+
+import pytz
+from django.db import transaction
+from django.db.models import F, Window, CharField
+from django.db.models.functions import Cast, Coalesce, FirstValue
+
+from .models import Pulse, MonthlyZoneConsumption
+from .tools import consumption_between_readings
+from .water_balance import revise_months
+
+""" MONTHLY BILLING """
+
+BILLING_COLUMNS = ['meter_id', 'meter_key', 'customer_name', 'zone_id', 'first_reading', 'last_reading',
+                   'consumption']
+
+
+def billing_period(month: dt.date) -> Tuple[dt.datetime, dt.datetime]:
+    """ Returns the times of the pulses opening and closing a month: midnight of its first day and of the next's. """
+    since = dt.datetime.combine(month.replace(day=1), dt.time(), tzinfo=pytz.utc)
+    until = (since + dt.timedelta(days=32)).replace(day=1)
+    return since, until
+
+
+def billing_rows(month: dt.date, zone_totals: Dict[int, object] = None) -> Iterator[tuple]:
+    """
+    Yields the consumption of every customer meter over a month, in `BILLING_COLUMNS` order.
+
+    The first and last readings of each meter within the month come from a single query: window functions pick them
+    out in the database, so one row per meter is fetched, however many pulses the month holds. A meter whose last
+    reading is lower than its first is taken to have rolled over once, or back-flowed if its `max_flow_rate` can't
+    have registered that much between the two.
+
+    :param zone_totals: Dict the consumption of each meter is added to, under the id of the zone the meter is in.
+    """
+    since, until = billing_period(month)
+    by_meter = {'partition_by': [F('meter_id')]}
+    # pulses saved before readings were stored as numbers might not be backfilled yet. Readings are windowed as text:
+    # Django 2.2 wraps decimal window functions in a CAST that SQLite rejects
+    reading = Coalesce(Cast('raw_reading', CharField()), 'reading')
+    rows = Pulse.objects.filter(meter__customer__isnull=False, time__gte=since, time__lte=until)\
+        .annotate(first_reading=Window(FirstValue(reading), order_by=F('time').asc(), **by_meter),
+                  last_reading=Window(FirstValue(reading), order_by=F('time').desc(), **by_meter),
+                  first_time=Window(FirstValue('time'), order_by=F('time').asc(), **by_meter),
+                  last_time=Window(FirstValue('time'), order_by=F('time').desc(), **by_meter),
+                  zone_id=Coalesce('meter__location__zone_id', 'meter__input_for_id'))\
+        .values_list('meter_id', 'meter__key', 'meter__customer__name', 'zone_id', 'first_reading', 'last_reading',
+                     'first_time', 'last_time', 'meter__meter_model__digits', 'meter__meter_model__max_flow_rate',
+                     'meter__reading_factor')\
+        .distinct().order_by('meter_id')
+
+    for meter_id, key, customer, zone_id, first_reading, last_reading, first_time, last_time, digits, max_rate, \
+            factor in rows.iterator():
+        consumption = consumption_between_readings(first_reading, last_reading, digits, factor,
+                                                   (last_time - first_time).total_seconds(), max_rate)
+        if zone_totals is not None and zone_id is not None:
+            zone_totals[zone_id] += consumption
+        yield meter_id, key, customer, zone_id, first_reading, last_reading, consumption
+
+
+def save_billed_consumption(month: dt.date, zone_totals: Dict[int, object]) -> None:
+    """ Sets the `billed_consumption` of the zones' monthly consumption records, creating those that are missing. """
+    month = month.replace(day=1)
+    with transaction.atomic():
+        records = {record.zone_id_id: record for record in MonthlyZoneConsumption.objects.select_for_update()
+                   .filter(date=month, zone_id_id__in=zone_totals)}
+        for record in records.values():
+            record.billed_consumption = zone_totals[record.zone_id_id]
+        MonthlyZoneConsumption.objects.bulk_update(records.values(), ['billed_consumption'])
+        MonthlyZoneConsumption.objects.bulk_create(
+            MonthlyZoneConsumption(zone_id_id=zone_id, date=month, billed_consumption=total)
+            for zone_id, total in zone_totals.items() if zone_id not in records)
+        revise_months([month])
@@ -0,0 +1,129 @@
+import atexit
+import base64
+import glob
+import gzip
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterator, List
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+lg = logging.getLogger(__name__)
+
+""" INGEST TRAFFIC CAPTURE """
+
+# Requests are captured as gzipped JSON lines, one per request: its arrival time `t` (unix seconds), `method`, `path`,
+# `query` string, `content_type`, base64 `body`, and the `status` it was answered with. Credentials aren't captured.
+
+
+class CaptureWriter:
+    """
+    Appends captured requests to a gzip file, starting a new file once the current one holds `max_bytes` or is
+    `rotate_seconds` old, and removing the oldest files beyond `keep`. Safe to share between threads.
+
+    Compressed data is flushed to the file every `flush_seconds`, so a capture is readable while it's being written,
+    and a crash loses no more than that.
+    """
+
+    def __init__(self, directory=None, max_bytes=None, rotate_seconds=None, keep=None, flush_seconds=None):
+        self.directory = directory or settings.INGEST_CAPTURE_DIR
+        self.max_bytes = max_bytes or settings.INGEST_CAPTURE_MAX_BYTES
+        self.rotate_seconds = rotate_seconds or settings.INGEST_CAPTURE_ROTATE_SECONDS
+        self.keep = keep or settings.INGEST_CAPTURE_KEEP_FILES
+        self.flush_seconds = settings.INGEST_CAPTURE_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.path = None
+        self._file = None
+        self._opened_at = self._flushed_at = 0
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict) -> None:
+        line = (json.dumps(record, separators=(',', ':')) + "\n").encode()
+        with self._lock:
+            if self._file is None or self._file.fileobj.tell() >= self.max_bytes or \
+                    time.monotonic() - self._opened_at >= self.rotate_seconds:
+                self._rotate()
+            self._file.write(line)
+            if time.monotonic() - self._flushed_at >= self.flush_seconds:
+                self._file.flush()
+                self._flushed_at = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        # files sort by the time they were started at, whichever process wrote them
+        self.path = os.path.join(self.directory, f"capture-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.gz")
+        self._file = gzip.open(self.path, 'ab')
+        self._opened_at = time.monotonic()
+        for path in list_captures(self.directory)[:-self.keep]:
+            os.remove(path)
+
+
+def list_captures(directory) -> List[str]:
+    """ Returns the capture files of a directory, oldest first. """
+    return sorted(glob.glob(os.path.join(directory, "capture-*.gz")))
+
+
+def read_captures(paths: List[str]) -> Iterator[Dict]:
+    """
+    Yields the requests captured in the files, in the order they arrived in, across files. A file cut short by a
+    crash is read up to where it was cut.
+    """
+    def read(path):
+        try:
+            with gzip.open(path, 'rt') as file:
+                for line in file:
+                    if line.endswith("\n"):
+                        yield json.loads(line)
+        except (EOFError, OSError):
+            lg.warning(f"capture file {path} is truncated, replaying what's readable")
+
+    return heapq.merge(*map(read, paths), key=lambda record: record['t'])
+
+
+class IngestCaptureMiddleware:
+    """
+    Captures requests to the ingest endpoints in `INGEST_CAPTURE_PATHS`, see `CaptureWriter`. Unused unless
+    `INGEST_CAPTURE` is on. Captures can be replayed with the `replay_ingest` management command.
+    """
+
+    def __init__(self, get_response):
+        if not settings.INGEST_CAPTURE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.paths = tuple(settings.INGEST_CAPTURE_PATHS)
+        self.writer = CaptureWriter()
+        atexit.register(self.writer.close)
+
+    def __call__(self, request):
+        if request.method != 'POST' or not request.path.startswith(self.paths):
+            return self.get_response(request)
+
+        arrived = time.time()
+        body = request.body  # read before the view consumes the stream
+        response = self.get_response(request)
+        try:
+            self.writer.write({
+                't': arrived,
+                'method': request.method,
+                'path': request.path,
+                'query': request.META.get('QUERY_STRING', ''),
+                'content_type': request.content_type,
+                'body': base64.b64encode(body).decode('ascii'),
+                'status': response.status_code,
+            })
+        except OSError:
+            lg.exception("failed to capture an ingest request")
+        return response
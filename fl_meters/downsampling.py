@@ -0,0 +1,93 @@
+from collections import defaultdict
+from operator import itemgetter
+
+import numpy as np
+
+""" SERIES DOWNSAMPLING """
+
+METHODS = ('lttb', 'minmax')
+
+
+def lttb_indices(t: np.ndarray, v: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: keeps the first and last points, and from each of `max_points - 2` equal buckets
+    in between, the point forming the largest triangle with the point kept from the previous bucket and the average
+    of the next bucket. Keeps the visual shape of a series, spikes included, with few points.
+
+    :return: The indices of the kept points, in ascending order.
+    """
+    n = len(t)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    v = np.nan_to_num(v)  # gaps don't weigh in the choice of points
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    # average of each bucket, computed at once; the bucket after the last one is the last point
+    sums_t, sums_v = np.add.reduceat(t[1:n - 1], edges[:-1] - 1), np.add.reduceat(v[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_t = np.append(sums_t / counts, t[-1])
+    avg_v = np.append(sums_v / counts, v[-1])
+
+    kept = np.empty(max_points, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # twice the area of the triangles formed with the previous point and the next bucket's average
+        areas = np.abs((t[previous] - avg_t[bucket + 1]) * (v[start:end] - v[previous]) -
+                       (t[previous] - t[start:end]) * (avg_v[bucket + 1] - v[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def min_max_indices(v: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Keeps the lowest and highest point of each of `max_points / 2` equal buckets, so no extreme value is lost.
+
+    :return: The indices of the kept points, in ascending order.
+    """
+    n = len(v)
+    if max_points >= n or max_points < 2:
+        return np.arange(n)
+
+    buckets = np.arange(n) * (max_points // 2) // n
+    # sorting by bucket then value puts each bucket's minimum first and its maximum last
+    by_min = np.lexsort((np.where(np.isnan(v), np.inf, v), buckets))
+    by_max = np.lexsort((np.where(np.isnan(v), -np.inf, v), buckets))
+    firsts = np.flatnonzero(np.diff(buckets[by_min], prepend=-1))
+    lasts = np.append(firsts[1:] - 1, n - 1)
+    return np.unique(np.concatenate([by_min[firsts], by_max[lasts]]))
+
+
+def downsample_indices(t, v, max_points: int, method='lttb') -> np.ndarray:
+    """ Returns the ascending indices of the points of `(t, v)` kept by `method`, one of `METHODS`. """
+    t = np.asarray(t, dtype=np.float64)
+    v = np.array([np.nan if value is None else float(value) for value in v], dtype=np.float64)
+    if method == 'minmax':
+        return min_max_indices(v, max_points)
+    return lttb_indices(t, v, max_points)
+
+
+def downsample_rows(rows: list, max_points: int, method='lttb', time=itemgetter(0), value=itemgetter(1),
+                    series=None, keep=None) -> list:
+    """
+    Downsamples the rows of every series to at most about `max_points` rows each, keeping them in their order.
+    Rows `keep` is true of, such as anomalies, are kept on top of those.
+
+    :param rows: Rows sorted by time within each series.
+    :param time: Returns the epoch seconds of a row.
+    :param value: Returns the value of a row.
+    :param series: Returns the series a row belongs to. All rows are a single series by default.
+    :param keep: Returns whether a row must be kept.
+    """
+    groups = defaultdict(list)
+    for idx, row in enumerate(rows):
+        groups[series(row) if series else None].append(idx)
+
+    kept_rows = set()
+    for group in groups.values():
+        kept = downsample_indices([time(rows[idx]) for idx in group], [value(rows[idx]) for idx in group],
+                                  max_points, method)
+        kept_rows.update(group[idx] for idx in kept)
+    return [row for idx, row in enumerate(rows) if idx in kept_rows or (keep is not None and keep(row))]
@@ -0,0 +1,256 @@
+import asyncio
+import functools
+import logging
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .ingest import decode_pulse_frame, insert_pulses, get_pulse_writer
+from .models import MeterToken
+
+lg = logging.getLogger(__name__)
+
+""" INGEST GATEWAY """
+
+# Over TCP, every message is prefixed with its length. A device opens a connection by sending its token, then sends
+# pulse frames (see `ingest.decode_pulse_frame`); the gateway answers every message with a single status byte.
+# Over UDP, every datagram is a token followed by a pulse frame, and is answered the same way.
+MESSAGE_LENGTH = struct.Struct('<H')
+TOKEN_LENGTH = 40
+
+OK = b'\x00'
+DENIED = b'\x01'
+MALFORMED = b'\x02'
+FOREIGN_METER = b'\x03'
+RETRY_LATER = b'\x04'
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    length, = MESSAGE_LENGTH.unpack(await reader.readexactly(MESSAGE_LENGTH.size))
+    return await reader.readexactly(length)
+
+
+def pack_message(payload: bytes) -> bytes:
+    return MESSAGE_LENGTH.pack(len(payload)) + payload
+
+
+def _in_db_thread(fn, *args):
+    # connections broken by a database restart are replaced instead of failing every following batch
+    close_old_connections()
+    return fn(*args)
+
+
+class IngestGateway:
+    """
+    Receives pulse frames from long-lived device connections and saves them in batches.
+
+    Frames from all connections are queued, and saved every `batch_size` pulses or `flush_interval` milliseconds
+    by a single database thread. A frame is acknowledged once its batch is saved. When the database lags, the queue
+    fills up and connections stop being read until it drains, which pushes back on devices through TCP flow
+    control; UDP datagrams are answered with `RETRY_LATER` instead, as are datagrams arriving while
+    `max_datagrams` are already being handled.
+
+    Tokens are looked up once per `token_ttl` seconds, whether they belong to a meter or not, so a revoked token
+    stops being accepted within it and unknown tokens don't each cost a query. Connections that don't send their
+    token within `auth_timeout` seconds, or whose token can't be looked up, are closed.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, max_pending=None, token_ttl=None, max_datagrams=None,
+                 auth_timeout=None):
+        self.batch_size = batch_size or settings.INGEST_BATCH_SIZE
+        self.flush_interval = (flush_interval or settings.INGEST_FLUSH_INTERVAL_MS) / 1000
+        self.max_pending = max_pending or settings.INGEST_GATEWAY_MAX_PENDING_FRAMES
+        self.token_ttl = token_ttl if token_ttl is not None else settings.INGEST_GATEWAY_TOKEN_TTL
+        self.max_datagrams = max_datagrams or settings.INGEST_GATEWAY_MAX_DATAGRAMS
+        self.auth_timeout = auth_timeout or settings.INGEST_GATEWAY_AUTH_TIMEOUT
+        self.connections = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gateway-db")
+        # the meter of each token looked up, None if it has none, and when the lookup expires
+        self._meters_by_token: Dict[str, Tuple[Optional[int], float]] = {}
+        self._tokens_pruned_at = 0
+        self._datagrams_in_flight = 0
+        self._pending: Optional[asyncio.Queue] = None
+        self._batcher = None
+        self._servers = []
+
+    async def start(self, host, port, udp_port=None):
+        self._pending = asyncio.Queue(maxsize=self.max_pending)
+        self._batcher = asyncio.ensure_future(self._save_batches())
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        self._servers.append(server)
+        if udp_port is not None:
+            transport, _ = await asyncio.get_event_loop().create_datagram_endpoint(
+                lambda: _DatagramProtocol(self), local_addr=(host, udp_port))
+            self._servers.append(transport)
+        return server
+
+    async def close(self):
+        for server in self._servers:
+            server.close()
+        self._batcher.cancel()
+        self._executor.shutdown()
+
+    async def _run_in_db_thread(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor, functools.partial(_in_db_thread, fn, *args))
+
+    async def authenticate(self, token: str) -> Optional[int]:
+        """ Returns the id of the meter a token belongs to, or None. """
+        now = asyncio.get_event_loop().time()
+        meter_id, expires_at = self._meters_by_token.get(token, (None, 0))
+        if expires_at <= now:
+            meter_id = await self._run_in_db_thread(
+                lambda: MeterToken.objects.filter(key=token).values_list('user_id', flat=True).first())
+            self._prune_tokens(now)
+            self._meters_by_token[token] = meter_id, now + self.token_ttl
+        return meter_id
+
+    def _prune_tokens(self, now: float):
+        # expired lookups are dropped once per TTL, so tokens sprayed by unknown devices don't pile up
+        if now - self._tokens_pruned_at >= self.token_ttl:
+            self._meters_by_token = {token: lookup for token, lookup in self._meters_by_token.items()
+                                     if lookup[1] > now}
+            self._tokens_pruned_at = now
+
+    async def ingest(self, frame: bytes, meter_id: int, wait=True) -> bytes:
+        """
+        Queues the pulses of a frame sent by `meter_id` and waits for them to be saved.
+
+        :param wait: Wait for room in the queue when it's full, instead of answering `RETRY_LATER`.
+        :return: The status byte to answer the device with.
+        """
+        try:
+            pulses = decode_pulse_frame(frame)
+        except ValueError:
+            return MALFORMED
+        if pulses[0]['meter_id'] != meter_id:
+            return FOREIGN_METER
+
+        saved = asyncio.get_event_loop().create_future()
+        try:
+            if wait:
+                await self._pending.put((pulses, saved))
+            else:
+                self._pending.put_nowait((pulses, saved))
+            await saved
+        except Exception:  # the queue is full, or the batch failed to save
+            return RETRY_LATER
+        return OK
+
+    async def _save_batches(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self._pending.get()]
+            count = len(batch[0][0])
+            deadline = loop.time() + self.flush_interval
+            while count < self.batch_size and loop.time() < deadline:
+                try:
+                    batch.append(await asyncio.wait_for(self._pending.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                count += len(batch[-1][0])
+
+            try:
+                await self._run_in_db_thread(_save_pulses, [pulse for pulses, _ in batch for pulse in pulses])
+            except Exception as e:
+                lg.exception(f"failed to save a batch of {count} pulses")
+                for _, saved in batch:
+                    saved.set_exception(e)
+            else:
+                for _, saved in batch:
+                    saved.set_result(None)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            try:
+                token = await asyncio.wait_for(read_message(reader), self.auth_timeout)
+            except asyncio.TimeoutError:
+                lg.info(f"hanging up on a device that sent no token in {self.auth_timeout}s")
+                return
+            try:
+                meter_id = await self.authenticate(token.decode('ascii', errors='replace'))
+            except Exception:
+                lg.exception("failed to look up the token of a device connection")
+                writer.write(RETRY_LATER)
+                return
+            if meter_id is None:
+                writer.write(DENIED)
+                return
+            writer.write(OK)
+
+            while True:
+                frame = await read_message(reader)
+                writer.write(await self.ingest(frame, meter_id))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # the device hung up
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    def receive_datagram(self, datagram: bytes, address, transport: asyncio.DatagramTransport):
+        """ Handles a datagram in a task of its own, or answers `RETRY_LATER` if `max_datagrams` are in flight. """
+        # datagrams are all received on the event loop, so the count needs no lock
+        if self._datagrams_in_flight >= self.max_datagrams:
+            transport.sendto(RETRY_LATER, address)
+            return
+        self._datagrams_in_flight += 1
+        asyncio.ensure_future(self._handle_datagram(datagram, address, transport))
+
+    async def _handle_datagram(self, datagram: bytes, address, transport: asyncio.DatagramTransport):
+        try:
+            token, frame = datagram[:TOKEN_LENGTH], datagram[TOKEN_LENGTH:]
+            try:
+                meter_id = await self.authenticate(token.decode('ascii', errors='replace'))
+            except Exception:
+                lg.exception("failed to look up the token of a datagram")
+                transport.sendto(RETRY_LATER, address)
+                return
+            status = DENIED if meter_id is None else await self.ingest(frame, meter_id, wait=False)
+            transport.sendto(status, address)
+        finally:
+            self._datagrams_in_flight -= 1
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, gateway: IngestGateway):
+        self.gateway = gateway
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self.gateway.receive_datagram(data, address, self.transport)
+
+
+def _save_pulses(pulses: List[Dict]):
+    if settings.INGEST_WRITE_BEHIND:
+        get_pulse_writer().submit_many(pulses)
+    else:
+        insert_pulses(pulses)
+
+
+""" SIMULATED DEVICES """
+
+
+async def simulate_device(host, port, token: str, frames: List[bytes]) -> List[bytes]:
+    """ Connects to a gateway as a device, sends `frames` one after the other and returns the status of each. """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(pack_message(token.encode('ascii')))
+        status = await reader.readexactly(1)
+        if status != OK:
+            return [status]
+        statuses = []
+        for frame in frames:
+            writer.write(pack_message(frame))
+            statuses.append(await reader.readexactly(1))
+        return statuses
+    finally:
+        writer.close()
@@ -0,0 +1,290 @@
+import atexit
+import datetime as dt
+import fcntl
+import glob
+import itertools
+import json
+import logging
+import os
+import struct
+import threading
+from typing import Dict, List
+
+import pytz
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.utils.dateparse import parse_datetime
+
+from .models import Meter, Pulse
+from .rollups import ZONE_CONSUMPTION, METER_CONSUMPTION, METER_FLOW, batched
+from .spool import Spool, list_segments, read_segment
+
+lg = logging.getLogger(__name__)
+
+""" BATCH INSERTS """
+
+
+def insert_pulses(rows: List[Dict], skip_existing=False) -> List[Pulse]:
+    """
+    Saves flow pulses in time order within a single transaction, so a batch costs one commit. Rows of unknown
+    meters are dropped.
+
+    Pulses are still inserted one at a time: the analytics of a pulse look for the latest pulses before it, so
+    a pulse must not be visible before the analytics of the ones preceding it have run. Their consumption and flow
+    rollups are written once per zone and meter at the end of the batch though, see `batched`. When its analytics
+    fail, a pulse is kept without them, the same way it is when saved on its own. A pulse the database refuses even
+    without its analytics is moved to the dead-letter file, see `dead_letter`, so it doesn't hold up its batch.
+
+    :param rows: Dicts with a `meter_id`, an aware `time` and a `reading`.
+    :param skip_existing: Drop rows whose meter already has a pulse at the same time. Used when replaying spooled
+                          rows that might have been committed already.
+    :return: The saved pulses.
+    """
+    meters = Meter.objects.in_bulk({row['meter_id'] for row in rows})
+    pulses = []
+    for row in sorted(rows, key=lambda row: row['time']):
+        meter = meters.get(row['meter_id'])
+        if meter is None:
+            lg.warning(f"dropping pulse of unknown meter ID:{row['meter_id']} at {row['time']}")
+            continue
+        pulses.append(Pulse(meter=meter, time=row['time'], reading=row['reading']))
+
+    if skip_existing and pulses:
+        existing = set(Pulse.objects.filter(
+            meter_id__in=meters, time__range=(pulses[0].time, pulses[-1].time)).values_list('meter_id', 'time'))
+        pulses = [pulse for pulse in pulses if (pulse.meter_id, pulse.time) not in existing]
+
+    saved = []
+    with transaction.atomic(), batched(ZONE_CONSUMPTION, METER_CONSUMPTION, METER_FLOW) as batch:
+        for pulse in pulses:
+            try:
+                with batch.atomic():
+                    pulse.save()
+            except Exception:
+                lg.exception(f"analytics failed for pulse of meter ID:{pulse.meter_id} at {pulse.time}")
+                pulse.pk = None
+                try:
+                    with transaction.atomic():
+                        Pulse.objects.bulk_create([pulse])
+                except Exception as error:
+                    dead_letter(pulse, error)
+                    continue
+            saved.append(pulse)
+
+    return saved
+
+
+def dead_letter(pulse: Pulse, error: Exception) -> None:
+    """ Appends a pulse the database refused to `INGEST_DEAD_LETTER_FILE`, with the error it was refused with. """
+    lg.error(f"dead-lettering pulse of meter ID:{pulse.meter_id} at {pulse.time}: {error!r}")
+    os.makedirs(os.path.dirname(settings.INGEST_DEAD_LETTER_FILE), exist_ok=True)
+    with open(settings.INGEST_DEAD_LETTER_FILE, 'a') as file:
+        file.write(json.dumps({'meter_id': pulse.meter_id, 'time': pulse.time.isoformat(), 'reading': pulse.reading,
+                               'error': repr(error)}) + "\n")
+
+
+""" BINARY FRAMES """
+
+# meter id, timestamp of the first pulse (unix seconds), reading of the first pulse, number of following pulses
+FRAME_HEADER = struct.Struct('<IIIH')
+# seconds since the previous pulse, reading minus the previous reading
+FRAME_DELTA = struct.Struct('<Hi')
+
+
+def decode_pulse_frame(frame: bytes) -> List[Dict]:
+    """
+    Decodes the pulses of a binary frame, as sent by transmitters on metered links. A frame is a `FRAME_HEADER`
+    followed by one `FRAME_DELTA` per additional pulse, all little-endian. Raises `ValueError` if it's malformed.
+
+    :return: Rows in the shape `insert_pulses` takes.
+    """
+    if len(frame) < FRAME_HEADER.size:
+        raise ValueError(f"Frame is shorter than its {FRAME_HEADER.size} bytes header")
+    meter_id, base_time, base_reading, count = FRAME_HEADER.unpack_from(frame)
+    if len(frame) != FRAME_HEADER.size + count * FRAME_DELTA.size:
+        raise ValueError(f"Frame announces {count} deltas but is {len(frame)} bytes long")
+
+    time_deltas, reading_deltas = zip(*FRAME_DELTA.iter_unpack(frame[FRAME_HEADER.size:])) if count else ((), ())
+    times = itertools.accumulate(itertools.chain([base_time], time_deltas))
+    readings = itertools.accumulate(itertools.chain([base_reading], reading_deltas))
+    return [{'meter_id': meter_id, 'time': dt.datetime.fromtimestamp(time, tz=pytz.utc), 'reading': str(reading)}
+            for time, reading in zip(times, readings)]
+
+
+""" WRITE-BEHIND """
+
+
+def _encode(pulse: Dict) -> bytes:
+    return json.dumps([pulse['meter_id'], pulse['time'].isoformat(), pulse['reading']]).encode()
+
+
+def _decode(record: bytes) -> Dict:
+    meter_id, time, reading = json.loads(record)
+    return {'meter_id': meter_id, 'time': parse_datetime(time), 'reading': reading}
+
+
+def replay_segments(segments: List[str], batch_size: int, remove=os.remove) -> int:
+    """
+    Saves the pulses of spool segments through `insert_pulses`, merging consecutive segments into batches of at
+    least `batch_size` pulses. Each segment is removed once its batch is committed; pulses that were committed
+    before a crash, but whose segment was left behind, are skipped.
+
+    :return: The number of pulses saved.
+    """
+    replayed = 0
+    rows, consumed = [], []
+    for idx, path in enumerate(segments):
+        rows.extend(_decode(record) for record in read_segment(path))
+        consumed.append(path)
+        if len(rows) >= batch_size or idx == len(segments) - 1:
+            replayed += len(insert_pulses(rows, skip_existing=True))
+            for consumed_path in consumed:
+                remove(consumed_path)
+            rows, consumed = [], []
+    return replayed
+
+
+_CLAIM_LOCK = "replay.lock"
+
+
+def replay_abandoned_spools(spool_dir: str, batch_size: int) -> int:
+    """
+    Replays and deletes the spools left behind by processes that are no longer running. A spool is claimed with an
+    exclusive lock first, so processes recovering at the same time never replay the same spool twice; the lock is
+    released by the system if its holder dies, and the spool is then replayed by the next process to recover.
+    """
+    replayed = 0
+    for directory in glob.glob(os.path.join(spool_dir, "*")):
+        pid = os.path.basename(directory)
+        if not pid.isdigit() or int(pid) == os.getpid() or _is_running(int(pid)):
+            continue
+        lock_path = os.path.join(directory, _CLAIM_LOCK)
+        try:
+            lock = open(lock_path, 'a')
+        except FileNotFoundError:
+            continue  # replayed and deleted by another process meanwhile
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # being replayed by another process
+            replayed += replay_segments(list_segments(directory), batch_size)
+            os.remove(lock_path)
+        try:
+            os.rmdir(directory)
+        except OSError:
+            # another process opened a new lock after ours was removed; it finds nothing to replay and deletes it
+            pass
+    return replayed
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class PulseWriter:
+    """
+    Accepts validated pulses from the ingest endpoints and saves them in batches from a background thread.
+
+    A pulse is accepted once it's durable in this process' spool, which doesn't need the database to be reachable.
+    After every flush interval, or as soon as `batch_size` pulses are waiting, the flusher seals the active
+    segment and replays the sealed ones into the database. While the database is down, sealed segments pile up and
+    are replayed as a few large batches once it's back.
+    """
+
+    def __init__(self, spool_dir=None, batch_size=None, flush_interval=None, max_spooled_bytes=None):
+        self.spool_dir = spool_dir or settings.INGEST_SPOOL_DIR
+        self.batch_size = batch_size or settings.INGEST_BATCH_SIZE
+        self.flush_interval = (flush_interval or settings.INGEST_FLUSH_INTERVAL_MS) / 1000
+        self.pid = os.getpid()
+        self.spool = Spool(os.path.join(self.spool_dir, str(self.pid)),
+                           max_bytes=max_spooled_bytes or settings.INGEST_SPOOL_MAX_BYTES)
+
+        self._waiting = 0
+        self._lock = threading.Lock()  # guards `_waiting`
+        self._batch_ready = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def submit(self, pulse: Dict) -> None:
+        """ Spools `pulse` for the next batch. Raises `SpoolFull` if the database has been lagging for too long. """
+        self.submit_many([pulse])
+
+    def submit_many(self, pulses: List[Dict]) -> None:
+        self.spool.append_many([_encode(pulse) for pulse in pulses])
+        with self._lock:
+            self._waiting += len(pulses)
+            if self._waiting >= self.batch_size:
+                self._batch_ready.set()
+
+    def flush(self) -> int:
+        """
+        Saves everything spooled so far.
+
+        :return: The number of pulses saved.
+        """
+        with self._lock:
+            self._waiting = 0
+        self.spool.seal()
+        return replay_segments(self.spool.sealed_segments(), self.batch_size, remove=self.spool.remove)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="pulse-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """ Stops the flusher thread and saves whatever is still spooled. """
+        self._stopped.set()
+        self._batch_ready.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.flush()
+        except Exception:
+            lg.exception("failed to save the remaining pulses, they're left in the spool")
+        self.spool.close()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._batch_ready.wait(self.flush_interval)
+            self._batch_ready.clear()
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                lg.exception("failed to save spooled pulses, retrying")
+
+    def recover(self) -> int:
+        """ Replays the spools left behind by processes that are no longer running. """
+        return replay_abandoned_spools(self.spool_dir, self.batch_size)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def pending_pulses() -> int:
+    """ Returns the number of pulses this process' `PulseWriter` accepted and hasn't saved yet, without starting it. """
+    writer = _writer
+    return writer._waiting if writer is not None and writer.pid == os.getpid() else 0
+
+
+def get_pulse_writer() -> PulseWriter:
+    """ Returns this process' running `PulseWriter`, starting it on first use (and again after a fork). """
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.pid != os.getpid():
+            _writer = PulseWriter()
+            try:
+                _writer.recover()
+            except Exception:
+                lg.exception("failed to replay abandoned spools")
+            _writer.start()
+        return _writer
@@ -0,0 +1,108 @@
+import datetime as dt
+from decimal import Decimal
+from typing import List
+
+import numpy as np
+import pytz
+from django.conf import settings
+from django.db.models import Avg
+from django.db.models.functions import ExtractHour, ExtractMinute
+
+from .models import QuarterHourlyZoneConsumption, Zone
+from .tools import to_fixed_point, from_fixed_point
+
+""" GAP INTERPOLATION """
+
+# The consumption of a zone over a gap between its pulses is measured, but not how it was spread over the quarter
+# hours of the gap. Each strategy weighs the quarter hours, and the measured consumption is split by those weights.
+QUARTERS_PER_DAY = 96
+
+
+def allocate(total: int, weights: np.ndarray) -> np.ndarray:
+    """
+    Splits `total` thousandths in proportion to `weights`. Parts are rounded off the running total, so they always
+    add up to `total` exactly.
+    """
+    cumulative = np.round(np.cumsum(weights) / weights.sum() * total).astype(np.int64)
+    return np.diff(cumulative, prepend=0)
+
+
+def linear(zone: Zone, first_tick: dt.datetime, count: int, total: int) -> np.ndarray:
+    """ Spreads the consumption evenly, as if the meters' readings rose in a straight line over the gap. """
+    return allocate(total, np.ones(count))
+
+
+def diurnal_profile(zone: Zone, before: dt.datetime) -> np.ndarray:
+    """
+    Returns the zone's average consumption in each quarter hour of the day, indexed by the quarter hour each period
+    ends at, over the `GAP_PROFILE_DAYS` before `before`. Quarter hours without history are NaN.
+    """
+    averages = QuarterHourlyZoneConsumption.objects\
+        .filter(zone_id=zone, datetime__gte=before - dt.timedelta(days=settings.GAP_PROFILE_DAYS),
+                datetime__lt=before)\
+        .values(hour=ExtractHour('datetime', tzinfo=pytz.utc), minute=ExtractMinute('datetime', tzinfo=pytz.utc))\
+        .annotate(average=Avg('consumption')).order_by().values_list('hour', 'minute', 'average')
+    by_quarter = np.full(QUARTERS_PER_DAY, np.nan)
+    for hour, minute, average in averages:
+        by_quarter[hour * 4 + minute // 15] = average
+    return by_quarter
+
+
+def profile(zone: Zone, first_tick: dt.datetime, count: int, total: int) -> np.ndarray:
+    """
+    Spreads the consumption in proportion to the zone's usual consumption at each time of the day, see
+    `diurnal_profile`. Quarter hours the zone has no history of weigh as much as its average one. Falls back to
+    `linear` if the zone has no usable history.
+    """
+    shape = np.clip(diurnal_profile(zone, first_tick), 0, None)
+    if np.isnan(shape).all():
+        return linear(zone, first_tick, count, total)
+    shape[np.isnan(shape)] = np.nanmean(shape)
+
+    first_quarter = first_tick.hour * 4 + first_tick.minute // 15
+    weights = shape[(first_quarter + np.arange(count)) % QUARTERS_PER_DAY]
+    if weights.sum() <= 0:
+        return linear(zone, first_tick, count, total)
+    return allocate(total, weights)
+
+
+def trend(zone: Zone, first_tick: dt.datetime, count: int, total: int) -> np.ndarray:
+    """
+    Carries on from the consumption of the quarter hour before the gap, changing it by the same amount every quarter
+    hour so that the gap adds up to the measured consumption: the gap ends up where the measurement says it should,
+    without its closing quarter hour taking all the difference. Quarter hours the trend would take below zero get
+    nothing. Falls back to `linear` if there's no quarter hour before the gap.
+    """
+    last = QuarterHourlyZoneConsumption.objects.filter(zone_id=zone, datetime__lt=first_tick)\
+        .order_by('-datetime').values_list('consumption', flat=True).first()
+    if last is None:
+        return linear(zone, first_tick, count, total)
+    held = float(to_fixed_point([last])[0])
+    steps = np.arange(1, count + 1)
+    step = (total - held * count) / steps.sum()
+    weights = np.clip(held + step * steps, 0, None)
+    if weights.sum() <= 0:
+        return linear(zone, first_tick, count, total)
+    return allocate(total, weights)
+
+
+STRATEGIES = {
+    'linear': linear,
+    'profile': profile,
+    'trend': trend,
+}
+
+
+def interpolate_gap(zone: Zone, first_tick: dt.datetime, count: int, consumption: Decimal,
+                    strategy: str = None) -> List[Decimal]:
+    """
+    Splits the `consumption` of a zone measured over `count` quarter hours, ending at `first_tick` and every quarter
+    hour after it, between them. Uses the zone's `gap_interpolation` strategy unless one is given.
+
+    :return: The consumption of each quarter hour, adding up to `consumption`.
+    """
+    if count == 1:
+        return [consumption]
+    total, = to_fixed_point([consumption])
+    parts = STRATEGIES[strategy or zone.gap_interpolation](zone, first_tick, count, int(total))
+    return [from_fixed_point(part) for part in parts]
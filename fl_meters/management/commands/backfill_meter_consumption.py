@@ -0,0 +1,71 @@
+import datetime as dt
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Min
+
+from fl_meters.models import Meter, Pulse, QuarterHourlyMeterConsumption
+from fl_meters.rollups import METER_CONSUMPTION
+from fl_meters.tools import interval_consumption, from_fixed_point, get_offset_time, period_end_of
+
+
+class Command(BaseCommand):
+    help = "Fills the quarter-hourly, daily and monthly consumption of meters from the pulses saved before it was " \
+           "recorded at ingest, one meter at a time. Can be stopped at any time, and picks up where it left off " \
+           "when run again."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meter', type=int, action='append', dest='meter_ids',
+                            help="ID of a meter to backfill; can be repeated. All meters by default")
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of intervals written per query")
+
+    def handle(self, *args, **options):
+        meters = Meter.objects.select_related('meter_model').order_by('id')
+        if options['meter_ids']:
+            meters = meters.filter(id__in=options['meter_ids'])
+
+        for meter in meters.iterator():
+            filled, skipped = self.backfill(meter, options['batch_size'])
+            if filled:
+                self.stdout.write(f"Meter ID:{meter.id}: {filled} intervals filled")
+            if skipped:
+                self.stdout.write(self.style.WARNING(f"Meter ID:{meter.id}: skipped {skipped} pulses whose reading "
+                                                     f"isn't a number"))
+        self.stdout.write(self.style.SUCCESS("Filled the consumption of every meter"))
+
+    @staticmethod
+    @transaction.atomic
+    def backfill(meter, batch_size):
+        """
+        Adds the intervals between the meter's pulses that end before its earliest recorded quarter hour, the one
+        the first pulse counted at ingest (or by an earlier run) ends in. A meter is filled in one transaction, so
+        a run stopped midway leaves it as it was.
+        """
+        counted_since = QuarterHourlyMeterConsumption.objects.filter(meter=meter)\
+            .aggregate(Min('datetime'))['datetime__min']
+        pulses = Pulse.objects.filter(meter=meter).order_by('time', 'id').only('id', 'time', 'reading', 'raw_reading')
+        if counted_since is not None:
+            pulses = pulses.filter(time__lte=counted_since - dt.timedelta(minutes=settings.RIE))
+
+        times, readings, skipped = [], [], 0
+        for pulse in pulses.iterator():
+            # duplicates are skipped, as they are at ingest
+            if times and pulse.time == times[-1]:
+                continue
+            try:
+                readings.append(pulse.parsed_reading())
+            except ValueError:
+                skipped += 1
+                continue
+            times.append(pulse.time)
+        if len(times) < 2:
+            return 0, skipped
+
+        deltas = interval_consumption(readings, [time.timestamp() for time in times], meter.meter_model.digits,
+                                      meter.reading_factor, meter.meter_model.max_flow_rate)
+        points = [(get_offset_time(period_end_of(time)), from_fixed_point(delta))
+                  for time, delta in zip(times[1:], deltas)]
+        for first in range(0, len(points), batch_size):
+            METER_CONSUMPTION.add(meter.id, points[first:first + batch_size])
+        return len(points), skipped
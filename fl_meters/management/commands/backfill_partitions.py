@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from fl_meters.rollups import ROLLUPS
+
+
+class Command(BaseCommand):
+    help = "Fills the partition columns of the rollups that have them (the time-of-day, weekly and quarterly split " \
+           "of zone consumption) from their quarter hours. Running it again recomputes them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entity', type=int, action='append', dest='entity_ids',
+                            help="ID of an entity to backfill; can be repeated. All entities by default")
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Number of entities backfilled per transaction, their rows being locked meanwhile")
+
+    def handle(self, *args, **options):
+        for rollup in ROLLUPS.values():
+            if not rollup.partitions:
+                continue
+            written = rollup.backfill_partitions(options['entity_ids'], options['batch_size'])
+            for level, count in written.items():
+                self.stdout.write(self.style.SUCCESS(f"Filled the partitions of {count} {rollup.name} rows at the "
+                                                     f"{level.name} level"))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from fl_meters.models import Pulse, PressurePulse
+from fl_meters.tools import parse_reading
+
+
+class Command(BaseCommand):
+    help = "Stores the readings of flow and pressure pulses saved before readings were stored as numbers, in " \
+           "batches. Can be stopped at any time, and picks up where it left off when run again."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Number of pulses updated per query")
+
+    def handle(self, *args, **options):
+        for model in (Pulse, PressurePulse):
+            filled, skipped = self.backfill(model, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Stored the readings of {filled} {model.__name__} rows"))
+            if skipped:
+                self.stdout.write(self.style.WARNING(f"Skipped {skipped} {model.__name__} rows whose reading isn't a "
+                                                     f"number"))
+
+    def backfill(self, model, batch_size):
+        filled, skipped, last_id = 0, 0, 0
+        while True:
+            pulses = list(model.objects.filter(raw_reading__isnull=True, id__gt=last_id)
+                          .order_by('id').only('id', 'reading')[:batch_size])
+            if not pulses:
+                return filled, skipped
+            last_id = pulses[-1].id
+
+            parsed = []
+            for pulse in pulses:
+                try:
+                    pulse.raw_reading = parse_reading(pulse.reading)
+                except ValueError:
+                    skipped += 1
+                    continue
+                parsed.append(pulse)
+            model.objects.bulk_update(parsed, ['raw_reading'])
+            filled += len(parsed)
+            self.stdout.write(f"{model.__name__}: {filled} rows stored, up to ID:{last_id}")
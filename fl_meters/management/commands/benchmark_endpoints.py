@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases, setup_test_environment, \
+    teardown_test_environment
+
+from benchmarks.endpoints import run_endpoint_benchmark, DATASET_SIZES, ENDPOINTS
+
+
+class Command(BaseCommand):
+    help = "Measures the wall time, queries and response size of dashboard read endpoints against synthetic " \
+           "datasets of several sizes, in a throwaway test database. Fails when an endpoint runs more queries " \
+           "than its budget, unless it's marked as an expected failure."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=DATASET_SIZES, action='append', dest='sizes',
+                            help="Dataset size to measure, can be repeated. Defaults to all of them.")
+        parser.add_argument('--endpoint', choices=[endpoint.name for endpoint in ENDPOINTS], action='append',
+                            dest='endpoints', help="Endpoint to measure, can be repeated. Defaults to all of them.")
+        parser.add_argument('--repeat', type=int, default=3, help="Requests per endpoint and size")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="File the JSON result is written to, instead of stdout")
+
+    def handle(self, *args, **options):
+        sizes = {name: DATASET_SIZES[name] for name in options['sizes'] or DATASET_SIZES}
+        endpoints = [endpoint for endpoint in ENDPOINTS
+                     if not options['endpoints'] or endpoint.name in options['endpoints']]
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            result = run_endpoint_benchmark(sizes, endpoints, options['repeat'], options['seed'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(result, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            for size_name, measured in result['sizes'].items():
+                for name, measures in measured['endpoints'].items():
+                    if measures['status'] == 200:
+                        self.stdout.write(f"{size_name} {name}: {measures['wall_ms']['p50']}ms, "
+                                          f"{measures['queries']}/{measures['budget']} queries, "
+                                          f"{measures['bytes']} bytes"
+                                          + (" (expected failure)" if measures['expected_failure'] else ""))
+        else:
+            self.stdout.write(output)
+
+        if result['violations']:
+            raise CommandError("Query budgets exceeded:\n" + "\n".join(result['violations']))
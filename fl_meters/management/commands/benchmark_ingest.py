@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, teardown_databases
+
+from benchmarks.ingest import run_ingest_benchmark, PATHS
+from benchmarks.stream import StreamFaults
+
+
+class Command(BaseCommand):
+    help = "Streams the pulses of a synthetic network through the ingest and analytics paths, and reports their " \
+           "throughput, per-pulse latency and queries per pulse as JSON. Runs against a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--zones', type=int, default=10)
+        parser.add_argument('--customers-per-zone', type=int, default=5)
+        parser.add_argument('--transmission-lines', type=int, default=2)
+        parser.add_argument('--pressure-per-zone', type=int, default=1)
+        parser.add_argument('--chlorine-per-zone', type=int, default=1)
+        parser.add_argument('--days', type=int, default=1, help="Days of pulses streamed")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--path', choices=PATHS, action='append', dest='paths',
+                            help="Path to measure, can be repeated. Defaults to all of them.")
+        parser.add_argument('--missing', type=float, default=0.01, help="Rate of readings never sent")
+        parser.add_argument('--duplicated', type=float, default=0.005, help="Rate of readings sent twice")
+        parser.add_argument('--late', type=float, default=0.01, help="Rate of readings arriving late")
+        parser.add_argument('--out-of-order', type=float, default=0.005,
+                            help="Rate of readings arriving before the previous one")
+        parser.add_argument('--output', help="File the JSON result is written to, instead of stdout")
+
+    def handle(self, *args, **options):
+        faults = StreamFaults(missing=options['missing'], duplicated=options['duplicated'], late=options['late'],
+                              out_of_order=options['out_of_order'])
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            result = run_ingest_benchmark(
+                zones=options['zones'], customers_per_zone=options['customers_per_zone'],
+                transmission_lines=options['transmission_lines'], pressure_per_zone=options['pressure_per_zone'],
+                chlorine_per_zone=options['chlorine_per_zone'], days=options['days'], faults=faults,
+                seed=options['seed'], paths=options['paths'] or PATHS)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        output = json.dumps(result, indent=2)
+        if not options['output']:
+            self.stdout.write(output)
+            return
+        with open(options['output'], 'w') as f:
+            f.write(output)
+        for path, measured in result['paths'].items():
+            if measured['pulses']:
+                self.stdout.write(f"{path}: {measured['pulses']} pulses, {measured['throughput']} pulses/s, "
+                                  f"p50 {measured['latency_ms']['p50']}ms, p99 {measured['latency_ms']['p99']}ms, "
+                                  f"{measured['queries_per_pulse']['mean']} queries/pulse, "
+                                  f"errors {measured['errors']}")
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from fl_meters.ingest import replay_abandoned_spools
+
+
+class Command(BaseCommand):
+    help = "Saves the pulses left in the ingest spools of processes that are no longer running, e.g. after the web " \
+           "workers were stopped while the database was unreachable."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.INGEST_BATCH_SIZE,
+                            help="Minimum number of pulses saved per transaction")
+
+    def handle(self, *args, **options):
+        replayed = replay_abandoned_spools(settings.INGEST_SPOOL_DIR, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Saved {replayed} spooled pulses"))
@@ -0,0 +1,35 @@
+import csv
+import datetime as dt
+import sys
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fl_meters.billing import BILLING_COLUMNS, billing_rows, save_billed_consumption
+
+
+class Command(BaseCommand):
+    help = "Writes the month consumption of every customer meter as CSV, then saves the billed consumption of every " \
+           "zone in its monthly consumption record. Billing a month again overwrites its billed consumption."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', required=True, help="Month to bill, as YYYY-MM")
+        parser.add_argument('--output', help="Write the CSV to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        try:
+            month = dt.datetime.strptime(options['month'], '%Y-%m').date()
+        except ValueError:
+            raise CommandError(f"Month ({options['month']}) must be in the YYYY-MM format")
+
+        zone_totals = defaultdict(int)
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            writer = csv.writer(output)
+            writer.writerow(BILLING_COLUMNS)
+            writer.writerows(billing_rows(month, zone_totals))
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        # only once every row is written, so a failed export bills nothing
+        save_billed_consumption(month, zone_totals)
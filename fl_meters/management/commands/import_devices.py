@@ -0,0 +1,54 @@
+import csv
+import sys
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from fl_meters.provisioning import provision_meters
+from fl_meters.serializers import DeviceSerializer
+
+
+class Command(BaseCommand):
+    help = "Provisions the meters listed in a CSV file, along with their locations, customers and auth tokens. " \
+           "Columns are named after the fields of `DeviceSerializer`; empty cells are treated as missing. " \
+           "Writes the `id`, `key` and `token` of each created meter as CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="CSV file with a header row")
+        parser.add_argument('--output', help="Write the created meters' tokens to this file instead of stdout")
+        parser.add_argument('--dry-run', action='store_true', help="Validate the file without creating anything")
+
+    def handle(self, *args, **options):
+        with open(options['file'], newline='', encoding='utf-8-sig') as file:
+            rows = [{column: value for column, value in row.items() if value not in ('', None)}
+                    for row in csv.DictReader(file)]
+
+        devices = DeviceSerializer(data=rows, many=True)
+        if not devices.is_valid():
+            self._raise_row_errors({idx: row_errors for idx, row_errors in enumerate(devices.errors) if row_errors})
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"{len(rows)} devices are valid"))
+            return
+
+        try:
+            meters = provision_meters(devices.validated_data)
+        except ValidationError as e:
+            self._raise_row_errors(e.message_dict)
+
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            writer = csv.DictWriter(output, fieldnames=['id', 'key', 'token'])
+            writer.writeheader()
+            writer.writerows(meters)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        self.stderr.write(self.style.SUCCESS(f"Provisioned {len(meters)} meters"))
+
+    @staticmethod
+    def _raise_row_errors(errors):
+        # rows are numbered as seen in a spreadsheet: the header is line 1
+        lines = [f"line {idx + 2}: {row_errors}" for idx, row_errors in sorted(errors.items())]
+        raise CommandError("Invalid devices, nothing was imported:\n" + "\n".join(lines))
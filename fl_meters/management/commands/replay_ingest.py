@@ -0,0 +1,104 @@
+import base64
+import cProfile
+import io
+import pstats
+import time
+from collections import Counter
+
+from django.core import serializers
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, teardown_databases, setup_test_environment, \
+    teardown_test_environment
+
+from fl_meters.capture import read_captures
+from fl_meters.models import Zone, Location, TransmissionLine, MeterModel, TransmitterModel, DeviceModel, Meter, \
+    PressureTransmitter, ZoneHasPressureTransmitter, ChlorineSensor
+
+# the device configuration replayed pulses need, in an order that satisfies foreign keys
+DEVICE_MODELS = (Zone, Location, TransmissionLine, MeterModel, TransmitterModel, DeviceModel, Meter,
+                 PressureTransmitter, ZoneHasPressureTransmitter, ChlorineSensor)
+
+
+def parse_speed(speed: str) -> float:
+    """ Parses a replay speed like `10x` or `0.5`. `max` replays without waiting, as 0. """
+    if speed == 'max':
+        return 0
+    try:
+        value = float(speed[:-1] if speed.endswith('x') else speed)
+    except ValueError:
+        raise CommandError(f"Bad speed `{speed}`, use a multiplier like `10x`, or `max`")
+    if value <= 0:
+        raise CommandError("Speed must be positive")
+    return value
+
+
+class Command(BaseCommand):
+    help = "Replays captured ingest requests against a scratch database holding a copy of the configured " \
+           "database's devices, at the pace they arrived in, optionally profiling the replay."
+
+    def add_arguments(self, parser):
+        parser.add_argument('captures', nargs='+', help="Capture files, replayed as a single stream")
+        parser.add_argument('--speed', default='1x', help="Replay speed, like `10x`, or `max` to not wait at all")
+        parser.add_argument('--profile', action='store_true', help="Profile the replay and report its hotspots")
+        parser.add_argument('--top', type=int, default=25, help="Functions listed in the hotspot report")
+        parser.add_argument('--profile-output', help="File the raw profile is saved to, for other viewers")
+
+    def handle(self, *args, **options):
+        speed = parse_speed(options['speed'])
+        devices = [obj for model in DEVICE_MODELS for obj in serializers.serialize('python', model.objects.all())]
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            for obj in serializers.deserialize('python', devices):
+                obj.save()
+            profiler = cProfile.Profile() if options['profile'] else None
+            statuses, count, elapsed = self.replay(options['captures'], speed, profiler)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f"Replayed {count} requests in {elapsed:.1f}s "
+                          f"({count / elapsed if elapsed else 0:.0f} requests/s), statuses {dict(statuses)}")
+        if profiler is not None:
+            self.report(profiler, options['top'])
+            if options['profile_output']:
+                profiler.dump_stats(options['profile_output'])
+
+    # the replay must not capture itself, nor rotate away the captures being replayed
+    @staticmethod
+    @override_settings(INGEST_CAPTURE=False)
+    def replay(paths, speed, profiler):
+        client = Client()
+        statuses = Counter()
+        count = 0
+        first_arrival = started = None
+        for record in read_captures(paths):
+            if first_arrival is None:
+                first_arrival, started = record['t'], time.monotonic()
+            if speed:
+                # keeps the gaps between requests, shrunk by `speed`; a slow replay catches up without waiting
+                delay = (record['t'] - first_arrival) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+            path = record['path'] + ('?' + record['query'] if record['query'] else '')
+            body = base64.b64decode(record['body'])
+            if profiler is not None:
+                profiler.enable()
+            response = client.generic(record['method'], path, body, content_type=record['content_type'])
+            if profiler is not None:
+                profiler.disable()
+            statuses[response.status_code] += 1
+            count += 1
+        return statuses, count, time.monotonic() - started if started is not None else 0
+
+    def report(self, profiler, top):
+        """ Lists the functions the replay spent the most time in, by their own time, then including callees. """
+        for sort, title in (('tottime', "own time"), ('cumulative', "time including callees")):
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).strip_dirs().sort_stats(sort).print_stats(top)
+            self.stdout.write(f"\nHotspots by {title}:")
+            # skip the preamble pstats prints before its table
+            self.stdout.write(stream.getvalue()[stream.getvalue().find('   ncalls'):])
@@ -0,0 +1,28 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from fl_meters.gateway import IngestGateway
+
+
+class Command(BaseCommand):
+    help = "Runs the ingest gateway, which receives pulse frames from devices over persistent TCP connections " \
+           "(and optionally UDP datagrams), and saves them in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=9100)
+        parser.add_argument('--udp-port', type=int, help="Also receive frames as UDP datagrams on this port")
+
+    def handle(self, *args, **options):
+        asyncio.run(self.serve(options['host'], options['port'], options['udp_port']))
+
+    async def serve(self, host, port, udp_port):
+        gateway = IngestGateway()
+        server = await gateway.start(host, port, udp_port)
+        self.stdout.write(self.style.SUCCESS(f"Ingest gateway listening on {host}:{port}" +
+                                             (f", udp {udp_port}" if udp_port is not None else "")))
+        try:
+            await server.serve_forever()
+        finally:
+            await gateway.close()
@@ -0,0 +1,53 @@
+import asyncio
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fl_meters.gateway import simulate_device, OK
+from fl_meters.ingest import FRAME_HEADER, FRAME_DELTA
+from fl_meters.models import MeterToken
+
+
+class Command(BaseCommand):
+    help = "Opens many concurrent device connections to an ingest gateway and sends pulse frames through each, " \
+           "using the tokens of existing meters. Meant for load testing a local gateway; the pulses are saved."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=9100)
+        parser.add_argument('--connections', type=int, default=1000)
+        parser.add_argument('--frames', type=int, default=10, help="Frames sent by each connection")
+        parser.add_argument('--pulses-per-frame', type=int, default=4)
+        parser.add_argument('--since', type=int, default=int(time.time()) - 365 * 24 * 3600,
+                            help="Unix time of the first simulated pulse")
+
+    def handle(self, *args, **options):
+        tokens = list(MeterToken.objects.values_list('key', 'user_id')[:options['connections']])
+        if not tokens:
+            raise CommandError("No meters to simulate, provision some first")
+
+        frames_per_meter = options['frames'] * options['connections'] // len(tokens)
+        devices = [(key, self.frames(meter_id, frames_per_meter, options['pulses_per_frame'], options['since']))
+                   for key, meter_id in tokens]
+
+        started = time.monotonic()
+        statuses = asyncio.run(self.simulate(options['host'], options['port'], devices))
+        elapsed = time.monotonic() - started
+
+        counts = Counter(status for device_statuses in statuses for status in device_statuses)
+        pulses = counts[OK] * options['pulses_per_frame']
+        self.stdout.write(f"{len(devices)} connections, {sum(counts.values())} frames in {elapsed:.1f}s: "
+                          f"{pulses / elapsed:.0f} pulses/s, statuses {dict(counts)}")
+
+    @staticmethod
+    def frames(meter_id, count, pulses_per_frame, since):
+        # consecutive quarter-hourly pulses, each reading 7 units more than the previous one
+        deltas = b"".join(FRAME_DELTA.pack(900, 7) for _ in range(pulses_per_frame - 1))
+        return [FRAME_HEADER.pack(meter_id, since + idx * pulses_per_frame * 900, idx * pulses_per_frame * 7,
+                                  pulses_per_frame - 1) + deltas
+                for idx in range(count)]
+
+    @staticmethod
+    async def simulate(host, port, devices):
+        return await asyncio.gather(*(simulate_device(host, port, token, frames) for token, frames in devices))
@@ -0,0 +1,199 @@
+import bisect
+import functools
+import hmac
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, OuterRef, Q, Subquery
+
+from .ingest import pending_pulses
+from .models import AnalyticsQueue, OnHold, QuarterHourlyZoneConsumption, Zone
+from .tools import get_now
+
+""" HISTOGRAMS """
+
+# Metrics are kept in the memory of each process: every worker exposes its own, and they're lost on restart.
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """ Counts observations into cumulative buckets, the way Prometheus histograms do. """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one counts observations above every bucket
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[Tuple[str, int]]:
+        """ Returns the `le` bound of each bucket, `+Inf` included, along with the observations within it. """
+        total, cumulative = 0, []
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            cumulative.append((str(bound), total))
+        return cumulative
+
+
+class HistogramFamily:
+    """ Histograms of a metric, one per set of label values. """
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.histograms: Dict[tuple, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: tuple, value) -> None:
+        with self._lock:
+            histogram = self.histograms.get(label_values)
+            if histogram is None:
+                histogram = self.histograms[label_values] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def exposition(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, histogram in sorted(self.histograms.items()):
+                labels = _labels(zip(self.label_names, label_values))
+                for bound, count in histogram.cumulative_counts():
+                    lines.append(f"{self.name}_bucket{{{labels},le=\"{bound}\"}} {count}")
+                lines.append(f"{self.name}_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"{self.name}_count{{{labels}}} {histogram.count}")
+        return lines
+
+
+def _labels(pairs) -> str:
+    escape = lambda value: str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return ",".join(f'{name}="{escape(value)}"' for name, value in pairs)
+
+
+stage_seconds = HistogramFamily('fl_pipeline_stage_seconds', "Time spent in each stage of the pulse analytics "
+                                "pipeline.", ('function', 'stage'), DURATION_BUCKETS)
+stage_queries = HistogramFamily('fl_pipeline_stage_queries', "Database queries run by each stage of the pulse "
+                                "analytics pipeline.", ('function', 'stage'), QUERY_BUCKETS)
+
+
+""" PIPELINE STAGES """
+
+
+class StageTimer:
+    """
+    Splits the time and queries of a call into stages: each `lap` closes the stage it names, and whatever runs after
+    the last lap is counted as `other`. Also the database execute wrapper counting the call's queries.
+    """
+
+    def __init__(self, function: str):
+        self.function = function
+        self.queries = 0
+        self.stages = defaultdict(lambda: [0, 0])  # seconds and queries of each stage
+        self.started = self._lap_started = time.perf_counter()
+        self._lap_queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.stages[stage][0] += now - self._lap_started
+        self.stages[stage][1] += self.queries - self._lap_queries
+        self._lap_started, self._lap_queries = now, self.queries
+
+    def finish(self) -> None:
+        if self._lap_started != self.started:
+            self.lap('other')
+        self.stages['total'] = [time.perf_counter() - self.started, self.queries]
+        for stage, (seconds, queries) in self.stages.items():
+            stage_seconds.observe((self.function, stage), seconds)
+            stage_queries.observe((self.function, stage), queries)
+
+
+_timers = threading.local()
+
+
+def instrumented(fn):
+    """
+    Observes the time and queries of every call of `fn` in the pipeline histograms, under `total` and under each
+    stage `fn` marks with `lap`. Does nothing when `PIPELINE_METRICS` is off.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not settings.PIPELINE_METRICS:
+            return fn(*args, **kwargs)
+        stack = _timers.__dict__.setdefault('stack', [])
+        timer = StageTimer(fn.__name__)
+        stack.append(timer)
+        try:
+            with connection.execute_wrapper(timer):
+                return fn(*args, **kwargs)
+        finally:
+            stack.pop()
+            timer.finish()
+    return wrapper
+
+
+def lap(stage: str) -> None:
+    """ Closes a stage of the innermost `instrumented` call running in this thread. """
+    stack = getattr(_timers, 'stack', None)
+    if stack:
+        stack[-1].lap(stage)
+
+
+""" EXPOSITION """
+
+
+def _gauge(name: str, help_text: str, samples: List[Tuple[dict, object]]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{{{_labels(labels.items())}}} {value}" if labels else f"{name} {value}")
+    return lines
+
+
+def backlog_gauges() -> List[str]:
+    """ Reads the analytics backlog from the database, in three queries. """
+    now = get_now()
+    on_hold = OnHold.objects.aggregate(zone=Count('id', filter=Q(zone__isnull=False)),
+                                       transmission_line=Count('id', filter=Q(transmission_line__isnull=False)))
+    # one lookup of the (zone, datetime) unique index per zone, rather than grouping every quarter hour
+    latest = QuarterHourlyZoneConsumption.objects.filter(zone_id=OuterRef('pk')).order_by('-datetime')\
+        .values('datetime')[:1]
+    latest_periods = Zone.objects.annotate(latest=Subquery(latest)).filter(latest__isnull=False)\
+        .values_list('name', 'latest')
+    return [
+        *_gauge('fl_analytics_queue_depth', "Zone periods queued for analytics.",
+                [({}, AnalyticsQueue.objects.count())]),
+        *_gauge('fl_ingest_spooled_pulses', "Pulses accepted by this process and waiting to be saved.",
+                [({}, pending_pulses())]),
+        *_gauge('fl_onhold_backlog', "Analytics held until the pulses they wait for arrive.",
+                [({'kind': kind}, count) for kind, count in on_hold.items()]),
+        *_gauge('fl_zone_analytics_lag_seconds', "Time since the latest quarter hour of each zone's consumption.",
+                [({'zone': name}, round((now - latest).total_seconds())) for name, latest in latest_periods]),
+    ]
+
+
+def authorized(request) -> bool:
+    """ Whether the request may read metrics and profiles: staff users, and scrapers bearing the `METRICS_TOKEN`. """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_staff:
+        return True
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(settings.METRICS_TOKEN) and scheme.lower() == 'bearer' \
+        and hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode())
+
+
+def exposition() -> str:
+    """ Renders every metric in the Prometheus text format. """
+    lines = stage_seconds.exposition() + stage_queries.exposition() + backlog_gauges()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.1 on 2026-10-19 13:19
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def merge_forked_counters(apps, schema_editor):
+    """
+    Concurrent `get_or_create` calls could create a counter twice. Forks are merged into their first row, which
+    keeps the highest serial any of them handed out, so no serial is handed out again.
+    """
+    Serial = apps.get_model('fl_meters', 'Serial')
+    forked = Serial.objects.values('model_name').annotate(count=Count('id')).filter(count__gt=1)\
+        .order_by().values_list('model_name', flat=True)
+    for model_name in list(forked):
+        counters = Serial.objects.filter(model_name=model_name).order_by('id')
+        last = counters.aggregate(value=Max('last_serial_value'), stamp=Max('last_serial_stamp'))
+        kept = counters.first()
+        counters.exclude(id=kept.id).delete()
+        # a queryset update, as saving would stamp the counter with today's date
+        Serial.objects.filter(id=kept.id).update(last_serial_value=last['value'], last_serial_stamp=last['stamp'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fl_meters', '0005_auto_20200911_0433'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_forked_counters, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='serial',
+            name='model_name',
+            field=models.CharField(max_length=16, unique=True),
+        ),
+    ]
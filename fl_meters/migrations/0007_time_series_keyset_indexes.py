@@ -0,0 +1,37 @@
+# Generated by Django 2.2.1 on 2026-10-19 13:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fl_meters', '0006_serial_model_name_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chlorinesensorpulse',
+            index=models.Index(fields=['time', 'id'], name='fl_meters_c_time_88f3c0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chlorinesensorpulse',
+            index=models.Index(fields=['sensor', 'time', 'id'], name='fl_meters_c_sensor__2d0ee3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pressurepulse',
+            index=models.Index(fields=['time', 'id'], name='fl_meters_p_time_4b39d1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pressurepulse',
+            index=models.Index(fields=['transmitter', 'time', 'id'], name='fl_meters_p_transmi_044d28_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pulse',
+            index=models.Index(fields=['time', 'id'], name='fl_meters_p_time_efacf4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pulse',
+            index=models.Index(fields=['meter', 'time', 'id'], name='fl_meters_p_meter_i_59cdc4_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 2.2.1 on 2026-10-19 15:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fl_meters', '0007_time_series_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyMeterConsumption',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('consumption', models.DecimalField(decimal_places=3, max_digits=13)),
+                ('meter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_consumption_set', to='fl_meters.Meter')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyMeterConsumption',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('consumption', models.DecimalField(decimal_places=3, max_digits=13)),
+                ('meter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_consumption_set', to='fl_meters.Meter')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuarterHourlyMeterConsumption',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime', models.DateTimeField()),
+                ('consumption', models.DecimalField(decimal_places=3, max_digits=13)),
+                ('meter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='qh_consumption_set', to='fl_meters.Meter')),
+            ],
+            options={
+                'unique_together': {('meter', 'datetime')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='monthlymeterconsumption',
+            index=models.Index(fields=['date', 'meter'], name='fl_meters_m_date_4f81e0_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlymeterconsumption',
+            unique_together={('meter', 'date')},
+        ),
+        migrations.AddIndex(
+            model_name='dailymeterconsumption',
+            index=models.Index(fields=['date', 'meter'], name='fl_meters_d_date_baa0f9_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailymeterconsumption',
+            unique_together={('meter', 'date')},
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.1 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fl_meters', '0008_meter_consumption'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pressurepulse',
+            name='raw_reading',
+            field=models.DecimalField(blank=True, decimal_places=3, max_digits=16, null=True),
+        ),
+        migrations.AddField(
+            model_name='pulse',
+            name='raw_reading',
+            field=models.DecimalField(blank=True, decimal_places=3, max_digits=16, null=True),
+        ),
+    ]
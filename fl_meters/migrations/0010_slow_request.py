@@ -0,0 +1,32 @@
+# Generated by Django 2.2.1 on 2026-10-19 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fl_meters', '0009_pulse_raw_reading'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(db_index=True, max_length=255)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=255)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('duration_ms', models.FloatField(db_index=True)),
+                ('db_ms', models.FloatField()),
+                ('queries', models.PositiveIntegerField()),
+                ('duplicated_queries', models.PositiveIntegerField(help_text='Queries repeating an earlier query of the request')),
+                ('duplicates', models.TextField(blank=True, help_text='Repeated query fingerprints, with how many times they ran')),
+                ('recorded_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'ordering': ['-duration_ms'],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 2.2.1 on 2026-10-19 18:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fl_meters', '0010_slow_request'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeterFlowRate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField()),
+                ('volume', models.DecimalField(decimal_places=3, max_digits=13)),
+                ('seconds', models.PositiveIntegerField()),
+                ('meter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='flow_rate_set', to='fl_meters.Meter')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HourlyMeterFlowRate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime', models.DateTimeField()),
+                ('volume', models.DecimalField(decimal_places=3, max_digits=13)),
+                ('seconds', models.PositiveIntegerField()),
+                ('meter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_flow_rate_set', to='fl_meters.Meter')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyMeterFlowRate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('volume', models.DecimalField(decimal_places=3, max_digits=13)),
+                ('seconds', models.PositiveIntegerField()),
+                ('meter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_flow_rate_set', to='fl_meters.Meter')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='meterflowrate',
+            index=models.Index(fields=['time', 'meter'], name='fl_meters_m_time_b1869b_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='meterflowrate',
+            unique_together={('meter', 'time')},
+        ),
+        migrations.AddIndex(
+            model_name='hourlymeterflowrate',
+            index=models.Index(fields=['datetime', 'meter'], name='fl_meters_h_datetim_dda1b9_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='hourlymeterflowrate',
+            unique_together={('meter', 'datetime')},
+        ),
+        migrations.AddIndex(
+            model_name='dailymeterflowrate',
+            index=models.Index(fields=['date', 'meter'], name='fl_meters_d_date_746315_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailymeterflowrate',
+            unique_together={('meter', 'date')},
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.1 on 2026-10-19 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fl_meters', '0011_meter_flow_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Annotation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.PositiveSmallIntegerField(choices=[(0, 'Undefined'), (1, 'Meter Flowrate'), (2, 'Zone Consumption')])),
+                ('entity_id', models.PositiveIntegerField()),
+                ('kind', models.PositiveSmallIntegerField(choices=[(0, 'Undefined'), (1, 'Interpolation'), (2, 'Anomaly'), (3, 'Estimation Confidence')])),
+                ('since', models.DateTimeField()),
+                ('until', models.DateTimeField()),
+                ('value', models.DecimalField(blank=True, decimal_places=3, max_digits=7, null=True)),
+                ('description', models.CharField(blank=True, default='', max_length=250)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['metric', 'until', 'entity_id'], name='fl_meters_a_metric_266050_idx'),
+        ),
+    ]
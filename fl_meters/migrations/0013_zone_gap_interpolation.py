@@ -0,0 +1,18 @@
+# Generated by Django 2.2.1 on 2026-10-19 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fl_meters', '0012_annotation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zone',
+            name='gap_interpolation',
+            field=models.CharField(choices=[('linear', 'Linear'), ('profile', "Zone's daily profile"), ('trend', 'Trend from the last quarter hour')], default='linear', max_length=9),
+        ),
+    ]
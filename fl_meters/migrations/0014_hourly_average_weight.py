@@ -0,0 +1,25 @@
+# Generated by Django 2.2.1 on 2026-10-19 21:05
+
+from django.db import migrations, models
+
+
+# Hours already rolled up are given a weight of 1: the number of points they averaged wasn't stored. Points added to
+# them later are weighed against a single point, instead of all those the hour held.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fl_meters', '0013_zone_gap_interpolation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hourlyavgchlorinelevel',
+            name='weight',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='hourlyavgzonepressure',
+            name='weight',
+            field=models.IntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.1 on 2026-10-19 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fl_meters', '0014_hourly_average_weight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaterBalanceRevision',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('revision', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,140 @@
+# Generated by Django 2.2.1 on 2026-10-19 23:05
+
+from django.db import migrations
+from django.db.models import Count
+
+# (model, entity field, period field, summed fields, averaged field): the rollup tables made unique per period. The
+# periods concurrent writes created twice are merged into their first row before the constraints are added.
+ROLLUP_TABLES = [
+    ('QuarterHourlyZoneConsumption', 'zone_id', 'datetime', ['consumption'], None),
+    ('DailyZoneConsumption', 'zone_id', 'date',
+     ['consumption', 'p_dawn', 'p_noon', 'p_afternoon', 'p_evening', 'p_nighttime'], None),
+    ('MonthlyZoneConsumption', 'zone_id', 'date', ['consumption', 'p_week1', 'p_week2', 'p_week3', 'p_week4'], None),
+    ('YearlyZoneConsumption', 'zone_id', 'year',
+     ['consumption', 'p_quarter1', 'p_quarter2', 'p_quarter3', 'p_quarter4'], None),
+    ('QuarterHourlyTSMInflow', 'transmission_line', 'datetime', ['consumption'], None),
+    ('DailyTSMInflow', 'transmission_line', 'date', ['consumption'], None),
+    ('MonthlyTSMInflow', 'transmission_line', 'date', ['consumption'], None),
+    ('YearlyTSMInflow', 'transmission_line', 'year', ['consumption'], None),
+    ('DailyTSMLossRecord', 'transmission_line', 'date', ['loss'], None),
+    ('MonthlyTSMLossRecord', 'transmission_line', 'date', ['loss'], None),
+    ('YearlyTSMLossRecord', 'transmission_line', 'year', ['loss'], None),
+    ('HourlyAvgZonePressure', 'zone', 'time', [], 'azp'),
+    ('DailyAvgZonePressure', 'zone', 'date', [], 'azp'),
+    ('MonthlyAvgZonePressure', 'zone', 'date', [], 'azp'),
+    ('YearlyAvgZonePressure', 'zone', 'year', [], 'azp'),
+    ('HourlyAvgChlorineLevel', 'sensor', 'time', [], 'level'),
+    ('DailyAvgChlorineLevel', 'sensor', 'date', [], 'level'),
+    ('MonthlyAvgChlorineLevel', 'sensor', 'date', [], 'level'),
+    ('YearlyAvgChlorineLevel', 'sensor', 'year', [], 'level'),
+]
+
+
+def merge_duplicate_periods(apps, schema_editor):
+    for model_name, entity, period, summed, averaged in ROLLUP_TABLES:
+        model = apps.get_model('fl_meters', model_name)
+        entity = model._meta.get_field(entity).attname
+        duplicated = model.objects.values(entity, period).annotate(rows=Count('id')).filter(rows__gt=1)\
+            .order_by().values_list(entity, period)
+        for entity_id, period_value in list(duplicated):
+            first, *duplicates = merged = list(model.objects.filter(**{entity: entity_id, period: period_value})
+                                               .order_by('id'))
+            for field in summed:
+                values = [getattr(row, field) for row in merged if getattr(row, field) is not None]
+                setattr(first, field, sum(values) if values else None)
+            if averaged:
+                weight = sum(row.weight for row in merged)
+                setattr(first, averaged, sum(getattr(row, averaged) * row.weight for row in merged) / weight)
+                first.weight = weight
+            if hasattr(first, 'billed_consumption') and first.billed_consumption is None:
+                first.billed_consumption = next((row.billed_consumption for row in duplicates
+                                                 if row.billed_consumption is not None), None)
+            first.save()
+            model.objects.filter(id__in=[row.id for row in duplicates]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fl_meters', '0015_water_balance_revision'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_periods, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='dailyavgchlorinelevel',
+            unique_together={('sensor', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyavgzonepressure',
+            unique_together={('zone', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailytsminflow',
+            unique_together={('transmission_line', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailytsmlossrecord',
+            unique_together={('transmission_line', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyzoneconsumption',
+            unique_together={('zone_id', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='hourlyavgchlorinelevel',
+            unique_together={('sensor', 'time')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='hourlyavgzonepressure',
+            unique_together={('zone', 'time')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlyavgchlorinelevel',
+            unique_together={('sensor', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlyavgzonepressure',
+            unique_together={('zone', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlytsminflow',
+            unique_together={('transmission_line', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlytsmlossrecord',
+            unique_together={('transmission_line', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlyzoneconsumption',
+            unique_together={('zone_id', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='quarterhourlytsminflow',
+            unique_together={('transmission_line', 'datetime')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='quarterhourlyzoneconsumption',
+            unique_together={('zone_id', 'datetime')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='yearlyavgchlorinelevel',
+            unique_together={('sensor', 'year')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='yearlyavgzonepressure',
+            unique_together={('zone', 'year')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='yearlytsminflow',
+            unique_together={('transmission_line', 'year')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='yearlytsmlossrecord',
+            unique_together={('transmission_line', 'year')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='yearlyzoneconsumption',
+            unique_together={('zone_id', 'year')},
+        ),
+    ]
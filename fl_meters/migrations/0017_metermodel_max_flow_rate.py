@@ -0,0 +1,18 @@
+# Generated by Django 2.2.1 on 2026-10-19 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fl_meters', '0016_rollup_unique_periods'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metermodel',
+            name='max_flow_rate',
+            field=models.DecimalField(blank=True, decimal_places=3, help_text='Most the meter registers per second, in raw units. Lets a counter rolling over several times between two pulses be counted.', max_digits=12, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.1 on 2026-10-19 23:50
+
+import re
+
+from django.db import migrations
+
+CHLORINE_SENSOR_KEY = re.compile(r'CHL-SSR-(\d+)$')
+
+
+def seed_chlorine_sensor_serial(apps, schema_editor):
+    """
+    Chlorine sensors used to draw their keys from the transmission line counter, and now have a counter of their
+    own. It starts past the highest key already given to a sensor, so the keys it hands out are free.
+    """
+    ChlorineSensor = apps.get_model('fl_meters', 'ChlorineSensor')
+    Serial = apps.get_model('fl_meters', 'Serial')
+    serials = [int(match.group(1)) for match in map(CHLORINE_SENSOR_KEY.match, ChlorineSensor.objects.filter(
+        key__startswith='CHL-SSR-').values_list('key', flat=True)) if match]
+    if not serials:
+        return
+    counter, _ = Serial.objects.get_or_create(model_name='ChlorineSensor')
+    if counter.last_serial_value < max(serials):
+        Serial.objects.filter(id=counter.id).update(last_serial_value=max(serials))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fl_meters', '0017_metermodel_max_flow_rate'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_chlorine_sensor_serial, migrations.RunPython.noop),
+    ]
@@ -21,7 +21,8 @@
 
 from .tools import next_meter_key, next_alert_key, next_transmitter_key, is_start_of_hour, is_end_of_hour, \
     sum_pulses_consumption, consumption_between_two_pulses, next_transmission_line_key, next_chlorine_sensor_key, \
-    next_tank_level_sensor_key
+    next_tank_level_sensor_key, next_meter_keys, next_transmitter_keys, next_chlorine_sensor_keys, \
+    next_tank_level_sensor_keys, next_transmission_line_keys, parse_reading
 
 OPERATIONAL_STATUS = [
     (2, 'Stopped'),
@@ -66,6 +67,13 @@
     (6, 'Irrigation'),
 ]
 
+# how the consumption measured over a gap between pulses is spread over its quarter hours, see `interpolation`
+GAP_INTERPOLATION = [
+    ('linear', 'Linear'),
+    ('profile', "Zone's daily profile"),
+    ('trend', 'Trend from the last quarter hour'),
+]
+
 TABLE_TYPE = [
     ('qh', 'QuarterHourly'),
     ('day', 'daily'),
@@ -87,6 +95,22 @@
 )
 
 
+class KeyedManager(models.Manager):
+    """
+    Manager of models whose `save()` assigns a serial key to new objects.
+
+    `bulk_create` skips `save()`, so keys are assigned here instead, reserving all the serials needed in a single
+    round-trip through the model's `next_keys`.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        keyless = [obj for obj in objs if not obj.key]
+        for obj, key in zip(keyless, self.model.next_keys(len(keyless))):
+            obj.key = key
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class Location(models.Model):
     address = map_fields.AddressField(max_length=200, null=True)
     geolocation = map_fields.GeoLocationField(max_length=100, null=True)
@@ -102,7 +126,7 @@ def __str__(self):
 
 
 class Serial(models.Model):
-    model_name = models.CharField(max_length=16)
+    model_name = models.CharField(max_length=16, unique=True)
     last_serial_value = models.IntegerField(default=0)
     last_serial_stamp = models.DateField(auto_now=True)
 
@@ -137,6 +161,9 @@ class Meter(models.Model):
     tsm_output = models.OneToOneField('TransmissionLine', models.SET_NULL, null=True, blank=True, related_name='output_meter',
                                       help_text="Output of Transmission Line")
 
+    objects = KeyedManager()
+    next_keys = staticmethod(next_meter_keys)
+
     is_authenticated = True  # django-specific attribute. enables authentication or something...
     is_pulsar = True  # used in .authentication.IsPulsar
 
@@ -239,6 +266,9 @@ class PressureTransmitter(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     date_modified = models.DateTimeField(auto_now=True)
 
+    objects = KeyedManager()
+    next_keys = staticmethod(next_transmitter_keys)
+
     is_authenticated = True  # django-specific attribute. enables authentication or something...
 
     class Meta:
@@ -372,16 +402,28 @@ class Pulse(models.Model):
     meter = models.ForeignKey(to=Meter, on_delete=models.PROTECT)
     time = models.DateTimeField(null=False, blank=False)
     reading = models.CharField(max_length=16, null=False, default="", blank=False)
+    # `reading` parsed once on save, so analytics and reports don't parse it again and can aggregate it in SQL
+    raw_reading = models.DecimalField(max_digits=16, decimal_places=3, null=True, blank=True)
     normalized_reading = models.DecimalField(max_digits=13, decimal_places=3, null=True, blank=True)
     anomaly = models.BooleanField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # keyset pagination and time range scans, see `pagination.TimeKeysetPagination`
+            models.Index(fields=['time', 'id']),
+            models.Index(fields=['meter', 'time', 'id']),
+        ]
+
     def at_day_end(self, margin_of_error=5):
         """:param margin_of_error: Tolerance in minutes. Default is 5 minutes"""
         return (self.time.hour == 23 and is_end_of_hour(self.time, margin_of_error)) or \
                (self.time.hour == 0 and is_start_of_hour(self.time, margin_of_error))
 
+    def parsed_reading(self) -> Decimal:
+        return self.raw_reading if self.raw_reading is not None else parse_reading(self.reading)
+
     def cleaned_reading(self):
-        return self.meter.reading_offset + (Decimal(self.reading) * self.meter.reading_factor)
+        return self.meter.reading_offset + (self.parsed_reading() * self.meter.reading_factor)
 
     def display_reading(self):
         if self.normalized_reading is not None:
@@ -408,6 +450,7 @@ def __repr__(self):
         return f"Pulse({self.id}) mtr({self.meter}) time({self.time.strftime(settings.VERBOSE_DATETIME_FORMAT)}) reading({self.reading})"
 
     def save(self, **kwargs):
+        self.raw_reading = parse_reading(self.reading)
         self.normalized_reading = self.cleaned_reading()
         super().save(**kwargs)
 
@@ -416,8 +459,15 @@ class PressurePulse(models.Model):
     transmitter = models.ForeignKey(to=PressureTransmitter, on_delete=models.PROTECT)
     time = models.DateTimeField(null=False, blank=False)
     reading = models.CharField(max_length=17, null=False, default="", blank=False)
+    raw_reading = models.DecimalField(max_digits=16, decimal_places=3, null=True, blank=True)
     normalized_reading = models.DecimalField(max_digits=13, decimal_places=3, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['time', 'id']),
+            models.Index(fields=['transmitter', 'time', 'id']),
+        ]
+
     def display_reading(self):
         if self.normalized_reading is not None:
             return self.normalized_reading
@@ -425,10 +475,14 @@ def display_reading(self):
             return round(self.cleaned_reading(), 3) if self.transmitter is not None else self.reading
         return "N/A"
 
+    def parsed_reading(self) -> Decimal:
+        return self.raw_reading if self.raw_reading is not None else parse_reading(self.reading)
+
     def cleaned_reading(self):
-        return Decimal(self.reading) * self.transmitter.reading_factor + self.transmitter.reading_offset
+        return self.parsed_reading() * self.transmitter.reading_factor + self.transmitter.reading_offset
 
     def save(self, **kwargs):
+        self.raw_reading = parse_reading(self.reading)
         self.normalized_reading = self.cleaned_reading()
         super().save(**kwargs)
 
@@ -479,6 +533,7 @@ class Zone(models.Model):
     n1 = models.DecimalField(max_digits=6, decimal_places=3, default=1)
     estimated_legitimate_night_use = models.DecimalField(max_digits=6, decimal_places=3, default=0)
     burst_threshold = models.DecimalField(max_digits=6, decimal_places=3, default=0)
+    gap_interpolation = models.CharField(max_length=9, choices=GAP_INTERPOLATION, default='linear')
 
     def calculate_delta_consumption(self, start_period, end_period):
         """
@@ -521,11 +576,13 @@ def calculate_sigma_consumption(self, start_period, end_period):
 
         for meter in input_meters:
             pulses = meter.get_pulses_between(start_period, end_period)
-            input_sum += sum_pulses_consumption(pulses, meter.meter_model.digits)
+            input_sum += sum_pulses_consumption(pulses, meter.meter_model.digits, meter.reading_factor,
+                                                  meter.meter_model.max_flow_rate)
 
         for meter in output_meters:
             pulses = meter.get_pulses_between(start_period, end_period)
-            output_sum += sum_pulses_consumption(pulses, meter.meter_model.digits)
+            output_sum += sum_pulses_consumption(pulses, meter.meter_model.digits, meter.reading_factor,
+                                                  meter.meter_model.max_flow_rate)
 
         return input_sum - output_sum
 
@@ -580,6 +637,9 @@ class MeterModel(models.Model):
     model_number = models.CharField(max_length=24)
     bulk_meter = models.BooleanField(default=True)
     digits = models.IntegerField(help_text="Number of digits on meter. Decimal digits should not be included.")
+    max_flow_rate = models.DecimalField(max_digits=12, decimal_places=3, null=True, blank=True,
+                                        help_text="Most the meter registers per second, in raw units. Lets a counter "
+                                                  "rolling over several times between two pulses be counted.")
     type = models.IntegerField(choices=METER_MECHANISM_TYPE, default=2)
 
     def __str__(self):
@@ -618,6 +678,9 @@ class ChlorineSensor(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     date_modified = models.DateTimeField(auto_now=True)
 
+    objects = KeyedManager()
+    next_keys = staticmethod(next_chlorine_sensor_keys)
+
     is_authenticated = True  # django-specific attribute. enables authentication or something...
 
     class Meta:
@@ -657,6 +720,12 @@ class ChlorineSensorPulse(models.Model):
     reading = models.DecimalField(max_digits=16, decimal_places=3)
     normalized_reading = models.DecimalField(max_digits=16, decimal_places=3, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['time', 'id']),
+            models.Index(fields=['sensor', 'time', 'id']),
+        ]
+
     def display_reading(self):
         if self.normalized_reading is not None:
             return self.normalized_reading
@@ -698,6 +767,9 @@ class TankLevelSensor(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     date_modified = models.DateTimeField(auto_now=True)
 
+    objects = KeyedManager()
+    next_keys = staticmethod(next_tank_level_sensor_keys)
+
     is_authenticated = True  # django-specific attribute. enables authentication or something...
 
     class Meta:
@@ -804,6 +876,9 @@ class TransmissionLine(models.Model):
     end_location = models.OneToOneField(to=Location, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
     volume = models.DecimalField(max_digits=12, decimal_places=3, default=0, blank=True)
 
+    objects = KeyedManager()
+    next_keys = staticmethod(next_transmission_line_keys)
+
     def calculate_loss_of(self, day: dt.date):
         """
         Delta (input pulses) - Delta (output pulses)
@@ -879,6 +954,9 @@ class QuarterHourlyZoneConsumption(models.Model):
     datetime = models.DateTimeField()
     consumption = models.DecimalField(max_digits=13, decimal_places=3, null=True)
 
+    class Meta:
+        unique_together = ('zone_id', 'datetime')
+
     def __str__(self):
         return self.datetime.strftime("%Y-%m-%d %H:%M") + " (" + self.zone_id.name + ")"
 
@@ -892,6 +970,9 @@ class DailyZoneConsumption(models.Model):
     p_evening = models.DecimalField(max_digits=13, decimal_places=3, default=0, blank=True)
     p_nighttime = models.DecimalField(max_digits=13, decimal_places=3, default=0, blank=True)
 
+    class Meta:
+        unique_together = ('zone_id', 'date')
+
     def __str__(self):
         return self.date.strftime("%Y %b. %d") + " (" + self.zone_id.name + ")"
 
@@ -905,6 +986,9 @@ class MonthlyZoneConsumption(models.Model):
     p_week3 = models.DecimalField(max_digits=13, decimal_places=6, default=0, blank=True)
     p_week4 = models.DecimalField(max_digits=13, decimal_places=6, default=0, blank=True)
 
+    class Meta:
+        unique_together = ('zone_id', 'date')
+
     def __str__(self):
         return self.date.strftime("%B, %Y") + " (" + self.zone_id.name + ")"
 
@@ -917,6 +1001,9 @@ class YearlyZoneConsumption(models.Model):
     p_quarter3 = models.DecimalField(max_digits=13, decimal_places=3, default=0, blank=True)
     p_quarter4 = models.DecimalField(max_digits=13, decimal_places=3, default=0, blank=True)
 
+    class Meta:
+        unique_together = ('zone_id', 'year')
+
     def __str__(self):
         return str(self.year) + " (" + self.zone_id.name + ")"
 
@@ -950,6 +1037,12 @@ class HourlyAvgZonePressure(models.Model):
     zone = models.ForeignKey(to=Zone, on_delete=models.DO_NOTHING)
     time = models.DateTimeField()
     azp = models.DecimalField(max_digits=10, decimal_places=5)
+    # hours rolled up before the number of points was stored count as a single point (migration 0014): points added
+    # to them later weigh as much as all those they held
+    weight = models.IntegerField(default=1)
+
+    class Meta:
+        unique_together = ('zone', 'time')
 
 class DailyAvgZonePressure(models.Model):
     zone = models.ForeignKey(to=Zone, on_delete=models.DO_NOTHING)
@@ -957,6 +1050,9 @@ class DailyAvgZonePressure(models.Model):
     azp = models.DecimalField(max_digits=10, decimal_places=5)
     weight = models.IntegerField()
 
+    class Meta:
+        unique_together = ('zone', 'date')
+
     def __str__(self):
         return f"{self.date.strftime('%Y %b. %d')} ({self.zone.name})"
 
@@ -966,6 +1062,9 @@ class MonthlyAvgZonePressure(models.Model):
     azp = models.DecimalField(max_digits=10, decimal_places=5)
     weight = models.IntegerField()
 
+    class Meta:
+        unique_together = ('zone', 'date')
+
     def __str__(self):
         return f"{self.date.strftime('%B %Y')} ({self.zone.name})"
 
@@ -975,6 +1074,9 @@ class YearlyAvgZonePressure(models.Model):
     azp = models.DecimalField(max_digits=10, decimal_places=5)
     weight = models.IntegerField()
 
+    class Meta:
+        unique_together = ('zone', 'year')
+
     def __str__(self):
         return f"{self.year} ({self.zone.name})"
 
@@ -985,6 +1087,9 @@ class QuarterHourlyTSMInflow(models.Model):
     datetime = models.DateTimeField()
     consumption = models.DecimalField(max_digits=13, decimal_places=3, null=True)
 
+    class Meta:
+        unique_together = ('transmission_line', 'datetime')
+
     def __str__(self):
         return self.datetime.strftime("%Y-%m-%d %H:%M") + " (" + self.transmission_line.key + ")"
 
@@ -993,6 +1098,9 @@ class DailyTSMInflow(models.Model):
     date = models.DateField()
     consumption = models.DecimalField(max_digits=13, decimal_places=3, null=True)
 
+    class Meta:
+        unique_together = ('transmission_line', 'date')
+
     def __str__(self):
         return self.date.strftime("%Y %b. %d") + " (" + self.transmission_line.key.name + ")"
 
@@ -1002,6 +1110,9 @@ class MonthlyTSMInflow(models.Model):
     consumption = models.DecimalField(max_digits=13, decimal_places=3, null=True)
     billed_consumption = models.DecimalField(max_digits=13, decimal_places=3, null=True)
 
+    class Meta:
+        unique_together = ('transmission_line', 'date')
+
     def __str__(self):
         return self.date.strftime("%B, %Y") + " (" + self.transmission_line.key + ")"
 
@@ -1010,6 +1121,9 @@ class YearlyTSMInflow(models.Model):
     year = models.IntegerField()
     consumption = models.DecimalField(max_digits=13, decimal_places=3, null=True)
 
+    class Meta:
+        unique_together = ('transmission_line', 'year')
+
     def __str__(self):
         return str(self.year) + " (" + self.transmission_line.key + ")"
 
@@ -1018,6 +1132,9 @@ class DailyTSMLossRecord(models.Model):
     date = models.DateField()
     loss = models.DecimalField(max_digits=13, decimal_places=3, null=True)
 
+    class Meta:
+        unique_together = ('transmission_line', 'date')
+
     def __str__(self):
         return self.date.strftime("%Y %b. %d") + " (" + self.transmission_line.key + ")"
 
@@ -1026,6 +1143,9 @@ class MonthlyTSMLossRecord(models.Model):
     date = models.DateField()
     loss = models.DecimalField(max_digits=13, decimal_places=3, null=True)
 
+    class Meta:
+        unique_together = ('transmission_line', 'date')
+
     def __str__(self):
         return self.date.strftime("%B, %Y") + " (" + self.transmission_line.key + ")"
 
@@ -1034,15 +1154,116 @@ class YearlyTSMLossRecord(models.Model):
     year = models.IntegerField()
     loss = models.DecimalField(max_digits=13, decimal_places=3, null=True)
 
+    class Meta:
+        unique_together = ('transmission_line', 'year')
+
     def __str__(self):
         return str(self.year) + " (" + self.transmission_line.key + ")"
 
 
+# Meter Consumption
+class QuarterHourlyMeterConsumption(models.Model):
+    meter = models.ForeignKey(Meter, models.CASCADE, related_name='qh_consumption_set')
+    datetime = models.DateTimeField()
+    consumption = models.DecimalField(max_digits=13, decimal_places=3)
+
+    class Meta:
+        unique_together = ('meter', 'datetime')
+
+    def __str__(self):
+        return self.datetime.strftime("%Y-%m-%d %H:%M") + " (" + self.meter.key + ")"
+
+class DailyMeterConsumption(models.Model):
+    meter = models.ForeignKey(Meter, models.CASCADE, related_name='daily_consumption_set')
+    date = models.DateField()
+    consumption = models.DecimalField(max_digits=13, decimal_places=3)
+
+    class Meta:
+        unique_together = ('meter', 'date')
+        indexes = [models.Index(fields=['date', 'meter'])]
+
+    def __str__(self):
+        return self.date.strftime("%Y %b. %d") + " (" + self.meter.key + ")"
+
+class MonthlyMeterConsumption(models.Model):
+    meter = models.ForeignKey(Meter, models.CASCADE, related_name='monthly_consumption_set')
+    date = models.DateField()
+    consumption = models.DecimalField(max_digits=13, decimal_places=3)
+
+    class Meta:
+        unique_together = ('meter', 'date')
+        indexes = [models.Index(fields=['date', 'meter'])]
+
+    def __str__(self):
+        return self.date.strftime("%B, %Y") + " (" + self.meter.key + ")"
+
+
+# Meter Flow Rates
+# The volume that flowed through a meter over a number of seconds: between two of its pulses, the later one at `time`,
+# or summed over the intervals ending within an hour or a day. Flow rates are in volume per hour.
+class MeterFlowRate(models.Model):
+    meter = models.ForeignKey(Meter, models.CASCADE, related_name='flow_rate_set')
+    time = models.DateTimeField()
+    volume = models.DecimalField(max_digits=13, decimal_places=3)
+    seconds = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('meter', 'time')
+        indexes = [models.Index(fields=['time', 'meter'])]
+
+    @property
+    def flow_rate(self):
+        return self.volume * 3600 / self.seconds if self.seconds else None
+
+    def __str__(self):
+        return self.time.strftime("%Y-%m-%d %H:%M") + " (" + self.meter.key + ")"
+
+class HourlyMeterFlowRate(models.Model):
+    meter = models.ForeignKey(Meter, models.CASCADE, related_name='hourly_flow_rate_set')
+    datetime = models.DateTimeField()
+    volume = models.DecimalField(max_digits=13, decimal_places=3)
+    seconds = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('meter', 'datetime')
+        indexes = [models.Index(fields=['datetime', 'meter'])]
+
+    @property
+    def flow_rate(self):
+        return self.volume * 3600 / self.seconds if self.seconds else None
+
+    def __str__(self):
+        return self.datetime.strftime("%Y-%m-%d %H:00") + " (" + self.meter.key + ")"
+
+class DailyMeterFlowRate(models.Model):
+    meter = models.ForeignKey(Meter, models.CASCADE, related_name='daily_flow_rate_set')
+    date = models.DateField()
+    volume = models.DecimalField(max_digits=13, decimal_places=3)
+    seconds = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('meter', 'date')
+        indexes = [models.Index(fields=['date', 'meter'])]
+
+    @property
+    def flow_rate(self):
+        return self.volume * 3600 / self.seconds if self.seconds else None
+
+    def __str__(self):
+        return self.date.strftime("%Y %b. %d") + " (" + self.meter.key + ")"
+
+
 # Chlorine Levels
 class HourlyAvgChlorineLevel(models.Model):
     sensor = models.ForeignKey(to=ChlorineSensor, on_delete=models.PROTECT)
     time = models.DateTimeField()
     level = models.DecimalField(max_digits=13, decimal_places=3)
+    # hours rolled up before the number of points was stored count as a single point (migration 0014): points added
+    # to them later weigh as much as all those they held
+    weight = models.IntegerField(default=1)
+
+    class Meta:
+        unique_together = ('sensor', 'time')
 
     def __str__(self):
         return f"{self.time.strftime(settings.DATETIME_FORMAT)} ({self.sensor.key}) : {self.level}"
@@ -1053,6 +1274,9 @@ class DailyAvgChlorineLevel(models.Model):
     level = models.DecimalField(max_digits=13, decimal_places=3)
     weight = models.IntegerField()
 
+    class Meta:
+        unique_together = ('sensor', 'date')
+
     def __str__(self):
         return f"{self.date.strftime(settings.DATE_FORMAT)} ({self.sensor.key}) : {self.level}"
 
@@ -1062,6 +1286,9 @@ class MonthlyAvgChlorineLevel(models.Model):
     level = models.DecimalField(max_digits=13, decimal_places=3)
     weight = models.IntegerField()
 
+    class Meta:
+        unique_together = ('sensor', 'date')
+
     def __str__(self):
         return f"{self.date.strftime('%B %Y')} ({self.sensor.key}) : {self.level}"
 
@@ -1071,6 +1298,9 @@ class YearlyAvgChlorineLevel(models.Model):
     level = models.DecimalField(max_digits=13, decimal_places=3)
     weight = models.IntegerField()
 
+    class Meta:
+        unique_together = ('sensor', 'year')
+
     def __str__(self):
         return f"{self.year} ({self.sensor.key}) : {self.level}"
 
@@ -1082,6 +1312,65 @@ class TankLevel(models.Model):
     def __str__(self):
         return f"{self.tank} | ({self.datetime.strftime(settings.DATETIME_FORMAT)})"
 
+
+class Annotation(models.Model):
+    """
+    Marks the points of a metric's series, from `since` to `until` included, of the entity with `entity_id`: a meter
+    for meter flow rates, a zone for zone consumption. A range of points is one annotation, however many there are.
+    """
+    INTERPOLATION, ANOMALY, ESTIMATION_CONFIDENCE = 1, 2, 3
+    METER_FLOWRATE, ZONE_CONSUMPTION = 1, 2
+
+    metric = models.PositiveSmallIntegerField(choices=METRIC_TYPES)
+    entity_id = models.PositiveIntegerField()
+    kind = models.PositiveSmallIntegerField(choices=ANNOTATION_TYPES)
+    since = models.DateTimeField()
+    until = models.DateTimeField()
+    value = models.DecimalField(max_digits=7, decimal_places=3, blank=True, null=True)
+    description = models.CharField(max_length=250, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # series read the annotations overlapping their time range, see `annotations.annotations_of`
+            models.Index(fields=['metric', 'until', 'entity_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} of {self.get_metric_display()} ({self.entity_id}) | " \
+               f"{self.since.strftime(settings.DATETIME_FORMAT)} - {self.until.strftime(settings.DATETIME_FORMAT)}"
+
+
+class SlowRequest(models.Model):
+    """ One of the slowest profiled requests of the last days, see `profiling.RequestProfilingMiddleware`. """
+    endpoint = models.CharField(max_length=255, db_index=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    status = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField(db_index=True)
+    db_ms = models.FloatField()
+    queries = models.PositiveIntegerField()
+    duplicated_queries = models.PositiveIntegerField(help_text="Queries repeating an earlier query of the request")
+    duplicates = models.TextField(blank=True, help_text="Repeated query fingerprints, with how many times they ran")
+    recorded_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['-duration_ms']
+
+    def __str__(self):
+        return f"{self.method} {self.endpoint} | {self.duration_ms:.0f}ms, {self.queries} queries"
+
+
+class WaterBalanceRevision(models.Model):
+    """
+    Counts the changes to the figures of a closed month: its consumption, losses or billing. Cached water balances
+    are keyed by the revisions of their months, see `water_balance.water_balance`.
+    """
+    month = models.DateField(unique=True)
+    revision = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.month.strftime('%B %Y')} | revision {self.revision}"
+
 # deprecated:
 class HourlyAvgConsumption(models.Model):
     zone = models.ForeignKey(to=Zone, on_delete=models.CASCADE, related_name='hourly_averages')
@@ -0,0 +1,76 @@
+import base64
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class TimeKeysetPagination(BasePagination):
+    """
+    Forward-only keyset pagination over `(time, id)`, for the time-series models.
+
+    The cursor of the next page holds the `(time, id)` of the last row of the current one, and the next page is
+    fetched with `WHERE (time, id) > cursor ORDER BY time, id LIMIT page_size`, which the composite indexes on
+    `time, id` answer with a range scan. Unlike `OFFSET` pagination, a deep page costs the same as the first one.
+    """
+    page_size = 500
+    max_page_size = 5000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by('time', 'id')
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            time, pk = cursor
+            # the redundant `time >= cursor` bound lets the database seek the index instead of filtering all rows
+            queryset = queryset.filter(time__gte=time).filter(Q(time__gt=time) | Q(id__gt=pk))
+
+        rows = list(queryset[:page_size + 1])
+        self.page = rows[:page_size]
+        self.has_next = len(rows) > page_size
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            time, pk = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            time, pk = parse_datetime(time), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if time is None:
+            raise NotFound(self.invalid_cursor_message)
+        return time, pk
+
+    def encode_cursor(self, row) -> str:
+        return base64.urlsafe_b64encode(f"{row.time.isoformat()}|{row.id}".encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
@@ -0,0 +1,173 @@
+import datetime as dt
+import logging
+import re
+import time
+from collections import Counter
+from typing import List, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from . import metrics
+from .models import SlowRequest
+from .tools import get_now
+
+lg = logging.getLogger(__name__)
+
+""" QUERY FINGERPRINTS """
+
+_IN_LIST = re.compile(r"\(\s*%s(?:\s*,\s*%s)+\s*\)")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+
+
+def fingerprint(sql: str) -> str:
+    """
+    Reduces a query to its shape: literals become `?` and parameter lists of any length `(...)`, so that the queries
+    of a loop, an N+1, share a fingerprint.
+    """
+    sql = _IN_LIST.sub("(...)", sql)
+    sql = _STRING.sub("?", sql)
+    return _NUMBER.sub("?", sql)
+
+
+""" REQUEST PROFILES """
+
+
+class RequestProfile:
+    """ The queries of a request, and the time spent running them. Also the execute wrapper that records them. """
+
+    def __init__(self):
+        self.fingerprints = Counter()
+        self.db_seconds = 0
+        self.started = time.perf_counter()
+        self.seconds = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def finish(self) -> None:
+        self.seconds = time.perf_counter() - self.started
+
+    @property
+    def queries(self) -> int:
+        return sum(self.fingerprints.values())
+
+    @property
+    def python_seconds(self) -> float:
+        return self.seconds - self.db_seconds
+
+    def duplicates(self) -> List[Tuple[str, int]]:
+        """ The fingerprints of queries run more than once, most repeated first. """
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count > 1]
+
+    def duplicated_queries(self) -> int:
+        """ Queries that repeat an earlier query of the request. """
+        return sum(count - 1 for _, count in self.duplicates())
+
+    def server_timing(self) -> str:
+        """ Renders the profile as a `Server-Timing` header, listing the most repeated query fingerprints. """
+        escape = lambda text: text.replace('\\', r'\\').replace('"', r'\"')
+        metrics = [
+            f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries"',
+            f'python;dur={self.python_seconds * 1000:.1f}',
+            f'total;dur={self.seconds * 1000:.1f}',
+            f'duplicates;desc="{self.duplicated_queries()} duplicated queries"',
+        ]
+        for idx, (sql, count) in enumerate(self.duplicates()[:settings.REQUEST_PROFILING_DUPLICATES], 1):
+            sql = " ".join(sql.split())
+            sql = sql if len(sql) <= 120 else sql[:117] + "..."
+            metrics.append(f'dup{idx};desc="{count}x {escape(sql)}"')
+        # header values must be latin-1, and query text can hold anything
+        return ", ".join(metrics).encode('latin-1', 'replace').decode('latin-1')
+
+
+SLOW_REQUEST_THRESHOLD_KEY = 'profiling:slow-request-threshold'
+
+
+def slow_request_threshold() -> float:
+    """
+    Prunes the `SlowRequest` table down to the `REQUEST_PROFILING_TOP` slowest requests of the last
+    `REQUEST_PROFILING_DAYS`, and returns the duration, in milliseconds, a request must exceed to join them. Both are
+    done once per `REQUEST_PROFILING_PRUNE_SECONDS` across processes, the threshold being cached in between.
+    """
+    threshold = cache.get(SLOW_REQUEST_THRESHOLD_KEY)
+    if threshold is not None:
+        return threshold
+
+    top = settings.REQUEST_PROFILING_TOP
+    SlowRequest.objects.filter(recorded_at__lt=get_now() - dt.timedelta(days=settings.REQUEST_PROFILING_DAYS))\
+        .delete()
+    evicted = SlowRequest.objects.order_by('-duration_ms').values_list('id', flat=True)[top:]
+    SlowRequest.objects.filter(id__in=list(evicted)).delete()
+    slowest = SlowRequest.objects.order_by('-duration_ms').values_list('duration_ms', flat=True)[top - 1:top]
+    threshold = slowest[0] if slowest else 0
+    cache.set(SLOW_REQUEST_THRESHOLD_KEY, threshold, settings.REQUEST_PROFILING_PRUNE_SECONDS)
+    return threshold
+
+
+def record_slow_request(request, response, profile: RequestProfile) -> None:
+    """
+    Keeps the request in the `SlowRequest` table if it's slower than the `slow_request_threshold`. Faster requests
+    cost a cache lookup and no query. Between prunes the table can hold a few more than the slowest requests kept.
+    """
+    duration_ms = round(profile.seconds * 1000, 3)
+    if duration_ms <= slow_request_threshold():
+        return
+
+    match = request.resolver_match
+    SlowRequest.objects.create(
+        endpoint=(match.route or match.view_name) if match else request.path[:255],
+        method=request.method,
+        path=request.path[:255],
+        status=response.status_code,
+        duration_ms=duration_ms,
+        db_ms=round(profile.db_seconds * 1000, 3),
+        queries=profile.queries,
+        duplicated_queries=profile.duplicated_queries(),
+        duplicates="\n".join(f"{count}x {sql}" for sql, count in profile.duplicates()),
+    )
+
+
+class RequestProfilingMiddleware:
+    """
+    Profiles requests: their queries, duplicated query fingerprints, and the time spent in the database and in
+    Python. Profiles are returned in a `Server-Timing` header, and the slowest are kept in the `SlowRequest` table.
+
+    Every request is profiled when `REQUEST_PROFILING` is on. Otherwise, a request asks to be with an `X-Profile`
+    header, which is honoured from staff users and from requests bearing the `METRICS_TOKEN`. Requests that aren't
+    profiled only cost a lookup of the setting and the header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.profiled(request):
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        with connection.execute_wrapper(profile):
+            response = self.get_response(request)
+        profile.finish()
+
+        response['Server-Timing'] = profile.server_timing()
+        try:
+            record_slow_request(request, response, profile)
+        except Exception:
+            lg.exception("failed to record a slow request")
+        return response
+
+    @staticmethod
+    def profiled(request) -> bool:
+        if settings.REQUEST_PROFILING:
+            return True
+        if 'HTTP_X_PROFILE' not in request.META:
+            return False
+        return metrics.authorized(request)
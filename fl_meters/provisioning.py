@@ -0,0 +1,131 @@
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from .models import Meter, MeterModel, Zone, TransmissionLine, Location, Customer, MeterToken
+
+""" BULK DEVICE PROVISIONING """
+
+BATCH_SIZE = 1000
+
+
+def _missing_ids(model, ids) -> set:
+    """ Returns the ids among `ids` that don't exist for `model`, using a single query. """
+    ids = set(filter(None, ids))
+    return ids - set(model.objects.filter(id__in=ids).values_list('id', flat=True))
+
+
+def validate_devices(devices: List[dict]) -> None:
+    """
+    Checks the references of already-cleaned device rows set-wise: one query per referenced table, no matter
+    how many devices there are. Raises a `ValidationError` mapping each bad row's index to its errors.
+    """
+    errors = defaultdict(list)
+
+    missing_models = _missing_ids(MeterModel, (device['meter_model'] for device in devices))
+    missing_zones = _missing_ids(
+        Zone, [device.get(field) for device in devices for field in ('input_for', 'output_for')])
+    missing_tsms = _missing_ids(
+        TransmissionLine, [device.get(field) for device in devices for field in ('tsm_input', 'tsm_output')])
+
+    # a transmission line has a single input meter and a single output meter
+    tsm_usage = {field: Counter(device[field] for device in devices if device.get(field))
+                 for field in ('tsm_input', 'tsm_output')}
+    taken_tsms = {
+        field: set(Meter.objects.filter(**{field + '__in': usage}).values_list(field + '_id', flat=True))
+        if usage else set()
+        for field, usage in tsm_usage.items()
+    }
+
+    for idx, device in enumerate(devices):
+        zones = [device.get('input_for'), device.get('output_for')]
+        tsms = [device.get('tsm_input'), device.get('tsm_output')]
+
+        if device['meter_model'] in missing_models:
+            errors[idx].append(f"Meter model ({device['meter_model']}) does not exist")
+        for zone_id in filter(lambda zone_id: zone_id in missing_zones, zones):
+            errors[idx].append(f"Zone ({zone_id}) does not exist")
+        for tsm_id in filter(lambda tsm_id: tsm_id in missing_tsms, tsms):
+            errors[idx].append(f"Transmission line ({tsm_id}) does not exist")
+
+        if not any(zones + tsms):
+            errors[idx].append("Meter must be associated with either a zone or a transmission line")
+        elif any(zones) and any(tsms):
+            errors[idx].append("Meter can't be associated with a zone and a transmission line")
+        elif zones[0] is not None and zones[0] == zones[1]:
+            errors[idx].append("Can't have same zone as input and output")
+        elif tsms[0] is not None and tsms[0] == tsms[1]:
+            errors[idx].append("Can't have same transmission line as input and output")
+
+        for field, taken in taken_tsms.items():
+            tsm_id = device.get(field)
+            if tsm_id and (tsm_id in taken or tsm_usage[field][tsm_id] > 1):
+                errors[idx].append(f"Transmission line ({tsm_id}) already has an {field.split('_')[1]} meter")
+
+    if errors:
+        raise ValidationError(dict(errors))
+
+
+def _bulk_create_with_ids(model, objs):
+    """ Bulk creates `objs`, falling back to saving them one by one if the database can't return their ids. """
+    if connection.features.can_return_ids_from_bulk_insert:
+        return model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+    for obj in objs:
+        obj.save()
+    return objs
+
+
+def provision_meters(devices: List[dict]) -> List[Dict]:
+    """
+    Creates meters, along with their locations, customers and auth tokens, for already-cleaned device rows.
+    Every table is written with bulk statements inside a single transaction, so either all devices are
+    provisioned or none are.
+
+    :param devices: Dicts in the shape of `DeviceSerializer.validated_data`.
+    :return: The `id`, `key` and `token` of each created meter, in the order of `devices`.
+    """
+    validate_devices(devices)
+
+    with transaction.atomic():
+        locations = {}
+        for idx, device in enumerate(devices):
+            if device.get('location'):
+                locations[idx] = Location(
+                    description=device['location'], city=device.get('city', ''),
+                    neighbourhood=device.get('neighbourhood', ''), bldg_no=device.get('bldg_no', ''),
+                    zone_id=device.get('input_for'))
+        _bulk_create_with_ids(Location, list(locations.values()))
+
+        meters = []
+        for idx, device in enumerate(devices):
+            meter = Meter(
+                meter_model_id=device['meter_model'], location=locations.get(idx),
+                input_for_id=device.get('input_for'), output_for_id=device.get('output_for'),
+                tsm_input_id=device.get('tsm_input'), tsm_output_id=device.get('tsm_output'),
+                serial_number=device.get('serial_number', ''))
+            for field in ('reading_factor', 'reading_offset', 'installation_date'):
+                if device.get(field) is not None:
+                    setattr(meter, field, device[field])
+            meters.append(meter)
+        Meter.objects.bulk_create(meters, batch_size=BATCH_SIZE)
+
+        if any(meter.pk is None for meter in meters):
+            # the database couldn't return the ids of the inserted rows; keys are unique, so look them up by key
+            ids = dict(Meter.objects.filter(key__in=[meter.key for meter in meters]).values_list('key', 'id'))
+            for meter in meters:
+                meter.pk = ids[meter.key]
+
+        Customer.objects.bulk_create([
+            Customer(meter=meter, name=device['customer_name'], customer_type=device['customer_type'],
+                     phone_number=device.get('phone_number', ''), email=device.get('email', ''))
+            for meter, device in zip(meters, devices) if device.get('customer_name')
+        ], batch_size=BATCH_SIZE)
+
+        tokens = [MeterToken(user=meter) for meter in meters]
+        for token in tokens:
+            token.key = token.generate_key()
+        MeterToken.objects.bulk_create(tokens, batch_size=BATCH_SIZE)
+
+    return [{'id': meter.pk, 'key': meter.key, 'token': token.key} for meter, token in zip(meters, tokens)]
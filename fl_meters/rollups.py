@@ -0,0 +1,439 @@
+import datetime as dt
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+import pytz
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import DateTimeField, F, Max, Min, Sum, ExpressionWrapper
+from django.db.models.functions import TruncHour
+
+from .models import QuarterHourlyZoneConsumption, DailyZoneConsumption, MonthlyZoneConsumption, \
+    YearlyZoneConsumption, QuarterHourlyTSMInflow, DailyTSMInflow, MonthlyTSMInflow, YearlyTSMInflow, \
+    DailyTSMLossRecord, MonthlyTSMLossRecord, YearlyTSMLossRecord, HourlyAvgZonePressure, DailyAvgZonePressure, \
+    MonthlyAvgZonePressure, YearlyAvgZonePressure, HourlyAvgChlorineLevel, DailyAvgChlorineLevel, \
+    MonthlyAvgChlorineLevel, YearlyAvgChlorineLevel, QuarterHourlyMeterConsumption, DailyMeterConsumption, \
+    MonthlyMeterConsumption, HourlyMeterFlowRate, DailyMeterFlowRate
+from .water_balance import revise_months
+
+""" ROLLUP LEVELS """
+
+# A point of a metric is added at the start of the period it was measured over: the start of its quarter hour, or
+# the day itself for metrics measured daily. Each level keys the point to one of its periods.
+Start = Union[dt.datetime, dt.date]
+
+
+def _day_of(start: Start) -> dt.date:
+    return start.astimezone(pytz.utc).date() if isinstance(start, dt.datetime) else start
+
+
+class Level:
+    """
+    A period a metric is rolled up to. `key` returns the period a point starting at `start` falls in, as stored in
+    the period field of the level's tables, and `bound` the period a bound of a read falls in.
+    """
+
+    def __init__(self, name: str, key: Callable[[Start], object], bound: Callable[[Start], object] = None):
+        self.name = name
+        self.key = key
+        self.bound = bound or key
+
+    def __repr__(self):
+        return f"Level({self.name})"
+
+
+# quarter hours are stored at the time they end at, and read between times
+QUARTER_HOUR = Level('quarter_hour', lambda start: start.astimezone(pytz.utc) + dt.timedelta(minutes=settings.RIE),
+                     lambda time: time)
+HOUR = Level('hour', lambda start: start.astimezone(pytz.utc).replace(minute=0, second=0, microsecond=0))
+DAY = Level('day', _day_of)
+MONTH = Level('month', lambda start: _day_of(start).replace(day=1))
+YEAR = Level('year', lambda start: _day_of(start).year)
+
+LEVELS = {level.name: level for level in (QUARTER_HOUR, HOUR, DAY, MONTH, YEAR)}
+
+""" PARTITIONS """
+
+
+class Partition:
+    """
+    Splits the periods of a level into parts, each stored in a column of the level's table next to the total. A point
+    is added to the column `column_of` its start, as well as to the total.
+    """
+
+    def __init__(self, columns: Tuple[str, ...], column_of: Callable[[Start], str]):
+        self.columns = columns
+        self.column_of = column_of
+
+
+def _time_of_day(start: dt.datetime) -> str:
+    hour = start.astimezone(pytz.utc).hour
+    started = [name for name, first_hour in settings.DAY_PARTITIONS if first_hour <= hour]
+    # hours before the first partition starts belong to the last one, which runs past midnight
+    return f'p_{started[-1] if started else settings.DAY_PARTITIONS[-1][0]}'
+
+
+TIME_OF_DAY = Partition(('p_dawn', 'p_noon', 'p_afternoon', 'p_evening', 'p_nighttime'), _time_of_day)
+# the fourth week of a month runs to its end
+WEEK_OF_MONTH = Partition(('p_week1', 'p_week2', 'p_week3', 'p_week4'),
+                          lambda start: f'p_week{min((_day_of(start).day - 1) // 7, 3) + 1}')
+QUARTER_OF_YEAR = Partition(('p_quarter1', 'p_quarter2', 'p_quarter3', 'p_quarter4'),
+                            lambda start: f'p_quarter{(_day_of(start).month - 1) // 3 + 1}')
+
+""" ROLLUPS """
+
+SUM, MEAN, MIN, MAX = 'sum', 'mean', 'min', 'max'
+
+
+class Rollup:
+    """
+    A metric of an entity, rolled up into a table per level. Declared once, with the `entity` foreign key its
+    tables share, the `fields` it rolls up, how they're aggregated (`SUM`, `MEAN`, `MIN` or `MAX`), and the
+    `(model, period field)` of each level. The tables of a `MEAN` rollup also hold the number of points averaged,
+    in `weight`. The periods of a `SUM` rollup of a single field can also be split by a `Partition` per level.
+    Callbacks given `on_write` for a level are called with the periods written to it, within the write's
+    transaction.
+
+    Points are written with `add`, and read back with `totals` and `series`. Within `batched`, they're buffered and
+    written once per entity instead.
+    """
+
+    def __init__(self, name: str, entity: str, fields: Tuple[str, ...], aggregation: str,
+                 levels: Dict[Level, Tuple[type, str]], weight: str = 'weight',
+                 partitions: Dict[Level, Partition] = None, on_write: Dict[Level, Callable[[List], None]] = None):
+        if aggregation not in (SUM, MEAN, MIN, MAX):
+            raise ValueError(f"Unknown aggregation {aggregation!r}")
+        if partitions and (aggregation != SUM or len(fields) > 1):
+            raise ValueError("Only rollups summing a single field can be partitioned")
+        self.name = name
+        self.entity = entity
+        self.fields = fields
+        self.aggregation = aggregation
+        self.levels = levels
+        self.weight = weight if aggregation == MEAN else None
+        self.partitions = partitions or {}
+        self.on_write = on_write or {}
+
+    def __repr__(self):
+        return f"Rollup({self.name})"
+
+    def _entity_attname(self, model) -> str:
+        return model._meta.get_field(self.entity).attname
+
+    """ WRITE PATH """
+
+    def add(self, entity_id: int, points: Iterable[Tuple[Start, object]]) -> None:
+        """
+        Adds points of an entity to every level, each a `(start, value)` pair, the value being a tuple of the
+        rollup's fields if it has more than one. Each level runs a single query to read the periods the points fall
+        in and one to write each of updated and new periods, however many points there are. All levels are written
+        in one transaction. Points are added to the partition columns of their periods in the same writes.
+        """
+        batch = getattr(_batches, 'current', None)
+        if batch is not None and self in batch.rollups:
+            batch.points.append((self, entity_id, list(points)))
+            return
+        self._add(entity_id, points)
+
+    def flush(self, entity_id: int) -> None:
+        """ Writes the points of an entity buffered by `batched` right away, so reads that follow see them. """
+        batch = getattr(_batches, 'current', None)
+        if batch is not None:
+            batch.flush(self, entity_id)
+
+    def _add(self, entity_id: int, points: Iterable[Tuple[Start, object]]) -> None:
+        points = [(start, value if len(self.fields) > 1 else (value,)) for start, value in points]
+        if not points:
+            return
+
+        with transaction.atomic():
+            for level, (model, period_field) in self.levels.items():
+                batches = defaultdict(list)
+                for start, values in points:
+                    batches[level.key(start)].append((start, values))
+                self._write(level, entity_id, batches)
+
+    def _write(self, level: Level, entity_id: int, batches: Dict[object, List[Tuple[Start, tuple]]]) -> None:
+        self._store(level, entity_id, batches)
+        if level in self.on_write:
+            self.on_write[level](list(batches))
+
+    def _store(self, level: Level, entity_id: int, batches: Dict[object, List[Tuple[Start, tuple]]]) -> None:
+        """
+        Folds batches of points into the rows of their periods. Locking the rows read doesn't keep a concurrent write
+        from creating the periods that were missing: if it did, the insert conflicts with the periods' unique
+        constraint, and the missing periods are stored again, this time added to the rows it created.
+        """
+        model, period_field = self.levels[level]
+        partition = self.partitions.get(level)
+        attname = self._entity_attname(model)
+        existing = {getattr(row, period_field): row for row in model.objects.select_for_update()
+                    .filter(**{attname: entity_id, f'{period_field}__in': list(batches)})}
+
+        created, updated = [], []
+        for period, batch in batches.items():
+            row = existing.get(period)
+            stored = row is not None
+            if not stored:
+                row = model(**{attname: entity_id, period_field: period})
+            self._combine(row, [values for _, values in batch], stored)
+            if partition is not None:
+                for start, (value,) in batch:
+                    column = partition.column_of(start)
+                    setattr(row, column, (getattr(row, column) or 0) + (value or 0))
+            (updated if stored else created).append(row)
+
+        if updated:
+            columns = list(self.fields) + ([self.weight] if self.weight else []) + \
+                list(partition.columns if partition is not None else ())
+            model.objects.bulk_update(updated, columns)
+        if created:
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create(created)
+            except IntegrityError:
+                self._store(level, entity_id, {getattr(row, period_field): batches[getattr(row, period_field)]
+                                               for row in created})
+
+    def _combine(self, row, batch: List[tuple], stored: bool) -> None:
+        """ Folds a batch of points into a row's fields, which hold nothing yet unless `stored`. """
+        weight = getattr(row, self.weight) if self.weight and stored else 0
+        for idx, field in enumerate(self.fields):
+            values = [values[idx] for values in batch]
+            current = getattr(row, field) if stored else None
+            if self.aggregation == SUM:
+                setattr(row, field, (current or 0) + sum(values))
+            elif self.aggregation == MEAN:
+                setattr(row, field, ((current or 0) * weight + sum(values)) / (weight + len(values)))
+            else:
+                pick = min if self.aggregation == MIN else max
+                setattr(row, field, pick(values if current is None else [current, *values]))
+        if self.weight:
+            setattr(row, self.weight, weight + len(batch))
+
+    """ READ PATH """
+
+    def _aggregate(self, model, field: str):
+        if self.aggregation == SUM:
+            return {'value': Sum(field)}
+        if self.aggregation == MEAN:
+            weighted = ExpressionWrapper(F(field) * F(self.weight), output_field=model._meta.get_field(field))
+            return {'value': Sum(weighted), 'weight': Sum(self.weight)}
+        return {'value': (Min if self.aggregation == MIN else Max)(field)}
+
+    def _grouped(self, level: Level, since: Start, until: Start, group_by: str, entity_ids: List[int] = None,
+                 field: str = None) -> Dict[object, object]:
+        model, period_field = self.levels[level]
+        field = field or self.fields[0]
+        rows = model.objects.filter(**{f'{period_field}__gte': level.bound(since),
+                                       f'{period_field}__lte': level.bound(until)})
+        if entity_ids is not None:
+            rows = rows.filter(**{f'{self._entity_attname(model)}__in': entity_ids})
+        group_by = self._entity_attname(model) if group_by == 'entity' else period_field
+
+        grouped = {}
+        for row in rows.values(group_by).annotate(**self._aggregate(model, field)).order_by(group_by):
+            value = row['value']
+            if self.aggregation == MEAN and value is not None:
+                value = value / row['weight']
+            grouped[row[group_by]] = value
+        return grouped
+
+    def totals(self, level: Level, since: Start, until: Start, entity_ids: List[int] = None,
+               field: str = None) -> Dict[int, object]:
+        """
+        Returns the value of each entity over the periods of a level from `since` to `until`, both included, in a
+        single query. Entities without periods in the range are left out. Reads the rollup's first field, unless
+        another is given.
+        """
+        return self._grouped(level, since, until, 'entity', entity_ids, field)
+
+    def series(self, level: Level, since: Start, until: Start, entity_ids: List[int] = None,
+               field: str = None) -> Dict[object, object]:
+        """
+        Returns the value of each period of a level from `since` to `until`, over all the entities or the given
+        ones, in a single query. Periods without rows are left out.
+        """
+        return self._grouped(level, since, until, 'period', entity_ids, field)
+
+    """ PARTITION BACKFILL """
+
+    def backfill_partitions(self, entity_ids: List[int] = None, batch_size: int = 100) -> Dict[Level, int]:
+        """
+        Recomputes the partition columns of every level from the rollup's quarter hours, summed by entity and hour so
+        partitions can't split an hour. Periods without quarter hours get empty partitions.
+
+        Entities are backfilled `batch_size` at a time, each batch in a transaction of its own: its rows are locked
+        at every level before its quarter hours are summed, so points added to the batch meanwhile wait for it
+        instead of being overwritten, while other entities are written to as usual.
+
+        :return: The number of rows written at each level.
+        """
+        if entity_ids is None:
+            entity_ids = self._partitioned_entities()
+        written = defaultdict(int)
+        for first in range(0, len(entity_ids), batch_size):
+            batch = entity_ids[first:first + batch_size]
+            with transaction.atomic():
+                rows = {}
+                for level, partition in self.partitions.items():
+                    model, period_field = self.levels[level]
+                    entity = self._entity_attname(model)
+                    rows[level] = list(model.objects.select_for_update().filter(**{f'{entity}__in': batch})
+                                       .only('id', entity, period_field, *partition.columns))
+                sums = self._partition_sums(batch)
+
+                for level, partition in self.partitions.items():
+                    model, period_field = self.levels[level]
+                    entity = self._entity_attname(model)
+                    for row in rows[level]:
+                        parts = sums[level].get((getattr(row, entity), getattr(row, period_field)), {})
+                        for column in partition.columns:
+                            setattr(row, column, parts.get(column, 0))
+                    model.objects.bulk_update(rows[level], list(partition.columns))
+                    written[level] += len(rows[level])
+        return dict(written)
+
+    def _partitioned_entities(self) -> List[int]:
+        """ Returns the entities with rows at any partitioned level, in a single query. """
+        queries = [model.objects.values_list(self._entity_attname(model), flat=True)
+                   for model, _ in (self.levels[level] for level in self.partitions)]
+        return sorted(queries[0].union(*queries[1:]))
+
+    def _partition_sums(self, entity_ids: List[int]) -> Dict[Level, Dict[tuple, Dict[str, Decimal]]]:
+        """
+        Sums the quarter hours of entities by hour, in a single query, into the partition columns of each period of
+        every partitioned level, keyed by `(entity, period)`.
+        """
+        qh_model, qh_field = self.levels[QUARTER_HOUR]
+        field, = self.fields
+        entity = self._entity_attname(qh_model)
+        start = ExpressionWrapper(F(qh_field) - dt.timedelta(minutes=settings.RIE), output_field=DateTimeField())
+        hours = qh_model.objects.filter(**{f'{field}__isnull': False, f'{entity}__in': entity_ids})\
+            .annotate(start=start).values(entity, hour=TruncHour('start', tzinfo=pytz.utc))\
+            .annotate(value=Sum(field)).order_by().values_list(entity, 'hour', 'value')
+
+        sums = {level: defaultdict(lambda: defaultdict(Decimal)) for level in self.partitions}
+        for entity_id, hour, value in hours.iterator():
+            for level, partition in self.partitions.items():
+                sums[level][(entity_id, level.key(hour))][partition.column_of(hour)] += value
+        return sums
+
+
+""" BATCHES """
+
+_batches = threading.local()
+
+
+class Batch:
+    """
+    The points added to some rollups while `batched`, in the order they were added, until they're flushed. A
+    savepoint taken with `atomic` keeps the buffer in step with the database: if it's rolled back, the points
+    buffered within it are dropped and the ones flushed within it are buffered again.
+    """
+
+    def __init__(self, rollups: Tuple[Rollup, ...]):
+        self.rollups = rollups
+        self.points = []
+
+    @contextmanager
+    def atomic(self):
+        points = list(self.points)
+        try:
+            with transaction.atomic():
+                yield
+        except Exception:
+            self.points = points
+            raise
+
+    def flush(self, rollup: Rollup = None, entity_id: int = None) -> None:
+        """ Writes the buffered points of an entity of a rollup, or all of them, in a single `add` per entity. """
+        pending, kept = defaultdict(list), []
+        for entry in self.points:
+            added_to, added_for, points = entry
+            if (rollup is None or added_to is rollup) and (entity_id is None or added_for == entity_id):
+                pending[(added_to, added_for)].extend(points)
+            else:
+                kept.append(entry)
+        self.points = kept
+        for (added_to, added_for), points in pending.items():
+            added_to._add(added_for, points)
+
+
+@contextmanager
+def batched(*rollups: Rollup):
+    """
+    Buffers the points added to the given rollups in this thread, and writes them once per entity on leaving the
+    block, unless it raised. Saving many pulses in a row would otherwise write the same periods of a zone or a meter
+    once per pulse. Reads within the block don't see buffered points until they're flushed, see `Rollup.flush`.
+    Nested blocks share the outermost one's batch.
+
+    :return: The `Batch`.
+    """
+    batch = getattr(_batches, 'current', None)
+    if batch is not None:
+        yield batch
+        return
+    batch = _batches.current = Batch(rollups)
+    try:
+        yield batch
+        batch.flush()
+    finally:
+        _batches.current = None
+
+
+""" METRICS """
+
+# the balances of closed months are cached, so rollups feeding them revise the months they change
+
+ZONE_CONSUMPTION = Rollup('zone_consumption', 'zone_id', ('consumption',), SUM, {
+    QUARTER_HOUR: (QuarterHourlyZoneConsumption, 'datetime'),
+    DAY: (DailyZoneConsumption, 'date'),
+    MONTH: (MonthlyZoneConsumption, 'date'),
+    YEAR: (YearlyZoneConsumption, 'year'),
+}, partitions={DAY: TIME_OF_DAY, MONTH: WEEK_OF_MONTH, YEAR: QUARTER_OF_YEAR}, on_write={MONTH: revise_months})
+
+TSM_INFLOW = Rollup('tsm_inflow', 'transmission_line', ('consumption',), SUM, {
+    QUARTER_HOUR: (QuarterHourlyTSMInflow, 'datetime'),
+    DAY: (DailyTSMInflow, 'date'),
+    MONTH: (MonthlyTSMInflow, 'date'),
+    YEAR: (YearlyTSMInflow, 'year'),
+}, on_write={MONTH: revise_months})
+
+TSM_LOSS = Rollup('tsm_loss', 'transmission_line', ('loss',), SUM, {
+    DAY: (DailyTSMLossRecord, 'date'),
+    MONTH: (MonthlyTSMLossRecord, 'date'),
+    YEAR: (YearlyTSMLossRecord, 'year'),
+}, on_write={MONTH: revise_months})
+
+ZONE_PRESSURE = Rollup('zone_pressure', 'zone', ('azp',), MEAN, {
+    HOUR: (HourlyAvgZonePressure, 'time'),
+    DAY: (DailyAvgZonePressure, 'date'),
+    MONTH: (MonthlyAvgZonePressure, 'date'),
+    YEAR: (YearlyAvgZonePressure, 'year'),
+})
+
+CHLORINE_LEVEL = Rollup('chlorine_level', 'sensor', ('level',), MEAN, {
+    HOUR: (HourlyAvgChlorineLevel, 'time'),
+    DAY: (DailyAvgChlorineLevel, 'date'),
+    MONTH: (MonthlyAvgChlorineLevel, 'date'),
+    YEAR: (YearlyAvgChlorineLevel, 'year'),
+})
+
+METER_CONSUMPTION = Rollup('meter_consumption', 'meter', ('consumption',), SUM, {
+    QUARTER_HOUR: (QuarterHourlyMeterConsumption, 'datetime'),
+    DAY: (DailyMeterConsumption, 'date'),
+    MONTH: (MonthlyMeterConsumption, 'date'),
+})
+
+# the raw intervals are kept apart, in `MeterFlowRate`, keyed by the time of the pulse closing them
+METER_FLOW = Rollup('meter_flow', 'meter', ('volume', 'seconds'), SUM, {
+    HOUR: (HourlyMeterFlowRate, 'datetime'),
+    DAY: (DailyMeterFlowRate, 'date'),
+})
+
+ROLLUPS = {rollup.name: rollup for rollup in (ZONE_CONSUMPTION, TSM_INFLOW, TSM_LOSS, ZONE_PRESSURE, CHLORINE_LEVEL,
+                                              METER_CONSUMPTION, METER_FLOW)}
@@ -7,6 +7,7 @@
 from pytz import utc
 
 from .models import Zone, PressurePulse, Alert, LossRecord, HourlyAvgZonePressure, Notification
+from .water_balance import revise_months
 from django.conf import settings
 
 lg = logging.getLogger(__name__)
@@ -74,6 +75,7 @@ def end_of_mnf_period_handler(mnf_start: dt.datetime, mnf_end: dt.datetime, zone
             alert = Alert.objects.create(zone=zone, loss_amount=loss_amount-zone.burst_threshold, kind='LK')
             notify_client(alert)
         LossRecord.objects.create(zone=zone, amount=loss_amount, date=mnf_end.date())
+        revise_months([mnf_end.date()])
 
 def notify_client(alert):
     for user in User.objects.filter(groups__name='Client'):
@@ -1,10 +1,76 @@
 import datetime
+from decimal import Decimal
+from typing import List
 
 from django.core.serializers.json import DjangoJSONEncoder
 from rest_framework import serializers
 
 from .fields import TimestampField
-from .models import Meter, Pulse, PressurePulse, ChlorineSensorPulse
+from .models import Meter, Pulse, PressurePulse, PressureTransmitter, ChlorineSensorPulse, CUSTOMER_TYPE
+from .tools import parse_reading
+
+
+def check_fits(value: Decimal, column) -> None:
+    """ Raises a `ValidationError` unless `value` can be stored in a `DecimalField` column without overflowing it. """
+    whole_digits = column.max_digits - column.decimal_places
+    if abs(round(value, column.decimal_places)) >= Decimal(10) ** whole_digits:
+        raise serializers.ValidationError(f"Reading ({value}) has more than {whole_digits} digits before the decimal "
+                                          f"point")
+
+
+class ReadingField(serializers.CharField):
+    """
+    A raw reading, kept as sent but rejected unless it's a number that fits the `raw_reading` column: no more
+    digits before the decimal point, nor decimal places, than it holds.
+    """
+    def __init__(self, column=Pulse._meta.get_field('raw_reading'), **kwargs):
+        self.column = column
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        reading = super().to_internal_value(data)
+        try:
+            value = parse_reading(reading)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        check_fits(value, self.column)
+        if -value.normalize().as_tuple().exponent > self.column.decimal_places:
+            raise serializers.ValidationError(f"Reading ({reading}) has more than {self.column.decimal_places} "
+                                              f"decimal places")
+        return reading
+
+
+class NormalizedReadingValidator:
+    """
+    Rejects readings that don't fit the `normalized_reading` column once the factor and offset of their device are
+    applied, which would fail the pulse's save instead.
+    """
+    device_model = None
+    device_field = None
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        device = self.device_model.objects.filter(id=attrs[f'{self.device_field}_id'])\
+            .only('reading_factor', 'reading_offset').first()
+        if device is not None:
+            normalized = device.reading_offset + parse_reading(attrs['reading']) * device.reading_factor
+            try:
+                check_fits(normalized, self.Meta.model._meta.get_field('normalized_reading'))
+            except serializers.ValidationError as e:
+                raise serializers.ValidationError({'reading': e.detail})
+        return attrs
+
+
+def validate_device_readings(device, readings: List[str], model=Pulse) -> None:
+    """
+    Runs readings of a device that didn't come through a serializer, such as the ones of a binary frame, through the
+    checks of `ReadingField` and `NormalizedReadingValidator`. Raises a `ValidationError` for the first that fails.
+    """
+    field = ReadingField(column=model._meta.get_field('raw_reading'), max_length=16)
+    normalized_column = model._meta.get_field('normalized_reading')
+    for reading in readings:
+        field.run_validation(reading)
+        check_fits(device.reading_offset + parse_reading(reading) * device.reading_factor, normalized_column)
 
 
 class PulseField(serializers.Field):
@@ -36,20 +102,22 @@ class Meta:
         )
 
 
-class PulseSerializer(serializers.ModelSerializer):
+class PulseSerializer(NormalizedReadingValidator, serializers.ModelSerializer):
+    device_model, device_field = Meter, 'meter'
     time = serializers.DateTimeField(default=datetime.datetime.now, required=False)
     meter_id = serializers.IntegerField(required=True)
-    reading = serializers.CharField(max_length=16, required=True)
+    reading = ReadingField(max_length=16, required=True)
 
     class Meta:
         model = Pulse
         fields = ('id', 'meter_id', 'reading', 'time')
         read_only_fields = ('time',)
 
-class TimestampedPulseSerializer(serializers.ModelSerializer):
+class TimestampedPulseSerializer(NormalizedReadingValidator, serializers.ModelSerializer):
+    device_model, device_field = Meter, 'meter'
     time = TimestampField(required=True)
     meter_id = serializers.IntegerField(required=True)
-    reading = serializers.CharField(max_length=16, required=True)
+    reading = ReadingField(max_length=16, required=True)
 
     class Meta:
         model = Pulse
@@ -57,10 +125,11 @@ class Meta:
         read_only_fields = ('time',)
 
 
-class TimestampedPressurePulseSerializer(serializers.ModelSerializer):
+class TimestampedPressurePulseSerializer(NormalizedReadingValidator, serializers.ModelSerializer):
+    device_model, device_field = PressureTransmitter, 'transmitter'
     time = TimestampField(required=True)
     transmitter_id = serializers.IntegerField(required=True)
-    reading = serializers.CharField(max_length=16, required=True)
+    reading = ReadingField(max_length=16, required=True)
 
     class Meta:
         model = PressurePulse
@@ -68,10 +137,11 @@ class Meta:
         read_only_fields = ('time',)
 
 
-class PressurePulseSerializer(serializers.ModelSerializer):
+class PressurePulseSerializer(NormalizedReadingValidator, serializers.ModelSerializer):
+    device_model, device_field = PressureTransmitter, 'transmitter'
     time = serializers.DateTimeField(default=datetime.datetime.now, required=False)
     transmitter_id = serializers.IntegerField(required=True)
-    reading = serializers.CharField(max_length=16, required=True)
+    reading = ReadingField(max_length=16, required=True)
 
     class Meta:
         model = PressurePulse
@@ -87,6 +157,34 @@ class Meta:
         fields = ('sensor', 'reading', 'time')
 
 
+class DeviceSerializer(serializers.Serializer):
+    """ A meter to be provisioned through `provisioning.provision_meters`. References are validated set-wise there. """
+    meter_model = serializers.IntegerField()
+    input_for = serializers.IntegerField(required=False, allow_null=True)
+    output_for = serializers.IntegerField(required=False, allow_null=True)
+    tsm_input = serializers.IntegerField(required=False, allow_null=True)
+    tsm_output = serializers.IntegerField(required=False, allow_null=True)
+    serial_number = serializers.CharField(max_length=32, required=False, allow_blank=True)
+    reading_factor = serializers.DecimalField(max_digits=9, decimal_places=2, required=False)
+    reading_offset = serializers.DecimalField(max_digits=12, decimal_places=5, required=False)
+    installation_date = serializers.DateTimeField(required=False)
+
+    location = serializers.CharField(required=False, allow_blank=True)
+    city = serializers.CharField(max_length=32, required=False, allow_blank=True)
+    neighbourhood = serializers.CharField(max_length=48, required=False, allow_blank=True)
+    bldg_no = serializers.CharField(max_length=8, required=False, allow_blank=True)
+
+    customer_name = serializers.CharField(max_length=48, required=False, allow_blank=True)
+    customer_type = serializers.ChoiceField(choices=CUSTOMER_TYPE, required=False)
+    phone_number = serializers.CharField(max_length=14, required=False, allow_blank=True)
+    email = serializers.CharField(max_length=32, required=False, allow_blank=True)
+
+    def validate(self, attrs):
+        if attrs.get('customer_name') and 'customer_type' not in attrs:
+            raise serializers.ValidationError({'customer_type': "A customer type is required for a customer."})
+        return attrs
+
+
 class SinceUntilSerializer(serializers.Serializer):
     since = serializers.DateTimeField()
     until = serializers.DateTimeField()
@@ -1,21 +1,26 @@
 import datetime as dt
 import logging
+from decimal import Decimal
+from typing import List
+
 import pytz
 
-from django.db.models import Q
+from django.db import IntegrityError, transaction
+from django.db.models import Q, F
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.conf import settings
 
-from .models import Meter, MeterToken, Pulse, QuarterHourlyZoneConsumption, DailyZoneConsumption, \
-    MonthlyZoneConsumption, YearlyZoneConsumption, OnHold, Zone, PressurePulse, DailyAvgZonePressure, \
-    MonthlyAvgZonePressure, YearlyAvgZonePressure, HourlyAvgZonePressure, TransmissionLine, DailyTSMInflow, \
-    MonthlyTSMInflow, QuarterHourlyTSMInflow, YearlyTSMInflow, YearlyTSMLossRecord, MonthlyTSMLossRecord,\
-    DailyTSMLossRecord, ChlorineSensorPulse, DailyAvgChlorineLevel, HourlyAvgChlorineLevel, MonthlyAvgChlorineLevel,\
-    YearlyAvgChlorineLevel
+from .models import Meter, MeterToken, Pulse, QuarterHourlyZoneConsumption, OnHold, PressurePulse, \
+    TransmissionLine, ChlorineSensorPulse, MeterFlowRate, Annotation
+from .annotations import add_annotation
+from .interpolation import interpolate_gap
+from .metrics import instrumented, lap
+from .rollups import ZONE_CONSUMPTION, TSM_INFLOW, TSM_LOSS, ZONE_PRESSURE, CHLORINE_LEVEL, METER_CONSUMPTION, \
+    METER_FLOW
 from .scripts import end_of_mnf_period_handler
 from .tools import is_midnight, ries_between, consumption_between_two_pulses, get_sisters_of_pulse, \
-    get_last_sisters_of_zone, datetime_ticks
+    get_last_sisters_of_zone, datetime_ticks, consumption_between_readings, period_end_of
 
 lg = logging.getLogger(__name__)
 
@@ -26,6 +31,7 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
 
 
 @receiver(post_save, sender=Pulse)
+@instrumented
 def on_flow_meter_pulse(sender, instance=None, created=False, **kwargs):
     instance: Pulse
     if created:
@@ -39,11 +45,15 @@ def on_flow_meter_pulse(sender, instance=None, created=False, **kwargs):
 
         pulse_time = (instance.time.astimezone(pytz.utc)).replace(second=0, microsecond=0)
 
+        update_meter_consumption(instance)
+        lap('meter_consumption')
+
         # this pulse is coming from a meter installed on a transmission line
         if instance.meter.tsm_input_id or instance.meter.tsm_output_id:
             lg.info(f"starting transmission line analysis of pulse ID:{instance.id} from meter ID:{instance.meter_id}")
             # check if pulse was awaited for
             on_hold_entries = [on_hold for on_hold in OnHold.objects.all() if on_hold.is_awaiting(instance)]
+            lap('onhold_scan')
 
             already_processed = set()
             for on_hold in on_hold_entries:
@@ -78,6 +88,7 @@ def on_flow_meter_pulse(sender, instance=None, created=False, **kwargs):
                         create_loss_record(loss_day, on_hold.transmission_line)
 
                     on_hold.delete()
+            lap('onhold_release')
 
             for transmission_line in (instance.meter.tsm_input, instance.meter.tsm_output):
                 if transmission_line is None:
@@ -104,6 +115,7 @@ def on_flow_meter_pulse(sender, instance=None, created=False, **kwargs):
                         lg.info(f"Inflow Record @({pulse_time.strftime(settings.VERBOSE_DATETIME_FORMAT)}) for tsm ({on_hold.transmission_line}) is being created on arrival of pulse ({instance!r})")
                         create_inflow_record(pulse_time, transmission_line)
                         on_hold.delete()
+            lap('onhold_create')
 
         # this pulse is coming from a meter installed on a zone border
         else:
@@ -118,9 +130,11 @@ def on_flow_meter_pulse(sender, instance=None, created=False, **kwargs):
                 if current_sisters is None:
                     # Not all sisters have arrived yet.
                     lg.debug(f"skipping pulse because not all sisters have arrived yet")
+                    lap('sister_lookup')
                     continue
 
                 previous_sisters = get_last_sisters_of_zone(zone)
+                lap('sister_lookup')
                 if previous_sisters is None:
                     # previous_sisters will be None when no base pulses exist to calculate delta meter reading from
                     lg.debug(f"skipping pulse because no base sisters exist")
@@ -140,6 +154,7 @@ def on_flow_meter_pulse(sender, instance=None, created=False, **kwargs):
                 for previous_pulse, current_pulse in zip(previous_sisters_outputs, current_sisters_outputs):
                     output_sum += consumption_between_two_pulses(previous_pulse, current_pulse, current_pulse.meter.meter_model.digits)
                 period_consumption = input_sum - output_sum
+                lap('zone_consumption')
 
                 # Update analytics tables. Fill if gap is detected
                 current_time = current_sisters[0].time
@@ -153,67 +168,32 @@ def on_flow_meter_pulse(sender, instance=None, created=False, **kwargs):
                         logging.debug(f"Gap is too large. Reseting...")
 
                         rie = previous_time
-                        offset_date = (rie-dt.timedelta(minutes=settings.RIE)).date()
-
                         logging.debug(f"resetting at time: {rie.strftime(settings.VERBOSE_DATETIME_FORMAT)}")
+                        ZONE_CONSUMPTION.add(zone.id, [(get_offset_time(rie), 0)])
 
-                        consumption_per_rie = 0
-
-                        QuarterHourlyZoneConsumption.objects.create(zone_id=zone, datetime=rie, consumption=consumption_per_rie)
-
-                        daily_record, daily_record_created = DailyZoneConsumption.objects.get_or_create(
-                            zone_id_id=zone.id, date=offset_date, defaults={'consumption': consumption_per_rie})
-                        if not daily_record_created:
-                            daily_record.consumption += consumption_per_rie
-                            daily_record.save()
-
-                        monthly_record, monthly_record_created = MonthlyZoneConsumption.objects.get_or_create(
-                            zone_id_id=zone.id, date=offset_date.replace(day=1), defaults={'consumption': consumption_per_rie})
-                        if not monthly_record_created:
-                            monthly_record.consumption += consumption_per_rie
-                            monthly_record.save()
-
-                        yearly_record, yearly_record_created = YearlyZoneConsumption.objects.get_or_create(
-                            zone_id_id=zone.id, year=offset_date.year, defaults={'consumption': consumption_per_rie})
-                        if not yearly_record_created:
-                            yearly_record.consumption += consumption_per_rie
-                            yearly_record.save()
-
+                        add_annotation(Annotation.ZONE_CONSUMPTION, zone.id, Annotation.ANOMALY, previous_time,
+                                       current_time, "Gap too large to fill, consumption reset to 0")
                         logging.warning(f"Large Gap Reseting Complete")
+                        lap('zone_rollups')
 
                         continue
 
-                consumption_per_rie = period_consumption / len(ticks_between)
-
-                for rie in ticks_between:
-                    offset_date = (rie-dt.timedelta(minutes=settings.RIE)).date()
-
-                    QuarterHourlyZoneConsumption.objects.create(
-                        zone_id=zone, datetime=rie, consumption=consumption_per_rie)
-
-                    daily_record, daily_record_created = DailyZoneConsumption.objects.get_or_create(
-                        zone_id_id=zone.id, date=offset_date, defaults={'consumption': consumption_per_rie})
-                    if not daily_record_created:
-                        daily_record.consumption += consumption_per_rie
-                        daily_record.save()
-
-                    monthly_record, monthly_record_created = MonthlyZoneConsumption.objects.get_or_create(
-                        zone_id_id=zone.id, date=offset_date.replace(day=1), defaults={'consumption': consumption_per_rie})
-                    if not monthly_record_created:
-                        monthly_record.consumption += consumption_per_rie
-                        monthly_record.save()
-
-                    yearly_record, yearly_record_created = YearlyZoneConsumption.objects.get_or_create(
-                        zone_id_id=zone.id, year=offset_date.year, defaults={'consumption': consumption_per_rie})
-                    if not yearly_record_created:
-                        yearly_record.consumption += consumption_per_rie
-                        yearly_record.save()
+                if len(ticks_between) > 1:
+                    # strategies read the zone's history, which may still be buffered by a batch insert
+                    ZONE_CONSUMPTION.flush(zone.id)
+                consumptions = interpolate_gap(zone, ticks_between[0], len(ticks_between), period_consumption)
+                add_zone_consumption(zone, ticks_between, consumptions)
+                if len(ticks_between) > 1:
+                    add_annotation(Annotation.ZONE_CONSUMPTION, zone.id, Annotation.INTERPOLATION, ticks_between[0],
+                                   ticks_between[-1], "Consumption interpolated over a gap between pulses")
+                lap('zone_rollups')
 
         # run celery task to detect anomalies each for previous day
         if instance.time.hour == 0 and instance.time.minute > 15:
             from fl_meters.tasks import label_anomalies
             day = (instance.time - dt.timedelta(days=1)).date().isoformat()
             label_anomalies(day)
+            lap('anomaly_labelling')
 
 @receiver(post_save, sender=PressurePulse)
 def on_pressure_transmitter_pulse(sender, instance=None, created=False, **kwargs):
@@ -230,156 +210,142 @@ def on_chlorine_sensor_pulse(sender, instance=None, created=False, **kwargs):
         update_chlorine_levels_analytics(instance)
 
 
+@instrumented
 def update_analytics(zone, *, period_start=None, period_end=None):
     if period_start is None or period_end is None:
         raise Exception("Period start and end times must be supplied.")
 
     consumption = zone.calculate_delta_consumption(period_start, period_end)
-
-    QuarterHourlyZoneConsumption.objects.create(
-        zone_id_id=zone.id,
-        consumption=consumption,
-        datetime=period_end
-    )
+    lap('zone_consumption')
 
     # if a past pulse is missing, consumption will be None and the only analytics entry that will
     # be created is a QuarterHourly record with a consumption of null.
     if consumption is None:
+        QuarterHourlyZoneConsumption.objects.create(zone_id_id=zone.id, consumption=None, datetime=period_end)
         return
 
-    offset_day = period_start.date()
-
-    # now update other accumulative ZATs
-    daily_record, daily_record_created = DailyZoneConsumption.objects.get_or_create(
-        zone_id_id=zone.id,
-        date=offset_day,
-        defaults={
-            'zone_id_id': zone.id,
-            'date': offset_day,
-            'consumption': consumption
-        })
-    if not daily_record_created:
-        daily_record.consumption += consumption
-        daily_record.save()
-
-    monthly_record, monthly_record_created = MonthlyZoneConsumption.objects.get_or_create(
-        zone_id_id=zone.id,
-        date=offset_day.replace(day=1),
-        defaults={
-            'zone_id_id': zone.id,
-            'date': offset_day.replace(day=1),
-            'consumption': consumption
-        })
-    if not monthly_record_created:
-        monthly_record.consumption += consumption
-        monthly_record.save()
-    logging.getLogger(__name__).info(f"Monthly Record:{monthly_record_created}")
-
-    yearly_record, yearly_record_created = YearlyZoneConsumption.objects.get_or_create(
-        zone_id_id=zone.id,
-        year=offset_day.year,
-        defaults={
-           'zone_id_id': zone.id,
-           'year': offset_day.year,
-           'consumption': consumption
-       })
-    if not yearly_record_created:
-        yearly_record.consumption += consumption
-        yearly_record.save()
-
-    lg.info(
-        f"Consumption Records Updated: For Zone ({zone}) Updated Successfully. "
-        f"QH @({period_end.strftime(settings.VERBOSE_DATETIME_FORMAT)}) CREATED VALUE({consumption}) "
-        f"Daily @({daily_record.date.strftime(settings.VERBOSE_DATE_FORMAT)}) {'CREATED' if daily_record_created else 'UPDATED'} VALUE({daily_record.consumption}) "
-        f"Monthly  @({monthly_record.date.strftime(settings.VERBOSE_DATE_FORMAT)}) {'CREATED' if monthly_record_created else 'UPDATED'} VALUE({monthly_record.consumption}) "
-        f"Yearly @({yearly_record.year}) {'CREATED' if yearly_record_created else 'UPDATED'} VALUE({yearly_record.consumption})"
-    )
+    ZONE_CONSUMPTION.add(zone.id, [(get_offset_time(period_end), consumption)])
+    lg.info(f"Consumption Records Updated: For Zone ({zone}) Updated Successfully. "
+            f"QH @({period_end.strftime(settings.VERBOSE_DATETIME_FORMAT)}) ADDED VALUE({consumption})")
+    lap('zone_rollups')
 
     if period_end.time() == dt.time(0, 0, 0):  # Calculate Losses at end of day # Rie
         previous_day = period_end.date() - dt.timedelta(days=1)
         mnf_start = dt.datetime.combine(previous_day, settings.MNF_START).replace(tzinfo=pytz.utc)
         mnf_end = dt.datetime.combine(previous_day, settings.MNF_END).replace(tzinfo=pytz.utc)
         end_of_mnf_period_handler(mnf_start, mnf_end, zone)
+        lap('mnf_handler')
+
+
+def update_meter_consumption(pulse: Pulse):
+    """
+    Adds the consumption since the previous pulse of the meter to the meter's consumption records, and the interval
+    between them to its flow rates. A late pulse splits an interval that was already counted on the pulse following
+    it, so its share is moved over from there. If the interval wasn't counted, the late pulse's is recorded alone.
+    The intervals are annotated on the meter's flow rate series, see `annotate_meter_flow`.
+    """
+    meter = pulse.meter
+    pulses = Pulse.objects.filter(meter_id=meter.id).exclude(id=pulse.id).only('id', 'time', 'reading', 'raw_reading')
+    previous_pulse = pulses.filter(time__lte=pulse.time).order_by('-time', '-id').first()
+    if previous_pulse is not None and previous_pulse.time == pulse.time:
+        lg.info(f"skipping consumption of duplicate pulse ID:{pulse.id} from meter ID:{meter.id}")
+        return
+    next_pulse = pulses.filter(time__gt=pulse.time).order_by('time', 'id').first()
+
+    if previous_pulse is not None:
+        seconds = round((pulse.time - previous_pulse.time).total_seconds())
+        consumption = meter_interval_consumption(meter, previous_pulse, pulse, seconds)
+        add_meter_consumption(meter.id, pulse.time, consumption)
+        add_meter_flow(meter.id, pulse.time, consumption, seconds)
+        annotate_meter_flow(meter.id, previous_pulse.time, pulse.time, consumption)
+        if next_pulse is not None:
+            add_meter_consumption(meter.id, next_pulse.time, -consumption)
+            # the interval of a pulse saved before flow rates were recorded was never counted, so there's no share
+            # of it to take away
+            if MeterFlowRate.objects.filter(meter_id=meter.id, time=next_pulse.time).exists():
+                add_meter_flow(meter.id, next_pulse.time, -consumption, -seconds)
+            add_annotation(Annotation.METER_FLOWRATE, meter.id, Annotation.ANOMALY, previous_pulse.time,
+                           next_pulse.time, "Interval split by a pulse that arrived late")
+    elif next_pulse is not None:
+        seconds = round((next_pulse.time - pulse.time).total_seconds())
+        consumption = meter_interval_consumption(meter, pulse, next_pulse, seconds)
+        add_meter_consumption(meter.id, next_pulse.time, consumption)
+        add_meter_flow(meter.id, next_pulse.time, consumption, seconds)
+        annotate_meter_flow(meter.id, pulse.time, next_pulse.time, consumption)
+
+
+def meter_interval_consumption(meter, since: Pulse, until: Pulse, seconds: int):
+    """
+    Returns the consumption between two pulses of a meter, `seconds` apart. When its counter could cycle more than
+    once between them, whole cycles are counted at the rate the meter registered over its interval before `since`,
+    the one more query this takes.
+    """
+    model = meter.meter_model
+    rate = None
+    if model.max_flow_rate is not None and model.max_flow_rate * seconds >= 10 ** model.digits and meter.reading_factor:
+        interval = MeterFlowRate.objects.filter(meter_id=meter.id, time__lte=since.time, seconds__gt=0)\
+            .order_by('-time').values_list('volume', 'seconds').first()
+        if interval is not None:
+            volume, interval_seconds = interval
+            rate = volume / interval_seconds / meter.reading_factor
+    return consumption_between_readings(since.parsed_reading(), until.parsed_reading(), model.digits,
+                                        meter.reading_factor, seconds, model.max_flow_rate, rate)
+
+
+def annotate_meter_flow(meter_id, since: dt.datetime, until: dt.datetime, consumption):
+    """
+    Annotates the interval of a meter's flow rate between pulses at `since` and `until`: as an anomaly if its
+    reading dropped, or as interpolated if the pulses are further apart than a quarter hour, its flow being spread
+    evenly over the gap.
+    """
+    if consumption < 0:
+        add_annotation(Annotation.METER_FLOWRATE, meter_id, Annotation.ANOMALY, since, until,
+                       "Reading dropped between pulses: back-flow")
+    elif until - since > dt.timedelta(minutes=settings.RIE):
+        add_annotation(Annotation.METER_FLOWRATE, meter_id, Annotation.INTERPOLATION, since, until,
+                       "Flow rate averaged over a gap between pulses")
+
+
+def add_meter_consumption(meter_id, time: dt.datetime, consumption):
+    """ Adds `consumption` to the quarter hour ending at (or right after) `time`, and to its day and month. """
+    METER_CONSUMPTION.add(meter_id, [(get_offset_time(period_end_of(time)), consumption)])
+
+
+def add_zone_consumption(zone, ticks: List[dt.datetime], consumptions: List[Decimal]):
+    """
+    Adds the consumption of a zone's quarter hours ending at `ticks` to them, and to their days, months and years.
+    Each period is written once, however many of the quarter hours fall in it.
+    """
+    ZONE_CONSUMPTION.add(zone.id, [(get_offset_time(tick), consumption)
+                                   for tick, consumption in zip(ticks, consumptions)])
+
+
+def add_meter_flow(meter_id, time: dt.datetime, volume, seconds: int):
+    """
+    Adds `volume` flowed over `seconds` to the meter's interval ending at `time`, and to the hour and day of the
+    quarter hour holding it. A negative `seconds` takes a split interval's share away.
+    """
+    intervals = MeterFlowRate.objects.filter(meter_id=meter_id, time=time)
+    if not intervals.update(volume=F('volume') + volume, seconds=F('seconds') + seconds):
+        try:
+            with transaction.atomic():
+                MeterFlowRate.objects.create(meter_id=meter_id, time=time, volume=volume, seconds=seconds)
+        except IntegrityError:
+            # a concurrent pulse created the interval since
+            intervals.update(volume=F('volume') + volume, seconds=F('seconds') + seconds)
+    METER_FLOW.add(meter_id, [(get_offset_time(period_end_of(time)), (volume, seconds))])
 
 
-
+@instrumented
 def update_pressure_analytics(zone, pulse, azp_factor):
-    offset_time = (pulse.time.astimezone(pytz.utc)) - dt.timedelta(minutes=15)
-    offset_date = offset_time.date()
-    start_of_hour = offset_time.replace(minute=0, second=0, microsecond=0)
-    pulse_reading = pulse.cleaned_reading() * azp_factor
-
-    hourly_record, just_created = HourlyAvgZonePressure.objects.get_or_create(
-        time=start_of_hour, zone=zone, defaults={'zone': zone, 'time': start_of_hour, 'azp': pulse_reading})
-    if not just_created:
-        period_start_time = offset_time.replace(minute=15)
-        period_end_time = period_start_time + dt.timedelta(minutes=45)
-        weight = PressurePulse.objects.filter(time__gte=period_start_time, time__lte=period_end_time).count() - 1  # exclude current pulse
-        hourly_record.azp = weighted_average(hourly_record.azp, weight, pulse_reading)
-        hourly_record.save()
-
-    daily_record, just_created = DailyAvgZonePressure.objects.get_or_create(
-        date=offset_date, zone=zone, defaults={'zone': zone, 'date': offset_date, 'weight': 1, 'azp': pulse_reading})
-    if not just_created:
-        daily_record.azp = weighted_average(daily_record.azp, daily_record.weight, pulse_reading)
-        daily_record.weight += 1
-        daily_record.save()
-
-    monthly_record, just_created = MonthlyAvgZonePressure.objects.get_or_create(
-        date=offset_date.replace(day=1), zone=zone,
-        defaults={'zone': zone, 'date': offset_date.replace(day=1), 'weight': 1, 'azp': pulse_reading})
-    if not just_created:
-        monthly_record.azp = weighted_average(monthly_record.azp, monthly_record.weight, pulse_reading)
-        monthly_record.weight += 1
-        monthly_record.save()
-
-    yearly_record, just_created = YearlyAvgZonePressure.objects.get_or_create(
-        year=offset_date.year, zone=zone,
-        defaults={'zone': zone, 'year': offset_date.year, 'weight': 1, 'azp': pulse_reading})
-    if not just_created:
-        yearly_record.azp = weighted_average(yearly_record.azp, yearly_record.weight, pulse.cleaned_reading())
-        yearly_record.weight += 1
-        yearly_record.save()
+    offset_time = get_offset_time(pulse.time.astimezone(pytz.utc))
+    ZONE_PRESSURE.add(zone.id, [(offset_time, pulse.cleaned_reading() * azp_factor)])
+    lap('pressure_rollups')
 
 def update_chlorine_levels_analytics(pulse: ChlorineSensorPulse):
-    offset_time = (pulse.time.astimezone(pytz.utc)) - dt.timedelta(minutes=15)
-    offset_date = offset_time.date()
-    start_of_hour = offset_time.replace(minute=0, second=0, microsecond=0)
-    pulse_reading = pulse.cleaned_reading()
-
-    hourly_record, just_created = HourlyAvgChlorineLevel.objects.get_or_create(
-        time=start_of_hour, sensor=pulse.sensor, defaults={'level': pulse_reading})
-    if not just_created:
-        period_start_time = offset_time.replace(minute=15)
-        period_end_time = period_start_time + dt.timedelta(minutes=45)
-        weight = ChlorineSensorPulse.objects.filter(time__gte=period_start_time, time__lte=period_end_time).count() - 1  # exclude current pulse
-        hourly_record.level = weighted_average(hourly_record.level, weight, pulse_reading)
-        hourly_record.save()
-
-    daily_record, just_created = DailyAvgChlorineLevel.objects.get_or_create(
-        date=offset_date, sensor=pulse.sensor, defaults={'weight': 1, 'level': pulse_reading})
-    if not just_created:
-        daily_record.level = weighted_average(daily_record.level, daily_record.weight, pulse_reading)
-        daily_record.weight += 1
-        daily_record.save()
-
-    monthly_record, just_created = MonthlyAvgChlorineLevel.objects.get_or_create(
-        date=offset_date.replace(day=1), sensor=pulse.sensor, defaults={'weight': 1, 'level': pulse_reading})
-    if not just_created:
-        monthly_record.level = weighted_average(monthly_record.level, monthly_record.weight, pulse_reading)
-        monthly_record.weight += 1
-        monthly_record.save()
-
-    yearly_record, just_created = YearlyAvgChlorineLevel.objects.get_or_create(
-        year=offset_date.year, sensor=pulse.sensor, defaults={'weight': 1, 'level': pulse_reading})
-    if not just_created:
-        yearly_record.level = weighted_average(yearly_record.level, yearly_record.weight, pulse_reading)
-        yearly_record.weight += 1
-        yearly_record.save()
-
-
-def weighted_average(current_avg, weight, new_value):
-    return (current_avg * weight + new_value) / (weight + 1)
+    offset_time = get_offset_time(pulse.time.astimezone(pytz.utc))
+    CHLORINE_LEVEL.add(pulse.sensor_id, [(offset_time, pulse.cleaned_reading())])
+
 
 def django_orm_adapted_weekday(date):
     return (date.weekday() + 1) % 7 + 1
@@ -387,39 +353,24 @@ def django_orm_adapted_weekday(date):
 def get_offset_time(time: dt.datetime):
     return time - dt.timedelta(minutes=15)
 
+@instrumented
 def create_inflow_record(time: dt.datetime, transmission_line: TransmissionLine) -> None:
     """ Create inflow records for the time period that ends with `time` """
 
     consumption = transmission_line.calculate_inflow_between(get_offset_time(time), time)
+    lap('tsm_inflow')
 
     if consumption is None:
         raise ValueError("Missing Pulses")
 
-    QuarterHourlyTSMInflow.objects.create(transmission_line=transmission_line, datetime=time, consumption=consumption)
-
-    offset_day = get_offset_time(time).date()
-
-    daily_record, created = DailyTSMInflow.objects.get_or_create(
-        date=offset_day, transmission_line=transmission_line, defaults={'consumption': consumption})
-    if not created:
-        daily_record.consumption += consumption
-        daily_record.save()
-
-    monthly_record, created = MonthlyTSMInflow.objects.get_or_create(
-        date=offset_day.replace(day=1), transmission_line=transmission_line, defaults={'consumption': consumption})
-    if not created:
-        monthly_record.consumption += consumption
-        monthly_record.save()
-
-    yearly_record, created = YearlyTSMInflow.objects.get_or_create(
-        year=offset_day.year, transmission_line=transmission_line, defaults={'consumption': consumption})
-    if not created:
-        yearly_record.consumption += consumption
-        yearly_record.save()
+    TSM_INFLOW.add(transmission_line.id, [(get_offset_time(time), consumption)])
+    lap('tsm_rollups')
 
 
+@instrumented
 def create_loss_record(day: dt.date, transmission_line: TransmissionLine):
     loss = transmission_line.calculate_loss_of(day)
+    lap('tsm_loss')
 
     if loss is None:
         raise ValueError("Missing Pulses")
@@ -429,23 +380,8 @@ def create_loss_record(day: dt.date, transmission_line: TransmissionLine):
     else:
         loss -= transmission_line.volume
 
-    daily_record, created = DailyTSMLossRecord.objects.get_or_create(
-        date=day, transmission_line=transmission_line, defaults={'loss': loss})
-    if not created:
-        daily_record.loss += loss
-        daily_record.save()
-
-    monthly_record, created = MonthlyTSMLossRecord.objects.get_or_create(
-        date=day.replace(day=1), transmission_line=transmission_line, defaults={'loss': loss})
-    if not created:
-        monthly_record.loss += loss
-        monthly_record.save()
-
-    yearly_record, created = YearlyTSMLossRecord.objects.get_or_create(
-        year=day.year, transmission_line=transmission_line, defaults={'loss': loss})
-    if not created:
-        yearly_record.loss += loss
-        yearly_record.save()
+    TSM_LOSS.add(transmission_line.id, [(day, loss)])
+    lap('tsm_rollups')
 
 
 
@@ -0,0 +1,135 @@
+import glob
+import logging
+import os
+import struct
+import threading
+import zlib
+from typing import Iterator, List
+
+lg = logging.getLogger(__name__)
+
+""" DURABLE LOCAL SPOOL """
+
+_HEADER = struct.Struct('<II')  # payload length, crc32 of the payload
+
+
+class SpoolFull(Exception):
+    pass
+
+
+def list_segments(directory) -> List[str]:
+    """ Returns the paths of the segments in a spool directory, oldest first. """
+    return sorted(glob.glob(os.path.join(directory, "*.seg")))
+
+
+def read_segment(path) -> Iterator[bytes]:
+    """
+    Yields the payloads of the records in a segment, in the order they were appended. Reading stops at the first
+    record that is truncated or fails its CRC check, which is what a crash in the middle of an append leaves behind.
+    """
+    with open(path, 'rb') as file:
+        while True:
+            header = file.read(_HEADER.size)
+            if not header:
+                return
+            if len(header) == _HEADER.size:
+                length, crc = _HEADER.unpack(header)
+                payload = file.read(length)
+                if len(payload) == length and zlib.crc32(payload) == crc:
+                    yield payload
+                    continue
+            lg.warning(f"dropping the torn tail of spool segment {path} at offset {file.tell()}")
+            return
+
+
+class Spool:
+    """
+    An append-only log of records, split into numbered segment files. Each record is framed with its length and a
+    CRC32 of its payload.
+
+    Appends are made durable with a group fsync: an append returns once its record is on disk, but appends that
+    land while another thread is syncing are all covered by that thread's next fsync, instead of one fsync each.
+    Writing always goes to the active segment; `seal()` closes it and starts the next one, so sealed segments can be
+    read and removed by a consumer while appends go on.
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        """ :param max_bytes: Refuse appends with `SpoolFull` once the segments in the spool take this much space. """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        segments = list_segments(directory)
+        self._size = sum(os.path.getsize(path) for path in segments)
+        # never append to a segment left by a previous run, its tail might be torn
+        self._number = int(os.path.basename(segments[-1])[:-len(".seg")]) + 1 if segments else 1
+        self._file = open(self._path(self._number), 'ab')
+
+        self._lock = threading.Lock()  # guards the active segment
+        self._sync_lock = threading.Lock()  # taken before `_lock` when both are needed
+        self._appended = 0
+        self._synced = 0
+
+    def _path(self, number):
+        return os.path.join(self.directory, f"{number:010d}.seg")
+
+    @property
+    def size(self) -> int:
+        """ The number of bytes taken by the segments in the spool. """
+        return self._size
+
+    def append(self, payload: bytes) -> None:
+        self.append_many([payload])
+
+    def append_many(self, payloads: List[bytes]) -> None:
+        """ Appends records that are made durable together, with a single fsync. """
+        frames = b"".join(_HEADER.pack(len(payload), zlib.crc32(payload)) + payload for payload in payloads)
+        with self._lock:
+            if self.max_bytes is not None and self._size >= self.max_bytes:
+                raise SpoolFull(f"spool {self.directory} holds {self._size} bytes")
+            self._file.write(frames)
+            self._file.flush()
+            self._size += len(frames)
+            self._appended += 1
+            ticket = self._appended
+        self._sync(ticket)
+
+    def _sync(self, ticket):
+        with self._sync_lock:
+            if self._synced >= ticket:
+                return
+            with self._lock:
+                target = self._appended
+            os.fsync(self._file.fileno())
+            self._synced = target
+
+    def seal(self) -> bool:
+        """ Closes the active segment, if anything was appended to it, and starts a new one. """
+        with self._sync_lock, self._lock:
+            if not self._file.tell():
+                return False
+            os.fsync(self._file.fileno())
+            self._synced = self._appended
+            self._file.close()
+            self._number += 1
+            self._file = open(self._path(self._number), 'ab')
+            return True
+
+    def sealed_segments(self) -> List[str]:
+        with self._lock:
+            active = self._path(self._number)
+        return [path for path in list_segments(self.directory) if path != active]
+
+    def remove(self, path) -> None:
+        """ Deletes a sealed segment once its records have been consumed. """
+        size = os.path.getsize(path)
+        os.remove(path)
+        with self._lock:
+            self._size -= size
+
+    def close(self) -> None:
+        with self._sync_lock, self._lock:
+            os.fsync(self._file.fileno())
+            self._file.close()
+            if not os.path.getsize(self._file.name):
+                os.remove(self._file.name)
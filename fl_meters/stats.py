@@ -5,101 +5,48 @@
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Sum
 
-from fl_meters.models import QuarterHourlyTSMInflow, DailyTSMInflow, MonthlyTSMInflow, YearlyTSMInflow, \
-    TransmissionLine, Zone, QuarterHourlyZoneConsumption, DailyZoneConsumption, MonthlyZoneConsumption, \
-    YearlyZoneConsumption, \
-    DailyTSMLossRecord, MonthlyTSMLossRecord, YearlyTSMLossRecord, DailyZoneLoss, MonthlyZoneLoss, YearlyZoneLoss, \
+from fl_meters.models import TransmissionLine, Zone, DailyZoneLoss, MonthlyZoneLoss, YearlyZoneLoss, \
     ChlorineSensor, ChlorineSensorPulse, HourlyAvgChlorineLevel, DailyAvgChlorineLevel, MonthlyAvgChlorineLevel, \
     YearlyAvgChlorineLevel
+from fl_meters.rollups import QUARTER_HOUR, DAY, MONTH, YEAR, ZONE_CONSUMPTION, TSM_INFLOW, TSM_LOSS
 from fl_meters.tools import datetime_ticks, round_down_to_ri
 
+# the rollup level read for each resolution the functions below are asked for
+ROLLUP_LEVELS = {'minutes': QUARTER_HOUR, 'days': DAY, 'months': MONTH, 'yearly': YEAR}
+
 # == Transmission Line-based ==
 
 def inflow_per_transmission_line(since: dt.datetime, until: dt.datetime, aggregator_string) -> Dict[str, Decimal]:
     # TOTEST: since and until are allowed to be equal
     # TOTEST: passing "wrong" datetime mid-month is allowed and is correctly fixed. same thing for other intervals
-
-    def dry_tool(model, since, until, filter_field):
-        return_dict = {
-            # 'tsm.key': 'inflow value'
-        }
-
-        filters = {
-            filter_field + '__gte': since,
-            filter_field + '__lte': until,
-        }
-        for tsm in TransmissionLine.objects.all():
-            return_dict[tsm.key] = model.objects.filter(transmission_line=tsm, **filters).aggregate(Sum('consumption'))['consumption__sum']
-
-        return return_dict
-
-    if aggregator_string == 'minutes':
-        return dry_tool(QuarterHourlyTSMInflow, since, until, 'datetime')
-    elif aggregator_string == 'days':
-        return dry_tool(DailyTSMInflow, since.date(), until.date(), 'date')
-    elif aggregator_string == 'months':
-        return dry_tool(MonthlyTSMInflow, since.date().replace(day=1), until.date().replace(day=1), 'date')
-    elif aggregator_string == 'yearly':
-        return dry_tool(YearlyTSMInflow, since.year, until.year, 'year')
-    else:
+    if aggregator_string not in ROLLUP_LEVELS:
         raise ValueError("Bad Resolution Value")
 
+    totals = TSM_INFLOW.totals(ROLLUP_LEVELS[aggregator_string], since, until)
+    return {tsm.key: totals.get(tsm.id) for tsm in TransmissionLine.objects.only('id', 'key')}
+
 
 def loss_per_transmission_line(since: dt.date, until: dt.date, aggregator_string) -> Dict[str, Decimal]:
     # TOTEST: since and until are allowed to be equal
     # TOTEST: passing "wrong" datetime mid-month is allowed and is correctly fixed. same thing for other intervals
-
-    def dry_tool(model, since, until, filter_field):
-        return_dict = {
-            # 'tsm.key': 'inflow value'
-        }
-
-        filters = {
-            filter_field + '__gte': since,
-            filter_field + '__lte': until
-        }
-
-        for tsm in TransmissionLine.objects.all():
-            return_dict[tsm.key] = model.objects.filter(transmission_line=tsm, **filters).aggregate(Sum('loss'))['loss__sum']
-
-        return return_dict
-
-    if aggregator_string == 'days' or aggregator_string == 'minutes':
-        return dry_tool(DailyTSMLossRecord, since, until, 'date')
-    elif aggregator_string == 'months':
-        return dry_tool(MonthlyTSMLossRecord, since.replace(day=1), until.replace(day=1), 'date')
-    elif aggregator_string == 'yearly':
-        return dry_tool(YearlyTSMLossRecord, since.year, until.year, 'year')
-    else:
+    if aggregator_string not in ROLLUP_LEVELS:
         raise ValueError("Bad Resolution Value")
 
+    # losses are only ever recorded daily
+    level = DAY if aggregator_string == 'minutes' else ROLLUP_LEVELS[aggregator_string]
+    totals = TSM_LOSS.totals(level, since, until)
+    return {tsm.key: totals.get(tsm.id) for tsm in TransmissionLine.objects.only('id', 'key')}
+
 
 # == Zone-based ==
 
 def consumption_per_zone(since: dt.datetime, until: dt.datetime, resolution) -> Dict[str, Decimal]:
-
-    def dry_tool(model, since, until, filter_field):
-        return_dict = {}
-        filters = {
-            filter_field + '__gte': since,
-            filter_field + '__lte': until
-        }
-        for zone in Zone.objects.all():
-            return_dict[zone.name] = model.objects.filter(zone_id=zone, **filters).aggregate(Sum('consumption'))['consumption__sum']
-
-        return return_dict
-
-    if resolution == 'minutes':
-        return dry_tool(QuarterHourlyZoneConsumption, since, until, 'datetime')
-    elif resolution == 'days':
-        return dry_tool(DailyZoneConsumption, since.date(), until.date(), 'date')
-    elif resolution == 'months':
-        return dry_tool(MonthlyZoneConsumption, since.date().replace(day=1), until.date().replace(day=1), 'date')
-    elif resolution == 'yearly':
-        return dry_tool(YearlyZoneConsumption, since.year, until.year, 'year')
-    else:
+    if resolution not in ROLLUP_LEVELS:
         raise ValueError("Bad Resolution Value")
 
+    totals = ZONE_CONSUMPTION.totals(ROLLUP_LEVELS[resolution], since, until)
+    return {zone.name: totals.get(zone.id) for zone in Zone.objects.only('id', 'name')}
+
 
 def loss_per_zone(since: dt.datetime, until: dt.datetime, aggregator_string):
     def dry_tool(model, since, until, filter_field):
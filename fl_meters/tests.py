@@ -1,10 +1,43 @@
-from collections import defaultdict
+import asyncio
+import csv
+import fcntl
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter, defaultdict
 from functools import reduce
+from io import StringIO
+from unittest import mock
 
+import numpy as np
 import pytz
-from django.test import TestCase
-
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from benchmarks.endpoints import run_endpoint_benchmark, QueryBudget, Endpoint
+from benchmarks.ingest import run_ingest_benchmark
+from benchmarks.network import generate_network
+from benchmarks.stream import pulse_stream, StreamFaults
+from fl_meters import downsampling, gateway, interpolation, metrics, profiling, rollups
+from fl_meters.annotations import add_annotation, annotations_of
+from fl_meters.billing import billing_rows, save_billed_consumption
+from fl_meters.capture import CaptureWriter, list_captures, read_captures
+from fl_meters.gateway import IngestGateway, simulate_device
+from fl_meters.management.commands import replay_ingest
+from fl_meters.ingest import PulseWriter, FRAME_HEADER, FRAME_DELTA, decode_pulse_frame, replay_abandoned_spools, \
+    insert_pulses
 from fl_meters.models import *
+from fl_meters.provisioning import provision_meters
+from fl_meters.serializers import TimestampedPulseSerializer
+from fl_meters.spool import Spool, SpoolFull, read_segment
+from fl_meters.tools import interval_consumption, sum_pulses_consumption, consumption_between_two_pulses, \
+    SerialAllocator
+from fl_meters.water_balance import compute_water_balance, water_balance
 from fl_meters.signals import get_offset_time
 
 def setup_zones(self):
@@ -875,3 +908,1122 @@ def test_x(self):
 
 
 
+
+
+@override_settings(SERIAL_BLOCK_SIZE=1)
+class SerialKeysTests(TestCase):
+    def setUp(self):
+        self.red = Zone.objects.create(name='red')
+        self.mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6)
+
+    def test_bulk_created_meters_get_unique_keys(self):
+        Meter.objects.create(meter_model=self.mm, input_for=self.red)
+        Meter.objects.bulk_create(Meter(meter_model=self.mm, input_for=self.red) for _ in range(50))
+
+        keys = list(Meter.objects.values_list('key', flat=True))
+        self.assertEqual(len(keys), 51)
+        self.assertEqual(len(set(keys)), 51)
+        self.assertEqual(Serial.objects.get(model_name="Meter").last_serial_value, 51)
+
+    def test_block_is_reserved_in_one_round_trip(self):
+        next_meter_key()
+        with self.assertNumQueries(4):  # savepoint, locked get, update, release savepoint
+            keys = next_meter_keys(100)
+        self.assertEqual(len(set(keys)), 100)
+        self.assertEqual(Serial.objects.get(model_name="Meter").last_serial_value, 101)
+
+    @override_settings(SERIAL_BLOCK_SIZE=10)
+    def test_blocks_reserved_in_rolled_back_transactions_are_not_cached(self):
+        serials = SerialAllocator("Test")
+        with self.assertRaises(OperationalError), transaction.atomic():
+            self.assertEqual(serials.take(), [1])
+            raise OperationalError
+        # the reservation was rolled back along with the transaction
+        self.assertEqual(serials.take(2), [1, 2])
+
+    def test_chlorine_sensors_have_their_own_counter(self):
+        TransmissionLine.objects.create()
+        ChlorineSensor.objects.create(model=DeviceModel.objects.create(manufacturer='', model_number=''))
+        self.assertEqual(Serial.objects.get(model_name="TransmissionLine").last_serial_value, 1)
+        self.assertEqual(Serial.objects.get(model_name="ChlorineSensor").last_serial_value, 1)
+
+
+class DeviceProvisioningTests(TestCase):
+    def setUp(self):
+        self.red = Zone.objects.create(name='red')
+        self.mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6, bulk_meter=False)
+
+    def test_provisioning_runs_a_fixed_number_of_queries(self):
+        devices = [{'meter_model': self.mm.id, 'input_for': self.red.id,
+                    'customer_name': f"customer {i}", 'customer_type': 2} for i in range(300)]
+
+        with self.assertNumQueries(15):  # independent of the number of devices
+            meters = provision_meters(devices)
+
+        self.assertEqual(len(meters), 300)
+        self.assertEqual(Customer.objects.count(), 300)
+        self.assertEqual(set(MeterToken.objects.values_list('key', flat=True)), {meter['token'] for meter in meters})
+        self.assertEqual(Meter.objects.get(key=meters[0]['key']).customer.name, "customer 0")
+
+    def test_references_are_validated_set_wise(self):
+        tsm = TransmissionLine.objects.create()
+        devices = [
+            {'meter_model': self.mm.id, 'input_for': self.red.id},
+            {'meter_model': self.mm.id + 1, 'input_for': self.red.id + 1},
+            {'meter_model': self.mm.id, 'tsm_input': tsm.id},
+            {'meter_model': self.mm.id, 'tsm_input': tsm.id},
+        ]
+
+        with self.assertRaises(ValidationError) as raised:
+            provision_meters(devices)
+
+        errors = raised.exception.message_dict
+        self.assertEqual(sorted(errors), [1, 2, 3])
+        self.assertEqual(len(errors[1]), 2)
+        self.assertFalse(Meter.objects.exists())
+
+
+class WriteBehindIngestTests(TestCase):
+    def setUp(self):
+        red = Zone.objects.create(name='red')
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6)
+        self.mtr = Meter.objects.create(meter_model=mm, input_for=red, reading_factor=2, reading_offset=17)
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir)
+        self.t0 = dt.datetime(2019, 5, 1, 5, 15, tzinfo=pytz.utc)
+
+    def pulse(self, minutes, reading, meter_id=None):
+        return {'meter_id': meter_id or self.mtr.id, 'time': self.t0 + dt.timedelta(minutes=minutes),
+                'reading': str(reading)}
+
+    def test_pulses_are_spooled_then_saved_in_one_batch(self):
+        writer = PulseWriter(spool_dir=self.spool_dir, batch_size=10, flush_interval=1)
+        for minutes, reading in [(30, 20), (0, 10), (15, 15)]:
+            writer.submit(self.pulse(minutes, reading))
+        self.assertFalse(Pulse.objects.exists())
+
+        self.assertEqual(writer.flush(), 3)
+        pulses = list(Pulse.objects.order_by('id'))
+        self.assertEqual([p.time for p in pulses], sorted(p.time for p in pulses))
+        self.assertEqual([p.normalized_reading for p in pulses], [37, 47, 57])
+        self.assertEqual(writer.spool.sealed_segments(), [])
+        writer.stop()
+
+    def test_rollups_are_written_once_per_batch(self):
+        rows = [self.pulse(minutes, reading) for minutes, reading in [(0, 10), (15, 15), (30, 21), (45, 30)]]
+        with mock.patch.object(rollups.ZONE_CONSUMPTION, '_add', wraps=rollups.ZONE_CONSUMPTION._add) as zone_add, \
+                mock.patch.object(rollups.METER_CONSUMPTION, '_add', wraps=rollups.METER_CONSUMPTION._add) as meter_add:
+            self.assertEqual(len(insert_pulses(rows)), 4)
+        self.assertEqual((zone_add.call_count, meter_add.call_count), (1, 1))
+        self.assertEqual(list(QuarterHourlyZoneConsumption.objects.order_by('datetime')
+                              .values_list('consumption', flat=True)), [10, 12, 18])
+        self.assertEqual(DailyMeterConsumption.objects.get(meter=self.mtr).consumption, 40)
+
+    def test_spooled_pulses_survive_a_database_outage(self):
+        writer = PulseWriter(spool_dir=self.spool_dir, batch_size=10, flush_interval=1)
+        writer.submit(self.pulse(0, 10))
+        with mock.patch('fl_meters.ingest.insert_pulses', side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                writer.flush()
+        writer.submit(self.pulse(15, 15))
+
+        self.assertEqual(len(writer.spool.sealed_segments()), 1)
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(Pulse.objects.count(), 2)
+        writer.stop()
+
+    def test_pulses_the_database_refuses_are_dead_lettered(self):
+        writer = PulseWriter(spool_dir=self.spool_dir, batch_size=10, flush_interval=1)
+        writer.submit_many([self.pulse(0, 10), self.pulse(15, 666)])
+        save = Pulse.save
+
+        def poisoned_save(pulse, *args, **kwargs):
+            if pulse.reading == '666':
+                raise OperationalError("poison")
+            return save(pulse, *args, **kwargs)
+
+        dead_letters = os.path.join(self.spool_dir, 'dead-letter.jsonl')
+        with override_settings(INGEST_DEAD_LETTER_FILE=dead_letters), \
+                mock.patch.object(Pulse, 'save', poisoned_save), \
+                mock.patch.object(Pulse.objects, 'bulk_create', side_effect=OperationalError("poison")):
+            self.assertEqual(writer.flush(), 1)
+        self.assertEqual(list(Pulse.objects.values_list('reading', flat=True)), ['10'])
+        self.assertEqual(writer.spool.sealed_segments(), [])
+        with open(dead_letters) as file:
+            self.assertEqual(json.loads(file.read())['reading'], '666')
+        writer.stop()
+
+    def test_pulses_are_refused_when_the_spool_is_full(self):
+        writer = PulseWriter(spool_dir=self.spool_dir, batch_size=10, flush_interval=1, max_spooled_bytes=1)
+        writer.submit(self.pulse(0, 10))
+        with self.assertRaises(SpoolFull):
+            writer.submit(self.pulse(15, 15))
+        writer.stop()
+        self.assertEqual(Pulse.objects.count(), 1)
+
+    def test_spools_of_dead_processes_are_replayed_once(self):
+        Pulse.objects.create(meter=self.mtr, time=self.t0, reading="10")
+        spool = Spool(os.path.join(self.spool_dir, "999999999"))
+        for pulse in [self.pulse(0, 10), self.pulse(15, 15), self.pulse(15, 15, meter_id=self.mtr.id + 1)]:
+            spool.append(json.dumps([pulse['meter_id'], pulse['time'].isoformat(), pulse['reading']]).encode())
+        spool.close()
+
+        writer = PulseWriter(spool_dir=self.spool_dir)
+        self.assertEqual(writer.recover(), 1)
+        self.assertEqual(Pulse.objects.count(), 2)
+        self.assertEqual(os.listdir(self.spool_dir), [str(writer.pid)])
+        writer.stop()
+
+    def test_spools_claimed_by_another_process_are_left_to_it(self):
+        directory = os.path.join(self.spool_dir, "999999999")
+        spool = Spool(directory)
+        spool.append(json.dumps([self.mtr.id, self.t0.isoformat(), "10"]).encode())
+        spool.close()
+
+        with open(os.path.join(directory, "replay.lock"), 'a') as claim:
+            fcntl.flock(claim, fcntl.LOCK_EX)
+            self.assertEqual(replay_abandoned_spools(self.spool_dir, 10), 0)
+        self.assertFalse(Pulse.objects.exists())
+        self.assertEqual(replay_abandoned_spools(self.spool_dir, 10), 1)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_torn_records_are_dropped(self):
+        spool = Spool(self.spool_dir)
+        for payload in [b"first", b"second", b"third"]:
+            spool.append(payload)
+        spool.seal()
+        segment, = spool.sealed_segments()
+        with open(segment, 'r+b') as file:
+            file.truncate(os.path.getsize(segment) - 1)
+
+        self.assertEqual(list(read_segment(segment)), [b"first", b"second"])
+        spool.close()
+
+
+class BinaryPulsesTests(TestCase):
+    def setUp(self):
+        red = Zone.objects.create(name='red')
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6)
+        self.mtr = Meter.objects.create(meter_model=mm, input_for=red)
+        self.t0 = dt.datetime(2019, 5, 1, 5, 15, tzinfo=pytz.utc)
+
+    def frame(self, meter_id, deltas):
+        return FRAME_HEADER.pack(meter_id, int(self.t0.timestamp()), 1000, len(deltas)) + \
+               b"".join(FRAME_DELTA.pack(*delta) for delta in deltas)
+
+    def test_frame_is_decoded_from_deltas(self):
+        pulses = decode_pulse_frame(self.frame(self.mtr.id, [(900, 25), (900, -3)]))
+        self.assertEqual([p['time'] for p in pulses],
+                         [self.t0, self.t0 + dt.timedelta(minutes=15), self.t0 + dt.timedelta(minutes=30)])
+        self.assertEqual([p['reading'] for p in pulses], ["1000", "1025", "1022"])
+
+    def test_frame_pulses_are_saved(self):
+        response = self.client.post('/api/binary-pulses/', self.frame(self.mtr.id, [(900, 25)]),
+                                    content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(list(Pulse.objects.order_by('time').values_list('reading', flat=True)), ["1000", "1025"])
+
+    def test_malformed_frames_are_rejected(self):
+        truncated = self.frame(self.mtr.id, [(900, 25)])[:-1]
+        self.assertEqual(self.client.post('/api/binary-pulses/', truncated,
+                                          content_type='application/octet-stream').status_code, 400)
+        self.assertEqual(self.client.post('/api/binary-pulses/', self.frame(self.mtr.id + 1, []),
+                                          content_type='application/octet-stream').status_code, 404)
+        self.assertFalse(Pulse.objects.exists())
+
+    def test_frames_with_readings_too_large_to_store_are_rejected(self):
+        Meter.objects.filter(id=self.mtr.id).update(reading_factor=9999999)  # the second reading overflows
+        response = self.client.post('/api/binary-pulses/', self.frame(self.mtr.id, [(900, 25)]),
+                                    content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Pulse.objects.exists())
+
+
+class IngestGatewayTests(TransactionTestCase):
+    def setUp(self):
+        Zone.objects.bulk_create(Zone(name=f"zone {i}") for i in range(50))
+        zones = Zone.objects.all()
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6)
+        self.meters = list(Meter.objects.filter(id__in=[meter['id'] for meter in provision_meters(
+            [{'meter_model': mm.id, 'input_for': zone.id} for zone in zones])]).select_related('auth_token'))
+        self.t0 = int(dt.datetime(2019, 5, 1, 5, 15, tzinfo=pytz.utc).timestamp())
+
+    def frame(self, meter_id, idx):
+        return FRAME_HEADER.pack(meter_id, self.t0 + idx * 1800, idx * 10, 1) + FRAME_DELTA.pack(900, 5)
+
+    def run_gateway(self, *devices):
+        async def run():
+            gateway = IngestGateway(batch_size=100, flush_interval=20)
+            server = await gateway.start('127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                return await asyncio.gather(*(simulate_device('127.0.0.1', port, token, frames)
+                                              for token, frames in devices))
+            finally:
+                await gateway.close()
+        return asyncio.run(run())
+
+    def test_concurrent_connections_are_saved_in_batches(self):
+        statuses = self.run_gateway(*((meter.auth_token.key, [self.frame(meter.id, idx) for idx in range(3)])
+                                      for meter in self.meters))
+
+        self.assertEqual(statuses, [[gateway.OK] * 3] * len(self.meters))
+        self.assertEqual(Pulse.objects.count(), len(self.meters) * 6)
+
+    def test_devices_are_authenticated_once_per_connection(self):
+        meter, other_meter = self.meters[:2]
+        statuses = self.run_gateway(
+            ("x" * 40, [self.frame(meter.id, 0)]),
+            (meter.auth_token.key, [self.frame(other_meter.id, 0), b"\x00", self.frame(meter.id, 0)]),
+        )
+
+        self.assertEqual(statuses, [[gateway.DENIED], [gateway.FOREIGN_METER, gateway.MALFORMED, gateway.OK]])
+        self.assertEqual(Pulse.objects.count(), 2)
+
+    def test_token_lookups_expire(self):
+        meter = self.meters[0]
+        token = meter.auth_token.key
+
+        async def run():
+            gateway = IngestGateway(token_ttl=0.05)
+            try:
+                looked_up = [await gateway.authenticate(token), await gateway.authenticate("x" * 40)]
+                await gateway._run_in_db_thread(lambda: MeterToken.objects.filter(user=meter).update(key="x" * 40))
+                # both lookups are remembered, the unknown token's too
+                looked_up += [await gateway.authenticate(token), await gateway.authenticate("x" * 40)]
+                await asyncio.sleep(0.1)
+                return looked_up + [await gateway.authenticate(token), await gateway.authenticate("x" * 40)]
+            finally:
+                gateway._executor.shutdown()
+
+        self.assertEqual(asyncio.run(run()), [meter.id, None, meter.id, None, None, meter.id])
+
+    def test_datagrams_in_flight_are_bounded(self):
+        async def run():
+            gateway = IngestGateway(max_datagrams=1)
+            transport = mock.Mock()
+            try:
+                for _ in range(2):
+                    gateway.receive_datagram(b"x" * 40, None, transport)
+                while gateway._datagrams_in_flight:
+                    await asyncio.sleep(0.01)
+            finally:
+                gateway._executor.shutdown()
+            return [call.args[0] for call in transport.sendto.call_args_list]
+
+        self.assertEqual(asyncio.run(run()), [gateway.RETRY_LATER, gateway.DENIED])
+
+    def test_connections_that_fail_to_authenticate_are_closed(self):
+        async def run():
+            gateway = IngestGateway(auth_timeout=0.05)
+            server = await gateway.start('127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                silent_reader, silent_writer = await asyncio.open_connection('127.0.0.1', port)
+                hung_up = await silent_reader.read()
+                silent_writer.close()
+                with mock.patch.object(MeterToken.objects, 'filter', side_effect=OperationalError):
+                    statuses = await simulate_device('127.0.0.1', port, self.meters[0].auth_token.key, [])
+                return hung_up, statuses, gateway.connections
+            finally:
+                await gateway.close()
+
+        self.assertEqual(asyncio.run(run()), (b"", [gateway.RETRY_LATER], 0))
+
+
+class PulsesExportTests(TestCase):
+    def setUp(self):
+        red = Zone.objects.create(name='red')
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6)
+        self.mtr1 = Meter.objects.create(meter_model=mm, input_for=red)
+        self.mtr2 = Meter.objects.create(meter_model=mm, input_for=red)
+        t0 = dt.datetime(2019, 1, 1, 5, 15, tzinfo=pytz.utc)
+        Pulse.objects.bulk_create(
+            Pulse(meter=meter, time=t0 + dt.timedelta(days=day), reading=str(day), normalized_reading=day)
+            for day in range(100) for meter in (self.mtr1, self.mtr2))
+
+    def test_periods_longer_than_a_month_are_streamed_as_csv(self):
+        response = self.client.get('/api/pulses-export/flow/',
+                                   {'since': '2019-01-01', 'until': '2019-12-31', 'meter': self.mtr1.id})
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['id', 'time', 'meter_id', 'meter_key', 'reading', 'normalized_reading'])
+        self.assertEqual(len(rows), 101)
+        self.assertEqual(rows[-1][3:], [self.mtr1.key, '99', '99.000'])
+
+    def test_pulses_are_streamed_as_ndjson(self):
+        response = self.client.get('/api/pulses-export/flow/',
+                                   {'since': '2019-01-01', 'until': '2019-01-02', 'format': 'ndjson'})
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['meter_id'] for row in rows], [self.mtr1.id, self.mtr2.id] * 2)
+        self.assertEqual(rows[0]['time'], '2019-01-01T05:15:00Z')
+
+    def test_invalid_exports_are_rejected(self):
+        self.assertEqual(self.client.get('/api/pulses-export/flow/', {'since': '2019-02-01', 'until': '2019-01-01'})
+                         .status_code, 400)
+        self.assertEqual(self.client.get('/api/pulses-export/flow/',
+                                         {'since': '2019-01-01', 'until': '2019-01-02', 'format': 'xml'})
+                         .status_code, 400)
+        self.assertEqual(self.client.get('/api/pulses-export/flow/',
+                                         {'since': '2019-01-01', 'until': '2019-01-02', 'meter': 'red'})
+                         .status_code, 400)
+        self.assertEqual(self.client.get('/api/pulses-export/pressure/',
+                                         {'since': '2019-01-01', 'until': '2019-01-02', 'transmitter': '1.5'})
+                         .status_code, 400)
+
+
+class ColumnarResponsesTests(TestCase):
+    def setUp(self):
+        self.red = Zone.objects.create(name='red')
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6)
+        self.mtr = Meter.objects.create(meter_model=mm, input_for=self.red)
+        self.t0 = dt.datetime(2019, 1, 1, 5, 15, tzinfo=pytz.utc)
+
+    def test_pulses_history_is_returned_as_gzipped_columns(self):
+        Pulse.objects.bulk_create(
+            Pulse(meter=self.mtr, time=self.t0 + dt.timedelta(minutes=15 * i), reading=str(i), normalized_reading=i)
+            for i in range(20))
+
+        response = self.client.get('/api/pulses-history/flow/',
+                                   {'since': '2019-01-01', 'until': '2019-01-02', 'format': 'columnar'},
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(data['t'], [self.t0.timestamp() + 900 * i for i in range(20)])
+        self.assertEqual(data['v'], list(range(20)))
+        self.assertEqual(data['series']['meter_id'], [self.mtr.id] * 20)
+        self.assertEqual(data['meters'][str(self.mtr.id)]['input_zone_name'], 'red')
+
+    def test_narration_is_grouped_into_columns(self):
+        # meters outside of zones, so that their pulses aren't analysed; the first flows 4 a quarter hour, the second
+        # 2 every half hour
+        mtr1, mtr2 = (Meter.objects.create(meter_model=self.mtr.meter_model) for _ in range(2))
+        for i in range(6):
+            Pulse.objects.create(meter=mtr1, time=self.t0 + dt.timedelta(minutes=15 * i), reading=str(4 * i))
+        for i in range(3):
+            Pulse.objects.create(meter=mtr2, time=self.t0 + dt.timedelta(minutes=30 * i), reading=str(2 * i))
+
+        response = self.client.get('/api/flow-meter/narrate', {
+            'from': '2019-01-01T00:00+00:00', 'to': '2019-01-02T00:00+00:00', 'format': 'columnar'})
+        data = json.loads(response.content)
+        self.assertEqual(data['t'], [self.t0.replace(minute=0).timestamp(), self.t0.replace(hour=6, minute=0).timestamp()])
+        self.assertEqual(data['v'], [16 + 4, 16 + 4])
+        self.assertEqual(data['series']['volume'], [4 * 3 + 2, 4 * 2 + 2])
+
+        response = self.client.get('/api/flow-meter/narrate', {
+            'from': '2019-01-01T00:00+00:00', 'to': '2019-01-02T00:00+00:00', 'resolution': 'days',
+            'exclude-meters[]': [mtr2.id]})
+        self.assertEqual(json.loads(response.content), [{'time': '2019-01-01', 'flow_rate': 16.0, 'volume': 20.0}])
+
+    def test_late_pulses_split_flow_intervals(self):
+        mtr = Meter.objects.create(meter_model=self.mtr.meter_model)
+        for minutes, reading in ((0, 0), (45, 9), (15, 1)):
+            Pulse.objects.create(meter=mtr, time=self.t0 + dt.timedelta(minutes=minutes), reading=str(reading))
+        intervals = MeterFlowRate.objects.order_by('time')
+        self.assertEqual([(record.volume, record.seconds, record.flow_rate) for record in intervals],
+                         [(1, 900, 4), (8, 1800, 16)])
+        hourly = HourlyMeterFlowRate.objects.get()
+        self.assertEqual((hourly.datetime, hourly.volume, hourly.seconds), (self.t0.replace(minute=0), 9, 2700))
+
+    def test_late_pulses_before_flow_rates_were_recorded(self):
+        mtr = Meter.objects.create(meter_model=self.mtr.meter_model)
+        for minutes, reading in ((0, 0), (45, 9)):
+            Pulse.objects.create(meter=mtr, time=self.t0 + dt.timedelta(minutes=minutes), reading=str(reading))
+        # pulses saved before this meter's flow rates were recorded
+        for model in (MeterFlowRate, HourlyMeterFlowRate, DailyMeterFlowRate):
+            model.objects.all().delete()
+
+        Pulse.objects.create(meter=mtr, time=self.t0 + dt.timedelta(minutes=15), reading='1')
+        self.assertEqual(list(MeterFlowRate.objects.values_list('time', 'volume', 'seconds')),
+                         [(self.t0 + dt.timedelta(minutes=15), 1, 900)])
+        hourly = HourlyMeterFlowRate.objects.get()
+        self.assertEqual((hourly.volume, hourly.seconds), (1, 900))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        red = Zone.objects.create(name='red')
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6)
+        self.mtr1 = Meter.objects.create(meter_model=mm, input_for=red)
+        self.mtr2 = Meter.objects.create(meter_model=mm, input_for=red)
+        t0 = dt.datetime(2019, 1, 1, 5, 15, tzinfo=pytz.utc)
+        # pulses of both meters share their times, so pages have to break ties by id
+        Pulse.objects.bulk_create(
+            Pulse(meter=meter, time=t0 + dt.timedelta(minutes=15 * i), reading=str(i), normalized_reading=i)
+            for i in range(15) for meter in (self.mtr1, self.mtr2))
+
+    def fetch_all(self, url, params):
+        ids, pages = [], 0
+        response = self.client.get(url, params)
+        while True:
+            pages += 1
+            ids += [pulse['id'] for pulse in response.data['results']]
+            if response.data['next'] is None:
+                return ids, pages
+            response = self.client.get(response.data['next'])
+
+    def test_pages_follow_time_and_id(self):
+        ids, pages = self.fetch_all('/api/pulse/', {'page_size': 7})
+        self.assertEqual(pages, 5)
+        self.assertEqual(ids, list(Pulse.objects.order_by('time', 'id').values_list('id', flat=True)))
+
+    def test_pages_are_filtered(self):
+        ids, _ = self.fetch_all('/api/pulse/', {'page_size': 4, 'meter': self.mtr2.id,
+                                                'since': '2019-01-01T06:00:00Z', 'until': '2019-01-01T07:00:00Z'})
+        self.assertEqual(ids, list(Pulse.objects.filter(meter=self.mtr2, time__range=(
+            dt.datetime(2019, 1, 1, 6, tzinfo=pytz.utc), dt.datetime(2019, 1, 1, 7, tzinfo=pytz.utc)))
+                                   .order_by('time').values_list('id', flat=True)))
+        self.assertEqual(len(ids), 5)
+
+    def test_bad_parameters_are_rejected(self):
+        self.assertEqual(self.client.get('/api/pulse/', {'cursor': 'nope'}).status_code, 404)
+        self.assertEqual(self.client.get('/api/pulse/', {'since': 'yesterday'}).status_code, 400)
+
+
+class DownsamplingTests(TestCase):
+    def setUp(self):
+        self.t = list(range(10000))
+        self.v = [i % 7 for i in self.t]
+        self.v[4321] = 500  # a burst
+
+    def test_spikes_are_kept(self):
+        for method in downsampling.METHODS:
+            kept = downsampling.downsample_indices(self.t, self.v, 100, method)
+            self.assertLessEqual(len(kept), 100)
+            self.assertIn(4321, kept)
+            self.assertEqual(list(kept), sorted(kept))
+
+    def test_short_series_are_untouched(self):
+        rows = [(t, v) for t, v in zip(self.t[:50], self.v)]
+        self.assertEqual(downsampling.downsample_rows(rows, 100), rows)
+
+    def test_pulses_history_is_downsampled(self):
+        red = Zone.objects.create(name='red')
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6)
+        mtr = Meter.objects.create(meter_model=mm, input_for=red)
+        t0 = dt.datetime(2019, 1, 1, tzinfo=pytz.utc)
+        Pulse.objects.bulk_create(
+            Pulse(meter=mtr, time=t0 + dt.timedelta(minutes=i), reading=str(i), normalized_reading=i % 5,
+                  anomaly=i == 301)
+            for i in range(600))
+
+        params = {'since': '2019-01-01', 'until': '2019-01-02', 'format': 'columnar'}
+        data = json.loads(self.client.get('/api/pulses-history/flow/', dict(params, max_points=50)).content)
+        self.assertLessEqual(len(data['t']), 51)
+        self.assertEqual(data['t'][0], t0.timestamp())
+        # the anomaly is kept, though its value is unremarkable
+        self.assertIn((t0 + dt.timedelta(minutes=301)).timestamp(), data['t'])
+
+        response = self.client.get('/api/pulses-history/flow/', dict(params, max_points='many'))
+        self.assertEqual(response.status_code, 400)
+
+
+class MeterConsumptionTests(TestCase):
+    def setUp(self):
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=3, bulk_meter=False)
+        self.mtr = Meter.objects.create(meter_model=mm, reading_factor=2)
+        Customer.objects.create(meter=self.mtr, name='customer', customer_type=1)
+        self.t0 = dt.datetime(2019, 1, 2, 5, 15, tzinfo=pytz.utc)
+
+    def send(self, minutes, reading):
+        Pulse.objects.create(meter=self.mtr, time=self.t0 + dt.timedelta(minutes=minutes), reading=reading)
+
+    def qh_consumption(self):
+        return {(record.datetime - self.t0).seconds // 60: record.consumption
+                for record in QuarterHourlyMeterConsumption.objects.filter(meter=self.mtr)}
+
+    def test_consumption_is_rolled_up(self):
+        self.send(0, 980)
+        self.send(15, 990)
+        self.send(30, 5)  # the meter rolled over
+        self.assertEqual(self.qh_consumption(), {15: 20, 30: 30})
+        self.assertEqual(DailyMeterConsumption.objects.get(meter=self.mtr, date=dt.date(2019, 1, 2)).consumption, 50)
+        self.assertEqual(MonthlyMeterConsumption.objects.get(meter=self.mtr, date=dt.date(2019, 1, 1)).consumption, 50)
+
+    def test_late_pulses_split_counted_intervals(self):
+        self.send(15, 100)
+        self.send(45, 130)
+        self.send(30, 110)
+        self.send(0, 90)
+        self.send(30, 110)  # duplicate
+        self.assertEqual(self.qh_consumption(), {15: 20, 30: 20, 45: 40})
+        self.assertEqual(DailyMeterConsumption.objects.get(meter=self.mtr).consumption, 80)
+
+    def test_flow_intervals_are_annotated(self):
+        self.send(0, 100)
+        self.send(15, 110)
+        self.send(60, 150)  # a gap
+        self.send(75, 140)  # back-flow
+        self.send(30, 120)  # late
+        self.assertEqual(
+            {(annotation.kind, (annotation.since - self.t0).seconds // 60, (annotation.until - self.t0).seconds // 60)
+             for annotation in Annotation.objects.filter(metric=Annotation.METER_FLOWRATE, entity_id=self.mtr.id)},
+            {(Annotation.INTERPOLATION, 15, 60), (Annotation.ANOMALY, 15, 75)})
+
+    def test_consumption_is_reported_with_its_average(self):
+        DailyMeterConsumption.objects.bulk_create(
+            DailyMeterConsumption(meter=self.mtr, date=dt.date(2019, 1, day), consumption=day) for day in range(1, 5))
+
+        data = self.client.get('/api/detailed-meters-consumption/', {'date': '2019-01-04'}).json()['data']
+        self.assertEqual(data[0]['consumption'], 4)
+        self.assertEqual(data[0]['average_consumption'], 2)
+        self.assertEqual(self.client.get('/api/meters-summary/', {'date': 'today'}).status_code, 400)
+
+    def test_counter_cycling_over_a_gap_is_counted_at_the_previous_rate(self):
+        MeterModel.objects.filter(id=self.mtr.meter_model_id).update(max_flow_rate=2)
+        self.mtr.refresh_from_db()
+        self.send(0, 0)
+        self.send(15, 360)  # 0.4 units per second
+        self.send(225, (360 + 5040) % 1000)
+        self.assertEqual(self.qh_consumption(), {15: 720, 225: 10080})
+
+    def test_pulses_saved_before_rollups_are_backfilled(self):
+        Pulse.objects.bulk_create(Pulse(meter=self.mtr, time=self.t0 + dt.timedelta(minutes=minutes), reading=reading)
+                                  for minutes, reading in ((0, 980), (15, 990), (15, 990), (30, 5)))
+        self.send(45, 15)  # counted at ingest
+        call_command('backfill_meter_consumption', stdout=StringIO())
+        self.assertEqual(self.qh_consumption(), {15: 20, 30: 30, 45: 20})
+
+        call_command('backfill_meter_consumption', stdout=StringIO())
+        self.assertEqual(DailyMeterConsumption.objects.get(meter=self.mtr).consumption, 70)
+
+
+class BillingExportTests(TestCase):
+    def setUp(self):
+        self.red = Zone.objects.create(name='red')
+        self.yellow = Zone.objects.create(name='yellow')
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=3, bulk_meter=False)
+        self.mtr1 = Meter.objects.create(meter_model=mm, input_for=self.red, reading_factor=2)
+        self.mtr2 = Meter.objects.create(meter_model=mm, location=Location.objects.create(zone=self.yellow))
+        bulk = Meter.objects.create(meter_model=mm, input_for=self.red)
+        for meter in (self.mtr1, self.mtr2):
+            Customer.objects.create(meter=meter, name=f'customer {meter.id}', customer_type=1)
+
+        t0 = dt.datetime(2019, 1, 1, tzinfo=pytz.utc)
+        Pulse.objects.bulk_create([
+            Pulse(meter=self.mtr1, time=t0 - dt.timedelta(minutes=15), reading='900'),
+            Pulse(meter=self.mtr1, time=t0, reading='990'),
+            Pulse(meter=self.mtr1, time=t0 + dt.timedelta(days=15), reading='995'),
+            Pulse(meter=self.mtr1, time=t0 + dt.timedelta(days=31), reading='10'),  # rolled over
+            Pulse(meter=self.mtr2, time=t0 + dt.timedelta(days=1), reading='100'),
+            Pulse(meter=self.mtr2, time=t0 + dt.timedelta(days=20), reading='150'),
+            Pulse(meter=self.mtr2, time=t0 + dt.timedelta(days=31, minutes=15), reading='170'),
+            Pulse(meter=bulk, time=t0 + dt.timedelta(days=1), reading='100'),
+            Pulse(meter=bulk, time=t0 + dt.timedelta(days=2), reading='900'),
+        ])
+        MonthlyZoneConsumption.objects.create(zone_id=self.red, date=dt.date(2019, 1, 1), consumption=300)
+
+    def assert_billed(self):
+        self.assertEqual(
+            dict(MonthlyZoneConsumption.objects.values_list('zone_id', 'billed_consumption')),
+            {self.red.id: 40, self.yellow.id: 50})
+        self.assertEqual(MonthlyZoneConsumption.objects.get(zone_id=self.red).consumption, 300)
+
+    def test_command_writes_customers_consumption(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.csv') as output:
+            call_command('export_billing', month='2019-01', output=output.name)
+            rows = list(csv.DictReader(output))
+
+        self.assertEqual([(int(row['meter_id']), float(row['consumption'])) for row in rows],
+                         [(self.mtr1.id, 40), (self.mtr2.id, 50)])
+        self.assertEqual(rows[1]['zone_id'], str(self.yellow.id))
+        self.assert_billed()
+
+    def test_first_and_last_readings_are_read_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = list(billing_rows(dt.date(2019, 1, 15)))
+        self.assertEqual([row[4:] for row in rows], [('990', '10', 40), ('100', '150', 50)])
+
+    def test_billing_is_streamed(self):
+        response = self.client.get('/api/billing-export/', {'month': '2019-01'})
+        rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 3)
+        # downloads don't bill the month
+        self.assertFalse(MonthlyZoneConsumption.objects.filter(billed_consumption__isnull=False).exists())
+        self.assertEqual(self.client.get('/api/billing-export/', {'month': 'January'}).status_code, 400)
+
+
+class WaterBalanceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.red = Zone.objects.create(name='red')
+        self.yellow = Zone.objects.create(name='yellow')
+        self.tsm = TransmissionLine.objects.create()
+        for month, (red, yellow) in enumerate([(100, 50), (200, 70)], start=1):
+            MonthlyZoneConsumption.objects.create(zone_id=self.red, date=dt.date(2019, month, 1), consumption=red,
+                                                  billed_consumption=red * 0.8)
+            MonthlyZoneConsumption.objects.create(zone_id=self.yellow, date=dt.date(2019, month, 1),
+                                                  consumption=yellow)
+            MonthlyTSMInflow.objects.create(transmission_line=self.tsm, date=dt.date(2019, month, 1), consumption=500)
+            MonthlyTSMLossRecord.objects.create(transmission_line=self.tsm, date=dt.date(2019, month, 1), loss=5)
+        LossRecord.objects.create(zone=self.red, date=dt.date(2019, 2, 3), amount=25)
+        LossRecord.objects.create(zone=self.red, date=dt.date(2019, 3, 1), amount=1000)
+
+    def test_balance_of_every_zone_is_computed_with_grouped_queries(self):
+        with self.assertNumQueries(8):
+            balance = compute_water_balance(dt.date(2019, 1, 1), dt.date(2019, 2, 1))
+
+        self.assertEqual(balance['zones']['red'], {
+            'system_input': 300, 'billed_consumption': 240, 'water_losses': 60, 'real_losses': 25,
+            'apparent_losses': 35, 'non_revenue_water': 60})
+        self.assertEqual(balance['zones']['yellow']['system_input'], 120)
+        self.assertIsNone(balance['zones']['yellow']['non_revenue_water'])
+        self.assertEqual(balance['transmission_lines'][self.tsm.key]['real_losses'], 10)
+        self.assertEqual(balance['total']['system_input'], 300 + 120 + 10)
+        self.assertEqual(balance['total']['real_losses'], 25 + 10)
+        self.assertIsNone(balance['total']['non_revenue_water'])
+
+    def test_closed_periods_are_cached_until_billed_again(self):
+        since, until = dt.date(2019, 1, 1), dt.date(2019, 2, 1)
+        water_balance(since, until)
+        with self.assertNumQueries(1):  # the revisions of its months
+            water_balance(since, until)
+
+        save_billed_consumption(since, {self.yellow.id: 20})
+        self.assertEqual(water_balance(since, until)['zones']['yellow']['non_revenue_water'], 120 - 20)
+
+    def test_late_figures_of_closed_months_revise_their_balance(self):
+        since, until = dt.date(2019, 1, 1), dt.date(2019, 2, 1)
+        self.assertEqual(water_balance(since, until)['zones']['yellow']['system_input'], 120)
+        # a late quarter hour of January
+        rollups.ZONE_CONSUMPTION.add(self.yellow.id, [(dt.datetime(2019, 1, 31, 12, tzinfo=pytz.utc), 5)])
+        self.assertEqual(water_balance(since, until)['zones']['yellow']['system_input'], 125)
+        self.assertEqual(WaterBalanceRevision.objects.get(month=since).revision, 1)
+        # the current month isn't cached, so it isn't revised
+        rollups.ZONE_CONSUMPTION.add(self.yellow.id, [(dt.datetime.now(pytz.utc), 5)])
+        self.assertEqual(WaterBalanceRevision.objects.count(), 1)
+
+    def test_balance_is_served(self):
+        data = self.client.get('/api/water-balance/', {'since': '2019-02', 'until': '2019-02'}).json()
+        self.assertEqual(float(data['zones']['red']['water_losses']), 40)
+        self.assertEqual(self.client.get('/api/water-balance/', {'since': '2019-02', 'until': '2019-01'}).status_code,
+                         400)
+
+
+class ConsumptionKernelTests(TestCase):
+    def test_rollover_and_back_flow(self):
+        deltas = interval_consumption(['990', '5', '3', '10.5'], [0, 900, 1800, 2700], 3, factor='2.5')
+        self.assertEqual(deltas.tolist(), [37500, -5000, 18750])
+
+    def test_counter_cycling_several_times_over_a_gap(self):
+        # about 4 units per second on a 4 digits counter, then a 3 hours gap
+        readings = [0, 3000, 7000, 1000, (1000 + 43000) % 10000]
+        times = [0, 900, 1800, 2700, 2700 + 10800]
+        self.assertEqual(interval_consumption(readings, times, 4).tolist(), [3000000, 4000000, 4000000, 3000000])
+        self.assertEqual(interval_consumption(readings, times, 4, max_rate=20).tolist(),
+                         [3000000, 4000000, 4000000, 43000000])
+        # more than the meter can register is back-flow
+        self.assertEqual(interval_consumption(readings, times, 4, max_rate=4).tolist(),
+                         [3000000, -6000000, -6000000, 43000000])
+        # a single interval is counted at the rate it's expected at
+        self.assertEqual(interval_consumption(readings[-2:], times[-2:], 4, max_rate=20, rate=4).tolist(), [43000000])
+
+    def test_counters_too_wide_for_int64_never_roll_over(self):
+        self.assertEqual(interval_consumption(['5', '3'], [0, 900], 20).tolist(), [-2000])
+        with self.assertRaises(OverflowError):
+            interval_consumption(['0', '9999999999999'], [0, 900], 16, factor='9999999.99')
+
+    def test_pulses_are_summed_in_time_order(self):
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=3)
+        mtr = Meter.objects.create(meter_model=mm, reading_factor=2, reading_offset=17)
+        t0 = dt.datetime(2019, 1, 1, 5, 15, tzinfo=pytz.utc)
+        pulses = [Pulse(meter=mtr, time=t0 + dt.timedelta(minutes=15 * i), reading=reading)
+                  for i, reading in enumerate(['980', '990', '5'])]
+        self.assertEqual(sum_pulses_consumption(reversed(pulses), mm.digits, mtr.reading_factor), 50)
+        self.assertEqual(consumption_between_two_pulses(pulses[1], pulses[2], mm.digits), 30)
+
+
+class RawReadingTests(TestCase):
+    def setUp(self):
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6)
+        self.mtr = Meter.objects.create(meter_model=mm)
+        self.t0 = dt.datetime(2019, 1, 1, 5, 15, tzinfo=pytz.utc)
+
+    def test_readings_are_parsed_on_save(self):
+        pulse = Pulse.objects.create(meter=self.mtr, time=self.t0, reading='120.5')
+        self.assertEqual(Pulse.objects.get(id=pulse.id).raw_reading, Decimal('120.5'))
+        self.assertFalse(TimestampedPulseSerializer(
+            data={'meter_id': self.mtr.id, 'reading': 'NaN', 'time': self.t0.timestamp()}).is_valid())
+
+    def test_readings_overflowing_their_columns_are_rejected(self):
+        post = lambda reading: self.client.post('/api/unix-pulse/', {
+            'meter_id': self.mtr.id, 'reading': reading, 'time': self.t0.timestamp()}, content_type='application/json')
+        for reading in ('12345678901234', '1.2345'):
+            response = post(reading)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('reading', response.data)
+        # fit `raw_reading`, but not `normalized_reading` once scaled by the meter's factor
+        self.mtr.reading_factor = 100
+        self.mtr.save()
+        self.assertEqual(post('123456789').status_code, 400)
+        self.assertEqual(post('100000000').status_code, 400)
+        self.assertEqual(post('1234567.125').status_code, 200)
+        self.assertEqual(list(Pulse.objects.values_list('reading', flat=True)), ['1234567.125'])
+
+    def test_backfill_is_resumable(self):
+        Pulse.objects.bulk_create(Pulse(meter=self.mtr, time=self.t0 + dt.timedelta(minutes=15 * i), reading=reading)
+                                  for i, reading in enumerate(['1', '2', 'x', '4', '5']))
+
+        call_command('backfill_raw_readings', batch_size=2, stdout=StringIO())
+        self.assertEqual(list(Pulse.objects.order_by('time').values_list('raw_reading', flat=True)),
+                         [1, 2, None, 4, 5])
+        with self.assertNumQueries(3):  # one empty batch per model, after the unparsable row
+            call_command('backfill_raw_readings', batch_size=2, stdout=StringIO())
+
+
+class IngestBenchmarkTests(TestCase):
+    def test_network_zones_are_chained(self):
+        network = generate_network(zones=3, customers_per_zone=2, transmission_lines=1)
+        self.assertEqual(network.size()['flow_meters'], 3 + 3 * 2 + 2)
+        boundary = Meter.objects.get(input_for=network.zones[1])
+        self.assertEqual(boundary.output_for, network.zones[0])
+        self.assertEqual(Location.objects.filter(zone=network.zones[2], meter__customer__isnull=False).count(), 2)
+
+    def test_stream_faults(self):
+        network = generate_network(zones=2, customers_per_zone=3, transmission_lines=0)
+        since = dt.datetime(2020, 3, 1, tzinfo=pytz.utc)
+        stats = Counter()
+        rows = list(pulse_stream(network, since, 96, StreamFaults(missing=0.05, duplicated=0.05, late=0.05,
+                                                                  out_of_order=0.05), stats=stats))
+
+        devices = 2 * 4 + 2 + 2  # flow meters, pressure transmitters and chlorine sensors
+        self.assertEqual(len(rows), devices * 96 - stats['missing'] + stats['duplicated'])
+        self.assertTrue(all(stats[fault] for fault in ('missing', 'duplicated', 'late', 'out_of_order')))
+        self.assertNotEqual([row['time'] for row in rows], sorted(row['time'] for row in rows))
+        # the same seed streams the same pulses
+        self.assertEqual(rows, list(pulse_stream(network, since, 96, StreamFaults(
+            missing=0.05, duplicated=0.05, late=0.05, out_of_order=0.05))))
+
+    def test_benchmark_leaves_no_pulses(self):
+        result = run_ingest_benchmark(zones=1, customers_per_zone=1, transmission_lines=0, paths=('ingest',))
+        json.dumps(result)
+        measured = result['paths']['ingest']
+        self.assertEqual(measured['pulses'], sum(kind['pulses'] for kind in measured['by_kind'].values()))
+        self.assertGreater(measured['queries_per_pulse']['mean'], 0)
+        self.assertFalse(Pulse.objects.exists())
+
+
+class EndpointBenchmarkTests(TestCase):
+    def test_endpoints_meet_budgets_or_fail_as_expected(self):
+        customization = mock.Mock(overview_report={'pies': ['network_input_today', 'zone_consumption_today'],
+                                                   'narration_charts': ['narrated_network_input',
+                                                                        'narrated_zone_consumption']},
+                                  dashboard_stats={'include_zones': '__all__'})
+        with mock.patch.dict('sys.modules', {'fl_dashboard.customization': customization}):
+            result = run_endpoint_benchmark({'tiny': {'zones': 2, 'customers_per_zone': 2, 'days': 3}}, repeat=1)
+        self.assertEqual(result['violations'], [])
+        self.assertTrue(all(measures['bytes'] for measures in result['sizes']['tiny']['endpoints'].values()))
+        self.assertFalse(Zone.objects.exists())
+
+    def test_budget_violations_are_reported(self):
+        result = run_endpoint_benchmark({'tiny': {'zones': 2, 'customers_per_zone': 0, 'days': 1}},
+                                        [Endpoint('ZonesList', '/api/zones/', QueryBudget(0, zones=0))], repeat=1)
+        self.assertEqual(result['violations'], ["ZonesList (tiny): 2 queries, over its budget of 0"])
+
+        result = run_endpoint_benchmark({'tiny': {'zones': 2, 'customers_per_zone': 0, 'days': 1}}, [
+            Endpoint('ZonesList', '/api/zones/', QueryBudget(0), expected_failure="N+1"),
+            Endpoint('MetersList', '/api/meters-list/', QueryBudget(1), expected_failure="fixed"),
+        ], repeat=1)
+        self.assertEqual(result['expected_violations'], ["ZonesList (tiny): 2 queries, over its budget of 0"])
+        self.assertEqual(result['violations'],
+                         ["MetersList (tiny): 1 queries, within its budget of 1 though marked as an expected failure"])
+
+
+class PipelineMetricsTests(TestCase):
+    def setUp(self):
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6)
+        self.zone = Zone.objects.create(name='red')
+        self.mtr = Meter.objects.create(meter_model=mm, input_for=self.zone)
+        self.t0 = dt.datetime(2019, 1, 2, 5, 15, tzinfo=pytz.utc)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram((1, 5))
+        for value in (0, 1, 3, 9):
+            histogram.observe(value)
+        self.assertEqual(histogram.cumulative_counts(), [('1', 2), ('5', 3), ('+Inf', 4)])
+        self.assertEqual((histogram.sum, histogram.count), (13, 4))
+
+    def test_pipeline_stages_are_exposed(self):
+        count = lambda: metrics.stage_seconds.histograms.get(('on_flow_meter_pulse', 'sister_lookup'),
+                                                             metrics.Histogram(())).count
+        before = count()
+        for minutes, reading in ((0, 10), (15, 20), (30, 30)):
+            Pulse.objects.create(meter=self.mtr, time=self.t0 + dt.timedelta(minutes=minutes), reading=reading)
+        OnHold.objects.create(zone=self.zone, time=self.t0, ready_on=1, current_pulses_arrived=0,
+                              past_pulses_arrived=0)
+        self.assertEqual(count() - before, 3)
+
+        with override_settings(METRICS_TOKEN='scraper'):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper')
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer guess').status_code, 403)
+        body = response.content.decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('fl_pipeline_stage_queries_bucket{function="on_flow_meter_pulse",stage="total",le="+Inf"}', body)
+        self.assertIn('fl_onhold_backlog{kind="zone"} 1', body)
+        self.assertIn('fl_zone_analytics_lag_seconds{zone="red"}', body)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+
+class IngestCaptureTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6)
+        self.mtr = Meter.objects.create(meter_model=mm)
+        self.t0 = dt.datetime(2019, 1, 2, 5, 15, tzinfo=pytz.utc)
+
+    def test_ingest_requests_are_captured_and_replayed(self):
+        with override_settings(INGEST_CAPTURE=True, INGEST_CAPTURE_DIR=self.directory, INGEST_CAPTURE_FLUSH_SECONDS=0):
+            for minutes, reading in ((15, 20), (0, 10)):
+                self.client.post('/api/unix-pulse/', json.dumps({
+                    'meter_id': self.mtr.id, 'reading': str(reading),
+                    'time': (self.t0 + dt.timedelta(minutes=minutes)).timestamp()}), content_type='application/json')
+            self.client.get('/api/zones/')
+
+        records = list(read_captures(list_captures(self.directory)))
+        self.assertEqual([(record['path'], record['status']) for record in records], [('/api/unix-pulse/', 200)] * 2)
+        self.assertNotIn('HTTP_AUTHORIZATION', records[0])
+
+        Pulse.objects.all().delete()
+        captures = list_captures(self.directory)
+        with override_settings(INGEST_CAPTURE=True, INGEST_CAPTURE_DIR=self.directory, INGEST_CAPTURE_FLUSH_SECONDS=0,
+                               INGEST_CAPTURE_MAX_BYTES=1, INGEST_CAPTURE_KEEP_FILES=1):
+            statuses, count, _ = replay_ingest.Command.replay(captures, 0, None)
+        self.assertEqual((statuses, count), ({200: 2}, 2))
+        self.assertEqual(list(Pulse.objects.order_by('id').values_list('reading', flat=True)), ['20', '10'])
+        self.assertEqual(list_captures(self.directory), captures)
+
+    def test_captures_rotate(self):
+        writer = CaptureWriter(self.directory, max_bytes=1, rotate_seconds=3600, keep=2, flush_seconds=0)
+        with mock.patch('fl_meters.capture.time.strftime', side_effect=['1', '2', '3']):
+            for idx in range(3):
+                writer.write({'t': idx})
+        self.assertEqual([record['t'] for record in read_captures(list_captures(self.directory))], [1, 2])
+        self.assertEqual(replay_ingest.parse_speed('10x'), 10)
+
+
+class RequestProfilingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6, bulk_meter=True)
+        for _ in range(3):
+            Meter.objects.create(meter_model=mm)
+
+    def test_fingerprints_ignore_literals(self):
+        self.assertEqual(profiling.fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND key = 'x' LIMIT 2"),
+                         profiling.fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND key = 'y' LIMIT 3"))
+
+    def test_requests_asking_to_be_are_profiled(self):
+        response = self.client.get('/api/bulk-meters-consumption/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertFalse(SlowRequest.objects.exists())
+
+        response = self.client.get('/api/bulk-meters-consumption/', HTTP_X_PROFILE='1')
+        self.assertNotIn('Server-Timing', response)
+
+        self.client.force_login(User.objects.create(username='staff', is_staff=True))
+        response = self.client.get('/api/bulk-meters-consumption/', HTTP_X_PROFILE='1')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('dup1;desc="3x SELECT', response['Server-Timing'])
+        slow = SlowRequest.objects.get()
+        self.assertEqual((slow.endpoint, slow.status, slow.duplicated_queries),
+                         ('api/bulk-meters-consumption/', 200, 2))
+
+    @override_settings(REQUEST_PROFILING=True, REQUEST_PROFILING_TOP=2)
+    def test_only_the_slowest_requests_are_kept(self):
+        for _ in range(4):
+            self.client.get('/api/bulk-meters-consumption/')
+        cache.clear()
+        threshold = profiling.slow_request_threshold()
+        self.assertEqual(SlowRequest.objects.count(), 2)
+        self.assertEqual(threshold, SlowRequest.objects.order_by('duration_ms')[0].duration_ms)
+
+        profile = profiling.RequestProfile()
+        profile.finish()
+        with self.assertNumQueries(0):
+            profiling.record_slow_request(mock.Mock(), mock.Mock(), profile)
+
+
+class AnnotationTests(TestCase):
+    def setUp(self):
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6)
+        self.zone = Zone.objects.create(name='red')
+        self.mtr = Meter.objects.create(meter_model=mm, input_for=self.zone)
+        self.t0 = dt.datetime(2019, 1, 2, 5, 15, tzinfo=pytz.utc)
+
+    def at(self, minutes):
+        return self.t0 + dt.timedelta(minutes=minutes)
+
+    def test_touching_ranges_are_merged(self):
+        for since, until in ((0, 15), (45, 60), (30, 30)):
+            add_annotation(Annotation.METER_FLOWRATE, self.mtr.id, Annotation.INTERPOLATION, self.at(since),
+                           self.at(until))
+        add_annotation(Annotation.METER_FLOWRATE, self.mtr.id, Annotation.ANOMALY, self.at(15), self.at(15))
+        self.assertEqual(Annotation.objects.count(), 2)
+
+        annotations = annotations_of(Annotation.METER_FLOWRATE, self.at(60), self.at(90), [self.mtr.id])
+        self.assertEqual([(annotation['kind'], annotation['since'], annotation['until'])
+                          for annotation in annotations], [('Interpolation', self.at(0), self.at(60))])
+        self.assertEqual(annotations_of(Annotation.METER_FLOWRATE, self.at(0), self.at(90), [self.mtr.id + 1]), [])
+
+    def test_gap_fills_are_annotated(self):
+        for minutes, reading in ((0, 10), (15, 20), (60, 50)):
+            Pulse.objects.create(meter=self.mtr, time=self.at(minutes), reading=reading)
+        annotation = Annotation.objects.get(metric=Annotation.ZONE_CONSUMPTION)
+        self.assertEqual((annotation.entity_id, annotation.kind), (self.zone.id, Annotation.INTERPOLATION))
+        self.assertEqual((annotation.since, annotation.until), (self.at(30), self.at(60)))
+
+    def test_narration_returns_annotations(self):
+        add_annotation(Annotation.METER_FLOWRATE, self.mtr.id, Annotation.ANOMALY, self.at(0), self.at(15))
+        response = self.client.get('/api/flow-meter/narrate', {
+            'from': '2019-01-02T00:00+00:00', 'to': '2019-01-03T00:00+00:00', 'format': 'columnar',
+            'meters[]': [self.mtr.id]})
+        annotations = json.loads(response.content)['annotations']
+        self.assertEqual([(annotation['kind'], annotation['since']) for annotation in annotations],
+                         [('Anomaly', self.t0.timestamp())])
+
+
+class GapInterpolationTests(TestCase):
+    def setUp(self):
+        mm = MeterModel.objects.create(manufacturer='', model_number='', digits=6)
+        self.zone = Zone.objects.create(name='red')
+        self.mtr = Meter.objects.create(meter_model=mm, input_for=self.zone)
+        self.t0 = dt.datetime(2019, 1, 2, 6, 15, tzinfo=pytz.utc)
+
+    def at(self, minutes):
+        return self.t0 + dt.timedelta(minutes=minutes)
+
+    def test_parts_add_up_to_the_total(self):
+        self.assertEqual(list(interpolation.allocate(1000, np.ones(3))), [333, 334, 333])
+        self.assertEqual(interpolation.interpolate_gap(self.zone, self.t0, 3, Decimal('1'), 'linear'),
+                         [Decimal('0.333'), Decimal('0.334'), Decimal('0.333')])
+
+    def test_profile_follows_the_zones_day(self):
+        QuarterHourlyZoneConsumption.objects.bulk_create(
+            QuarterHourlyZoneConsumption(zone_id=self.zone, datetime=self.at(15 * idx - 24 * 60), consumption=value)
+            for idx, value in enumerate((1, 1, 1, 1, 3, 3, 3, 3)))
+        self.assertEqual(interpolation.interpolate_gap(self.zone, self.t0, 8, Decimal('32'), 'profile'),
+                         [2, 2, 2, 2, 6, 6, 6, 6])
+        # no history to go by
+        self.assertEqual(interpolation.interpolate_gap(self.zone, self.t0 - dt.timedelta(days=30), 2, Decimal('2'),
+                                                       'profile'), [1, 1])
+
+    def test_gaps_are_filled_with_the_zones_strategy(self):
+        self.zone.gap_interpolation = 'trend'
+        self.zone.save()
+        for minutes, reading in ((0, 10), (15, 20), (60, 60)):
+            Pulse.objects.create(meter=self.mtr, time=self.at(minutes), reading=reading)
+        self.assertEqual(list(QuarterHourlyZoneConsumption.objects.filter(datetime__gt=self.at(15))
+                              .order_by('datetime').values_list('consumption', flat=True)),
+                         [Decimal('11.667'), Decimal('13.333'), 15])
+        self.assertEqual(DailyZoneConsumption.objects.get(zone_id=self.zone).consumption, 50)
+
+    def test_trending_from_the_last_quarter_hour_adds_up_to_the_total(self):
+        QuarterHourlyZoneConsumption.objects.create(zone_id=self.zone, datetime=self.t0, consumption=10)
+        # 4 quarter hours of 10 would be 40: the gap trends up to 60, or down to 20
+        self.assertEqual(interpolation.interpolate_gap(self.zone, self.at(15), 4, Decimal('60'), 'trend'),
+                         [12, 14, 16, 18])
+        self.assertEqual(interpolation.interpolate_gap(self.zone, self.at(15), 4, Decimal('20'), 'trend'),
+                         [8, 6, 4, 2])
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.red = Zone.objects.create(name='red')
+        self.blue = Zone.objects.create(name='blue')
+        # quarter hours starting on the last day of January, and on the first of February
+        self.jan31 = dt.datetime(2019, 1, 31, 23, 30, tzinfo=pytz.utc)
+        self.feb1 = dt.datetime(2019, 2, 1, 0, 0, tzinfo=pytz.utc)
+
+    def test_points_are_written_to_every_level_at_once(self):
+        points = [(self.jan31, Decimal('1')), (self.jan31 + dt.timedelta(minutes=15), Decimal('2')),
+                  (self.feb1, Decimal('4'))]
+        # a read and a write per level, however many points, a savepoint around each insert, and two to revise
+        # the closed months written
+        with self.assertNumQueries(2 + 4 * 2 + 4 * 2 + 2):
+            rollups.ZONE_CONSUMPTION.add(self.red.id, points)
+        rollups.ZONE_CONSUMPTION.add(self.red.id, [(self.feb1, Decimal('8'))])
+
+        self.assertEqual(QuarterHourlyZoneConsumption.objects.get(zone_id=self.red, datetime=self.feb1 +
+                                                                  dt.timedelta(minutes=15)).consumption, 12)
+        self.assertEqual(DailyZoneConsumption.objects.get(zone_id=self.red, date=self.jan31.date()).consumption, 3)
+        self.assertEqual(MonthlyZoneConsumption.objects.get(zone_id=self.red, date=self.feb1.date()).consumption, 12)
+        self.assertEqual(YearlyZoneConsumption.objects.get(zone_id=self.red, year=2019).consumption, 15)
+
+    def test_periods_created_by_a_concurrent_write_are_added_to(self):
+        combine = rollups.Rollup._combine
+
+        def racing_combine(rollup, row, batch, stored):
+            # another process creates the day after it was read as missing
+            if isinstance(row, DailyZoneConsumption) and not DailyZoneConsumption.objects.exists():
+                DailyZoneConsumption.objects.create(zone_id=self.red, date=self.feb1.date(), consumption=5)
+            combine(rollup, row, batch, stored)
+
+        with mock.patch.object(rollups.Rollup, '_combine', racing_combine):
+            rollups.ZONE_CONSUMPTION.add(self.red.id, [(self.feb1, Decimal('1'))])
+        daily = DailyZoneConsumption.objects.get(zone_id=self.red)
+        self.assertEqual((daily.consumption, daily.p_nighttime), (6, 1))
+
+    def test_means_are_weighed_by_the_points_they_hold(self):
+        rollups.ZONE_PRESSURE.add(self.red.id, [(self.jan31, Decimal('4')), (self.feb1, Decimal('6'))])
+        rollups.ZONE_PRESSURE.add(self.red.id, [(self.feb1 + dt.timedelta(minutes=15), Decimal('9'))])
+
+        hourly = HourlyAvgZonePressure.objects.get(zone=self.red, time=self.feb1)
+        self.assertEqual((hourly.azp, hourly.weight), (Decimal('7.5'), 2))
+        yearly = YearlyAvgZonePressure.objects.get(zone=self.red, year=2019)
+        self.assertAlmostEqual(yearly.azp, Decimal('6.33333'), 5)
+        self.assertEqual(yearly.weight, 3)
+        self.assertEqual(rollups.ZONE_PRESSURE.series(rollups.MONTH, self.jan31, self.feb1),
+                         {self.jan31.date().replace(day=1): 4, self.feb1.date(): Decimal('7.5')})
+
+    def test_extremes_keep_the_most_extreme_point(self):
+        peak = rollups.Rollup('peak_pressure', 'zone', ('azp',), rollups.MAX,
+                              {rollups.HOUR: (HourlyAvgZonePressure, 'time')})
+        peak.add(self.red.id, [(self.feb1, Decimal('3')), (self.feb1, Decimal('5'))])
+        peak.add(self.red.id, [(self.feb1, Decimal('4'))])
+        self.assertEqual(HourlyAvgZonePressure.objects.get(zone=self.red).azp, 5)
+
+    def test_totals_are_read_per_entity_in_one_query(self):
+        rollups.ZONE_CONSUMPTION.add(self.red.id, [(self.jan31, Decimal('1')), (self.feb1, Decimal('2'))])
+        rollups.ZONE_CONSUMPTION.add(self.blue.id, [(self.feb1, Decimal('5'))])
+
+        with self.assertNumQueries(1):
+            totals = rollups.ZONE_CONSUMPTION.totals(rollups.DAY, self.jan31, self.feb1)
+        self.assertEqual(totals, {self.red.id: 3, self.blue.id: 5})
+        self.assertEqual(rollups.ZONE_CONSUMPTION.totals(rollups.DAY, self.feb1, self.feb1, [self.red.id]),
+                         {self.red.id: 2})
+
+    def partitioned_points(self):
+        return [(self.jan31, Decimal('1')), (self.jan31 + dt.timedelta(minutes=15), Decimal('2')),
+                (self.feb1, Decimal('4')), (self.feb1 + dt.timedelta(hours=10), Decimal('8')),
+                (self.feb1 + dt.timedelta(days=9, hours=4), Decimal('16'))]
+
+    def assert_partitions(self):
+        daily = DailyZoneConsumption.objects.get(zone_id=self.red, date=self.feb1.date())
+        self.assertEqual((daily.p_dawn, daily.p_noon, daily.p_afternoon, daily.p_evening, daily.p_nighttime),
+                         (0, 8, 0, 0, 4))
+        self.assertEqual(DailyZoneConsumption.objects.get(zone_id=self.red, date=self.jan31.date()).p_nighttime, 3)
+        monthly = MonthlyZoneConsumption.objects.get(zone_id=self.red, date=self.feb1.date())
+        self.assertEqual((monthly.p_week1, monthly.p_week2, monthly.p_week3, monthly.p_week4), (12, 16, 0, 0))
+        self.assertEqual(MonthlyZoneConsumption.objects.get(zone_id=self.red, date=dt.date(2019, 1, 1)).p_week4, 3)
+        yearly = YearlyZoneConsumption.objects.get(zone_id=self.red, year=2019)
+        self.assertEqual((yearly.consumption, yearly.p_quarter1, yearly.p_quarter2), (31, 31, 0))
+
+    def test_points_are_added_to_their_partitions(self):
+        rollups.ZONE_CONSUMPTION.add(self.red.id, self.partitioned_points())
+        self.assert_partitions()
+
+    def test_partitions_are_backfilled_from_quarter_hours(self):
+        rollups.ZONE_CONSUMPTION.add(self.red.id, self.partitioned_points())
+        for model in (DailyZoneConsumption, MonthlyZoneConsumption, YearlyZoneConsumption):
+            model.objects.update(**{field.name: 0 for field in model._meta.fields if field.name.startswith('p_')})
+
+        # the entities, then per batch: a lock and a write per level, the quarter hours, and the savepoint
+        with self.assertNumQueries(1 + 3 * 2 + 1 + 2):
+            rollups.ZONE_CONSUMPTION.backfill_partitions()
+        self.assert_partitions()
+        rollups.ZONE_CONSUMPTION.add(self.blue.id, [(self.feb1, Decimal('5'))])
+        self.assertEqual(rollups.ZONE_CONSUMPTION.backfill_partitions(batch_size=1),
+                         {rollups.DAY: 4, rollups.MONTH: 3, rollups.YEAR: 2})
+        call_command('backfill_partitions', stdout=StringIO())
+        self.assert_partitions()
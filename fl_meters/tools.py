@@ -1,8 +1,13 @@
 import datetime as dt
+import functools
+import threading
+from decimal import Decimal, InvalidOperation
 from enum import Enum
 from typing import List, Optional
 
+import numpy as np
 import pytz
+from django.db import transaction
 from django.utils.timezone import localtime
 from pytz import utc
 from django.conf import settings
@@ -69,6 +74,12 @@ def round_down_to_ri(time: dt.datetime):
     ri_minute = (time.minute // 15) * 15
     return time.replace(minute=ri_minute, second=0, microsecond=0)
 
+def period_end_of(time: dt.datetime) -> dt.datetime:
+    """ Returns the end of the quarter hour `time` falls in, `time` itself if it ends one. """
+    time = time.astimezone(pytz.utc)
+    period_end = round_down_to_ri(time)
+    return period_end if period_end == time else period_end + dt.timedelta(minutes=15)
+
 def slide_to_start_of_aggregation_period(time: dt.datetime, aggregation_period):
     if aggregation_period == 'minutes':
         rie = 15
@@ -84,128 +95,150 @@ def slide_to_start_of_aggregation_period(time: dt.datetime, aggregation_period):
     raise ValueError("Bad Aggregation Period Value")
 
 
-def _next_meter_serial():
-    """ Returns the serial number for meters to be used next.
-    It also automatically increments the serial record in the database. """
-
-    from .models import Serial
-    db_record, created = Serial.objects.get_or_create(model_name="Meter")
-
-    if db_record.last_serial_stamp.year < dt.datetime.now().year:
-        # if a new serial year is upon us, reset serial to 1 and save record.
-        db_record.last_serial_value = 1
-        serial_value = 1
-    else:
-        db_record.last_serial_value += 1
-        serial_value = db_record.last_serial_value
-
-    db_record.save()
-    return serial_value
-
-
-def _next_transmitter_serial():
-    """ Returns the serial number for transmitters to be used next.
-    It also automatically increments the serial record in the database. """
-
-    from .models import Serial
-    db_record, created = Serial.objects.get_or_create(model_name="Transmitter")
-
-    # if last serial was in the previous year:
-    if db_record.last_serial_stamp.year < dt.datetime.now().year:
-        # reset serial to 1
-        db_record.last_serial_value = 1
-        serial_value = 1
-    else:
-        db_record.last_serial_value += 1
-        serial_value = db_record.last_serial_value
-
-    db_record.save()
-    return serial_value
-
+class SerialAllocator:
+    """
+    Hands out serial numbers for a `Serial` record in blocks.
 
-def _next_chlorine_sensor_serial():
-    from .models import Serial
-    db_record, created = Serial.objects.get_or_create(model_name="ChlorineSensor")
+    Each block is reserved with a single locked read-modify-write on the `Serial` row, so concurrent processes
+    never receive the same serial. Serials left over from a reserved block are cached in-process and served to
+    the following calls without a database round-trip. A block reserved within a transaction is only cached once
+    the transaction commits: if it rolls back, so does the reservation, and its serials are handed out again.
 
-    db_record.last_serial_value += 1
-    serial_value = db_record.last_serial_value
+    :param model_name: The `Serial.model_name` the serials are counted under.
+    :param period: Maps a date to the period the counter is reset on (e.g. its year). `None` never resets.
+    """
 
-    db_record.save()
-    return serial_value
+    def __init__(self, model_name, period=None):
+        self.model_name = model_name
+        self.period = period
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self._cached_period = None
+
+    def _current_period(self):
+        return self.period(dt.date.today()) if self.period is not None else None
+
+    def _reserve(self, count):
+        """ Reserves `count` serials in the database and returns the first one. """
+        from .models import Serial
+
+        with transaction.atomic():
+            db_record, created = Serial.objects.select_for_update().get_or_create(model_name=self.model_name)
+
+            if not created and self.period is not None \
+                    and self.period(db_record.last_serial_stamp) != self._current_period():
+                # if a new serial period is upon us, restart the serials from 1.
+                db_record.last_serial_value = 0
+
+            first_serial = db_record.last_serial_value + 1
+            db_record.last_serial_value += count
+            db_record.save()
+
+        return first_serial
+
+    def take(self, count=1) -> List[int]:
+        """ Returns `count` consecutive-as-possible serials, reserving a new block only if the cache runs out. """
+        with self._lock:
+            if self._cached_period != self._current_period():
+                # serials cached in a past period would carry a stale year or day in their keys
+                self._next = self._end = 0
+                self._cached_period = self._current_period()
+
+            serials = list(range(self._next, min(self._end, self._next + count)))
+            self._next += len(serials)
+
+            missing = count - len(serials)
+            if missing > 0:
+                block_size = max(missing, settings.SERIAL_BLOCK_SIZE)
+                first_serial = self._reserve(block_size)
+                serials += list(range(first_serial, first_serial + missing))
+                self._next = self._end = 0
+                # outside of a transaction, on_commit runs right away, so it's called once the lock is released
+                leftover = functools.partial(
+                    self._cache, first_serial + missing, first_serial + block_size, self._cached_period)
+            else:
+                leftover = None
+
+        if leftover is not None:
+            transaction.on_commit(leftover)
+        return serials
+
+    def _cache(self, next_serial, end, period):
+        with self._lock:
+            if period == self._cached_period and self._next == self._end:
+                self._next, self._end = next_serial, end
+
+
+_meter_serials = SerialAllocator("Meter", period=lambda date: date.year)
+_transmitter_serials = SerialAllocator("Transmitter", period=lambda date: date.year)
+_chlorine_sensor_serials = SerialAllocator("ChlorineSensor")
+_alert_serials = SerialAllocator("Alert", period=lambda date: date)
+_transmission_line_serials = SerialAllocator("TransmissionLine")
+_tank_level_sensor_serials = SerialAllocator("TankLevelSensor")
+
+
+def next_meter_keys(count):
+    """ Returns `count` formatted meter_keys ready to be used in meter objects """
+    this_year = dt.datetime.now().strftime("%y")
+    return [f"MTR-{this_year}{str(serial).rjust(4, '0')}" for serial in _meter_serials.take(count)]
 
 
-def _next_alert_serial():
-    """ Returns the serial number for alerts to be used next.
-    It also automatically increments the serial record in the database. """
+def next_transmitter_keys(count):
+    """ Returns `count` formatted transmitter_keys ready to be used in transmitter objects """
+    this_year = dt.datetime.now().strftime("%y")
+    return [f"PTM-{this_year}{str(serial).rjust(4, '0')}" for serial in _transmitter_serials.take(count)]
 
-    from .models import Serial
-    db_record, created = Serial.objects.get_or_create(model_name="Alert")
 
-    if db_record.last_serial_stamp.day < dt.datetime.now().day:
-        # if a new serial year is upon us, reset serial to 1 and save record.
-        db_record.last_serial_value = 1
-        serial_value = 1
-    else:
-        db_record.last_serial_value += 1
-        serial_value = db_record.last_serial_value
+def next_chlorine_sensor_keys(count):
+    """ Returns `count` formatted chlorine_sensor_keys ready to be used in ChlorineSensor objects """
+    return [f"CHL-SSR-{serial}" for serial in _chlorine_sensor_serials.take(count)]
 
-    db_record.save()
-    return serial_value
 
+def next_alert_keys(count):
+    """ Returns `count` formatted alert_keys ready to be used in alert objects """
+    short_date = dt.datetime.now().strftime("%y%m%d")
+    return [f"ALERT-{short_date}-{str(serial).rjust(3, '0')}" for serial in _alert_serials.take(count)]
 
-def _next_transmission_line_serial():
-    """ Returns the serial number for transmission line to be used next.
-    It also automatically increments the serial record in the database. """
 
-    from .models import Serial
-    db_record, created = Serial.objects.get_or_create(model_name="TransmissionLine")
+def next_transmission_line_keys(count):
+    """ Returns `count` formatted keys ready to be used in transmission_line objects """
+    return [f"TSM-{serial}" for serial in _transmission_line_serials.take(count)]
 
-    db_record.last_serial_value += 1
-    serial_value = db_record.last_serial_value
 
-    db_record.save()
-    return serial_value
+def next_tank_level_sensor_keys(count):
+    """ Returns `count` formatted keys ready to be used in TankLevelSensor objects """
+    return [f"TKLVL-{serial}" for serial in _tank_level_sensor_serials.take(count)]
 
 
 def next_meter_key():
     """ Returns the formatted meter_key ready to be used in a meter object """
-    serial_number = str(_next_meter_serial()).rjust(4, "0")
-    this_year = dt.datetime.now().strftime("%y")
-    return f"MTR-{this_year}{serial_number}"
+    return next_meter_keys(1)[0]
 
 
 def next_transmitter_key():
     """ Returns the formatted transmitter_key ready to be used in a transmitter object """
-    serial_number = str(_next_transmitter_serial()).rjust(4, "0")
-    this_year = dt.datetime.now().strftime("%y")
-    return f"PTM-{this_year}{serial_number}"
+    return next_transmitter_keys(1)[0]
 
 
 def next_chlorine_sensor_key():
     """ Returns the formatted chlorine_sensor_key ready to be used in a ChlorineSensor object """
-    serial_number = str(_next_transmission_line_serial()).rjust(1, "0")
-    return f"CHL-SSR-{serial_number}"
+    return next_chlorine_sensor_keys(1)[0]
+
 
 def next_alert_key():
     """ Returns the formatted alert_key ready to be used in an alert object """
-    serial_number = str(_next_alert_serial()).rjust(3, "0")
-    short_date = dt.datetime.now().strftime("%y%m%d")
-    return f"ALERT-{short_date}-{serial_number}"
+    return next_alert_keys(1)[0]
 
 
 def next_transmission_line_key():
     """ Returns the formatted key ready to be used in a transmission_line object """
-    serial_number = str(_next_transmission_line_serial()).rjust(1, "0")
-    return f"TSM-{serial_number}"
+    return next_transmission_line_keys(1)[0]
 
 
 def next_tank_level_sensor_key():
-    from .models import Serial
-    db_record, created = Serial.objects.get_or_create(model_name="TankLevelSensor")
-    db_record.last_serial_value += 1
-    serial_number = str(db_record.last_serial_value).rjust(1, "0")
-    db_record.save()
-    return f"TKLVL-{serial_number}"
+    """ Returns the formatted key ready to be used in a TankLevelSensor object """
+    return next_tank_level_sensor_keys(1)[0]
 
 
 def is_end_of_hour(time, margin_of_error=5):
@@ -240,23 +273,109 @@ def consumption_between_two_pulses_legacy(before_pulse, after_pulse, meter_digit
 def consumption_between_two_pulses(before_pulse, after_pulse, meter_digits):
     if before_pulse is None or after_pulse is None:
         raise Exception("Neither of the pulses can be None.")
+    return consumption_between_readings(before_pulse.parsed_reading(), after_pulse.parsed_reading(), meter_digits,
+                                        after_pulse.meter.reading_factor,
+                                        (after_pulse.time - before_pulse.time).total_seconds())
+
+def consumption_between_readings(before_reading, after_reading, meter_digits, reading_factor=1, seconds=0,
+                                 max_rate=None, rate=None) -> Decimal:
+    """
+    Returns the consumption between two raw readings of a meter, `seconds` apart, see `interval_consumption`. A
+    single interval has no rate of its own to count whole cycles of the counter by, so it takes the `rate` expected
+    of the meter when it's known.
+    """
+    delta, = interval_consumption([before_reading, after_reading], [0, seconds], meter_digits, reading_factor,
+                                  max_rate, rate)
+    return from_fixed_point(delta)
+
+def sum_pulses_consumption(pulses, meter_digits, reading_factor=1, max_rate=None):
+    """ Sums the consumption between consecutive pulses of a meter. `pulses` don't need to be sorted. """
+    pulses = sorted(pulses, key=lambda pulse: pulse.time)
+    if len(pulses) < 2:
+        return 0
+    deltas = interval_consumption([pulse.parsed_reading() for pulse in pulses],
+                                  [pulse.time.timestamp() for pulse in pulses], meter_digits, reading_factor, max_rate)
+    return from_fixed_point(deltas.sum())
+
+
+""" CONSUMPTION KERNEL """
+
+
+def parse_reading(reading) -> Decimal:
+    """ Parses a raw reading sent by a device. Raises `ValueError` if it isn't a finite number. """
+    try:
+        value = Decimal(reading)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f"Reading ({reading}) is not a number")
+    if not value.is_finite():
+        raise ValueError(f"Reading ({reading}) is not a finite number")
+    return value
+
+# readings are kept in int64 thousandths of their unit, so deltas are exact and don't go through Decimal
+FIXED_POINT_DIGITS = 3
+INT64_MAX = np.iinfo(np.int64).max
+# the widest counter range deltas are taken modulo, in thousandths
+MAX_FIXED_POINT_SPAN = 10 ** 18
+
+
+def to_fixed_point(values) -> np.ndarray:
+    """ Converts readings, given as strings, Decimals or ints, to int64 thousandths. """
+    return np.array([int(Decimal(value).scaleb(FIXED_POINT_DIGITS).to_integral_value()) for value in values],
+                    dtype=np.int64)
+
+
+def from_fixed_point(value) -> Decimal:
+    return Decimal(int(value)).scaleb(-FIXED_POINT_DIGITS)
+
+
+def interval_consumption(readings, times, digits: int, factor=1, max_rate=None, rate=None) -> np.ndarray:
+    """
+    Returns the consumption over each interval between consecutive raw readings of a meter, in int64 thousandths.
+    The reading offset of the meter cancels out of every delta, so it isn't needed.
+
+    Deltas are taken modulo the range of the meter's counter (`10 ** digits`), so a counter rolling over is accounted
+    for, and a delta that wraps past half the range is a drop in the reading: back-flow. When `max_rate` is given,
+    readings far enough apart for the counter to roll over several times are told apart too: each delta is given the
+    number of whole cycles, from back-flow to as many as `max_rate` allows, that brings it closest to the `rate`
+    expected of the meter, by default its median rate over the series. A single interval is its own median, so it
+    rolls over at most once unless its `rate` is given.
+
+    :param readings: Raw readings, in time order.
+    :param times: Unix timestamps of the readings, or any times in seconds.
+    :param factor: The reading factor of the meter.
+    :param max_rate: The most the meter can register per second, in raw units.
+    :param rate: The rate expected of the meter, in raw units per second.
+    :return: `len(readings) - 1` consumptions.
+    """
+    raw = to_fixed_point(readings)
+    # a counter too wide for int64 thousandths is wider than any reading stored, so it's never seen rolling over
+    span = min(10 ** (digits + FIXED_POINT_DIGITS), MAX_FIXED_POINT_SPAN)
+
+    wrapped = np.diff(raw) % span
+    deltas = np.where(wrapped > span // 2, wrapped - span, wrapped)
+
+    if max_rate is not None and len(deltas):
+        elapsed = np.diff(np.asarray(times, dtype=np.float64))
+        # readings taken at the same time keep their delta
+        moving = elapsed > 0
+        if rate is not None:
+            rate = float(rate) * 10 ** FIXED_POINT_DIGITS
+        else:
+            rate = np.median(deltas[moving] / elapsed[moving]) if moving.any() else 0
+        most_cycles = np.floor((float(max_rate) * 10 ** FIXED_POINT_DIGITS * elapsed - wrapped) / span)
+        cycles = np.clip(np.rint((rate * elapsed - wrapped) / span), -1, np.maximum(most_cycles, -1))
+        if cycles.max() >= INT64_MAX // span:
+            raise OverflowError(f"Consumption of {int(cycles.max())} cycles of a {digits} digits counter doesn't fit "
+                                f"in int64")
+        deltas = np.where(moving, wrapped + cycles.astype(np.int64) * span, deltas)
+
+    # factors have two decimal places; scale them to integers, then round the product back half away from zero
+    factor = int(Decimal(factor).scaleb(2).to_integral_value())
+    if len(deltas) and np.abs(deltas).max() > (INT64_MAX - 50) // max(abs(factor), 1):
+        raise OverflowError(f"Consumption scaled by a reading factor of {factor / 100} doesn't fit in int64")
+    scaled = deltas * factor
+    return np.sign(scaled) * ((np.abs(scaled) + 50) // 100)
 
-    if int(after_pulse.reading) < int(after_pulse.reading)/2:
-        after_reading = 10 ** meter_digits + int(after_pulse.reading)
-    else:
-        after_reading = after_pulse.cleaned_reading()
-
-    return after_reading - before_pulse.cleaned_reading()
-
-def sum_pulses_consumption(pulses, meter_digits):
-    consumption_sum = 0
-    last_pulse = None
-    for pulse in pulses:
-        if last_pulse is None:
-            last_pulse = pulse
-            continue
-        consumption_sum += consumption_between_two_pulses(last_pulse, pulse, meter_digits)
-    return consumption_sum
 
 def get_offset_time(datetime: dt.datetime):
     """ Offset time is used to get the "effective" day of a pulse's time. """
@@ -12,6 +12,7 @@
 app_name = "api"
 urlpatterns = [
     path('new-meter/', views.ConfigView.as_view()),
+    path('devices/bulk/', views.BulkDevicesView.as_view(), name='bulk-devices'),
     path('meters-summary/', views.MetersSummary.as_view()),
     path('meters-list/', views.MetersList.as_view()),
     path('transmitters-list/', views.PressureTransmittersList.as_view()),
@@ -31,10 +32,15 @@
     path('analytics/azp/', views.azp_history),
     path('pulses-history/flow/', views.flow_pulses_history),
     path('pulses-history/pressure/', views.pressure_pulses_history),
+    path('pulses-export/flow/', views.flow_pulses_export, name='flow-pulses-export'),
+    path('pulses-export/pressure/', views.pressure_pulses_export, name='pressure-pulses-export'),
+    path('billing-export/', views.billing_export, name='billing-export'),
+    path('water-balance/', views.water_balance_report, name='water-balance'),
 
     path('unix-time/', views.unix_time),
     path('unix-pulse/', views.UnixStampedPulse.as_view()),
     path('unix-pressure-pulse/', views.UnixStampedPressurePulse.as_view()),
+    path('binary-pulses/', views.binary_pulses, name='binary-pulses'),
 
     path('stats/overview', views.overview_report_data),
     path('stats/narrated-pressure-levels-overview-data/', views.narrated_pressure_levels_overview_data),
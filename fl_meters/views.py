@@ -3,28 +3,43 @@
 import itertools
 import json
 from functools import reduce
+from operator import attrgetter, itemgetter
 from json import JSONEncoder
 
 import pytz
 from django.conf import settings
-from django.core.exceptions import PermissionDenied
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models import Sum, Avg, F
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse
-from django.utils.dateparse import parse_datetime
+from django.db.models.functions import TruncMonth, TruncYear
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse, HttpResponseNotFound, \
+    StreamingHttpResponse
+from django.utils.dateparse import parse_datetime, parse_date
 from django.utils.timezone import now, make_aware, localtime
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET, require_POST
 from flexdict import FlexDict
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, serializers
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from fl_dashboard.tools import clean_since_until_date
-from . import stats
+from . import downsampling, metrics, stats
+from .annotations import annotations_of
+from .billing import BILLING_COLUMNS, billing_rows
+from .water_balance import water_balance
+from .ingest import get_pulse_writer, decode_pulse_frame, insert_pulses
+from .pagination import TimeKeysetPagination
+from .provisioning import provision_meters
+from .spool import SpoolFull
 from .models import Zone, DailyZoneConsumption, Meter, Pulse, PressurePulse, Alert, Customer, PressureTransmitter, \
-    MonthlyZoneConsumption, LossRecord, QuarterHourlyZoneConsumption, TransmissionLine, ChlorineSensorPulse
+    MonthlyZoneConsumption, LossRecord, QuarterHourlyZoneConsumption, TransmissionLine, ChlorineSensorPulse, \
+    DailyMeterConsumption, MeterFlowRate, HourlyMeterFlowRate, DailyMeterFlowRate, Annotation
 from .serializers import MeterSerializer, PulseSerializer, PressurePulseSerializer, TimestampedPulseSerializer, \
-    DatesToStrings, SinceUntilSerializer, ChlorineSensorPulseSerializer, TimestampedPressurePulseSerializer
-from .tools import consumption_between_two_pulses, get_now, datetime_ticks
+    DatesToStrings, SinceUntilSerializer, ChlorineSensorPulseSerializer, TimestampedPressurePulseSerializer, \
+    DeviceSerializer, validate_device_readings
+from .tools import get_now, datetime_ticks, get_offset_time
 
 DATETIME_FORMAT = settings.DATETIME_FORMAT
 
@@ -34,33 +49,120 @@ class MeterViewSet(viewsets.ModelViewSet):
     serializer_class = MeterSerializer
 
 
-class PulseViewSet(viewsets.ModelViewSet):
+class TimeSeriesFilterMixin:
+    """
+    Filters the list of a time-series viewset by the `since` and `until` query parameters, and by the device named
+    after `device_field`. Lists are paginated by `(time, id)` keysets.
+    """
+    device_field = None
+    pagination_class = TimeKeysetPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+
+        params = self.request.query_params
+        for param, lookup in (('since', 'time__gte'), ('until', 'time__lte')):
+            if params.get(param):
+                time = parse_datetime(params[param])
+                if time is None:
+                    raise serializers.ValidationError({param: "Send datetime values in ISO 8601 format"})
+                queryset = queryset.filter(**{lookup: time})
+        if params.get(self.device_field):
+            try:
+                queryset = queryset.filter(**{self.device_field + '_id': int(params[self.device_field])})
+            except ValueError:
+                raise serializers.ValidationError({self.device_field: "Send the id of a device"})
+        return queryset
+
+
+class PulseViewSet(TimeSeriesFilterMixin, viewsets.ModelViewSet):
     permission_classes = ()
     queryset = Pulse.objects.all()
     serializer_class = PulseSerializer
     http_method_names = ['get', 'post', 'head']
+    device_field = 'meter'
 
 
-class PressurePulseViewSet(viewsets.ModelViewSet):
+class PressurePulseViewSet(TimeSeriesFilterMixin, viewsets.ModelViewSet):
     permission_classes = ()
     queryset = PressurePulse.objects.all()
     serializer_class = PressurePulseSerializer
     http_method_names = ['get', 'post', 'head']
+    device_field = 'transmitter'
 
 
-class ChlorinePulseViewSet(viewsets.ModelViewSet):
+class ChlorinePulseViewSet(TimeSeriesFilterMixin, viewsets.ModelViewSet):
     permission_classes = ()
     queryset = ChlorineSensorPulse.objects.all()
     serializer_class = ChlorineSensorPulseSerializer
     http_method_names = ['get', 'post', 'head']
+    device_field = 'sensor'
 
 
 class ConfigView(APIView):
 
     def post(self, request, format=None):
-        meter = Meter.objects.create()
-        data = {'id': meter.id, 'token': meter.key}
-        return Response(data=data, status=status.HTTP_200_OK)
+        device = DeviceSerializer(data=request.data)
+        if not device.is_valid():
+            return Response(device.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            meter, = provision_meters([device.validated_data])
+        except ValidationError as e:
+            return Response(e.message_dict[0], status=status.HTTP_400_BAD_REQUEST)
+        return Response(data=meter, status=status.HTTP_200_OK)
+
+
+class BulkDevicesView(APIView):
+    """
+    Provisions a list of meters in one request. The whole list is rejected if any device is invalid, with the
+    errors keyed by the device's index. On success, responds with each meter's `id`, `key` and auth `token`.
+    """
+
+    def post(self, request, format=None):
+        devices = DeviceSerializer(data=request.data, many=True)
+        if not devices.is_valid():
+            errors = {idx: row_errors for idx, row_errors in enumerate(devices.errors) if row_errors}
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            meters = provision_meters(devices.validated_data)
+        except ValidationError as e:
+            return Response(e.message_dict, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data={'data': meters}, status=status.HTTP_201_CREATED)
+
+
+def clean_consumption_day(request) -> dt.date:
+    """ Returns the day meters' consumption is reported for: the requested `date`, or today. """
+    if 'date' not in request.query_params:
+        return get_offset_time(get_now()).date()
+    day = parse_date(request.query_params['date'])
+    if day is None:
+        raise ValueError("Date must be in the YYYY-MM-DD format")
+    return day
+
+
+def meters_consumption(day: dt.date, meters=None):
+    """
+    Reads the consumption of meters on `day`, and their average daily consumption over the
+    `METER_AVERAGE_CONSUMPTION_DAYS` days before it, from their daily consumption records. The records of pulses
+    saved before they were kept at ingest are filled by the `backfill_meter_consumption` command.
+
+    :param meters: A queryset of the meters to read, all meters by default.
+    :return: Two dicts mapping meter ids to their consumption and to their average. Meters without records are
+             missing from them.
+    """
+    records = DailyMeterConsumption.objects.all()
+    if meters is not None:
+        records = records.filter(meter__in=meters)
+
+    consumption = dict(records.filter(date=day).values_list('meter_id', 'consumption'))
+    averages = dict(
+        records.filter(date__lt=day, date__gte=day - dt.timedelta(days=settings.METER_AVERAGE_CONSUMPTION_DAYS))
+        .values('meter_id').annotate(average=Avg('consumption')).values_list('meter_id', 'average'))
+    return consumption, averages
 
 
 # I think this is not used anymore
@@ -74,6 +176,11 @@ def get(self, request, format=None):
             'data': []
         }
 
+        try:
+            consumption, averages = meters_consumption(clean_consumption_day(request))
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
         all_meters = Meter.objects.all()
 
         for meter in all_meters:
@@ -95,8 +202,8 @@ def get(self, request, format=None):
                 "previous_reading": previous_pulse.display_reading(),
                 "previous_time": previous_pulse.time.strftime(DATETIME_FORMAT) if previous_pulse.time is not None else "N/A",
 
-                "consumption": 5,
-                "average_consumption": 4.333,
+                "consumption": consumption.get(meter.id, 0),
+                "average_consumption": averages.get(meter.id, 0),
                 "status_string": status_string
             })
 
@@ -140,6 +247,10 @@ def get(self, request, format=None):
         }
 
         bulk_meters = Meter.objects.filter(meter_model__bulk_meter=True).select_related('meter_model')
+        try:
+            consumption, averages = meters_consumption(clean_consumption_day(request), bulk_meters)
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
 
         for meter in bulk_meters:
             last_two_pulses = meter.get_last_two_pulses()
@@ -147,11 +258,6 @@ def get(self, request, format=None):
             last_pulse = last_two_pulses[0] if len(last_two_pulses) > 0 else None
             previous_pulse = last_two_pulses[1] if len(last_two_pulses) > 1 else None
 
-            if last_pulse is None or previous_pulse is None:
-                consumption_value = 'N/A'
-            else:
-                consumption_value = consumption_between_two_pulses(previous_pulse, last_pulse, meter.meter_model.digits)
-
             return_dict["data"].append({
                 "meter_key": meter.key,
 
@@ -161,8 +267,8 @@ def get(self, request, format=None):
                 "previous_reading": previous_pulse.normalized_reading if previous_pulse else "N/A",
                 "previous_time": previous_pulse.time.strftime(DATETIME_FORMAT) if previous_pulse else "N/A",
 
-                "consumption": consumption_value,
-                "average_consumption": 0,
+                "consumption": consumption.get(meter.id, 'N/A'),
+                "average_consumption": averages.get(meter.id, 'N/A'),
             })
 
         return Response(return_dict)
@@ -173,18 +279,19 @@ class DetailedMetersConsumption(APIView):
     permission_classes = ()
 
     def get(self, request, format=None):
-        from random import randrange
         return_dict = {
             'data': []
         }
 
-        detailed_meters = Meter.objects.filter(meter_model__bulk_meter=False)
+        detailed_meters = Meter.objects.filter(meter_model__bulk_meter=False).select_related('customer')
+        try:
+            consumption, averages = meters_consumption(clean_consumption_day(request), detailed_meters)
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
 
         for meter in detailed_meters:
             last_two_pulses = meter.get_last_two_pulses()
 
-            alerts_number = Alert.objects.filter(meter_id__exact=meter.pk).count()
-
             last_pulse = last_two_pulses[0] if len(last_two_pulses) > 0 else Pulse()
             previous_pulse = last_two_pulses[1] if len(last_two_pulses) > 1 else Pulse()
 
@@ -199,9 +306,10 @@ def get(self, request, format=None):
                 "previous_time": previous_pulse.time.strftime(
                     DATETIME_FORMAT) if previous_pulse.time is not None else "N/A",
 
-                "consumption": 0,
-                "average_consumption": 0,
-                "alerts_no": alerts_number
+                "consumption": consumption.get(meter.id, 0),
+                "average_consumption": averages.get(meter.id, 0),
+                # the alerts of the meter itself; alerts are only raised on zones so far
+                "alerts_no": 0
             })
 
         return Response(return_dict)
@@ -515,6 +623,62 @@ def azp_history(request):
     return HttpResponseBadRequest()
 
 
+def wants_columnar(request) -> bool:
+    return request.GET.get('format') == 'columnar'
+
+
+def _epoch(time) -> float:
+    if not isinstance(time, dt.datetime):
+        time = dt.datetime.combine(time, dt.time.min).replace(tzinfo=pytz.utc)
+    return time.timestamp()
+
+
+def to_columns(rows, series_names=()) -> dict:
+    """
+    Transposes `(time, value, *series)` rows into the columnar chart format: epoch seconds in `t`, values in `v`,
+    and each other column in `series`, under its name. Keys aren't repeated per point, unlike a list of dicts.
+    """
+    columns = list(zip(*rows)) or [()] * (2 + len(series_names))
+    return {
+        't': list(map(_epoch, columns[0])),
+        'v': [None if value is None else float(value) for value in columns[1]],
+        'series': dict(zip(series_names, map(list, columns[2:]))),
+    }
+
+
+def narrated_to_columns(narration: dict) -> dict:
+    """ Transposes a `{time: value}` narration from `stats` into the columnar chart format. """
+    return to_columns(sorted(narration.items()))
+
+
+def annotations_to_json(annotations, columnar: bool) -> list:
+    """ Renders the annotations of a series, with their times in epoch seconds in the columnar chart format. """
+    if not columnar:
+        return annotations
+    return [{**annotation, 'since': _epoch(annotation['since']), 'until': _epoch(annotation['until']),
+             'value': None if annotation['value'] is None else float(annotation['value'])}
+            for annotation in annotations]
+
+
+def clean_downsampling(request):
+    """
+    Returns the `max_points` and `downsample` method requested for a series. `max_points` is None when the series
+    isn't to be downsampled. Raises `ValueError` if either is invalid.
+    """
+    max_points, method = request.GET.get('max_points'), request.GET.get('downsample', 'lttb')
+    if method not in downsampling.METHODS:
+        raise ValueError(f"Unknown downsampling method `{method}`")
+    if max_points is None:
+        return None, method
+    if int(max_points) < 3:
+        raise ValueError("Series can't be downsampled to less than 3 points")
+    return int(max_points), method
+
+
+DOWNSAMPLING_ERROR = "`max_points` must be a number greater than 2, and `downsample` one of: " + \
+                     ", ".join(downsampling.METHODS)
+
+
 def generic_filtered_json_response(request, get_json_response):
     if request.method == 'GET':
         until = request.GET.get('until', None)
@@ -538,6 +702,7 @@ def generic_filtered_json_response(request, get_json_response):
     return HttpResponseBadRequest()
 
 @csrf_exempt
+@gzip_page
 def overview_report_data(request):
     today = dt.datetime.combine(localtime().date(), dt.time.min).replace(tzinfo=pytz.utc)
     thirty_days_ago = today - dt.timedelta(days=30)
@@ -547,7 +712,8 @@ def overview_report_data(request):
     from fl_dashboard.customization import overview_report
     response_dict = {
         'pies': {},
-        'narrated_charts': {}
+        'narrated_charts': {},
+        'annotations': {},
     }
     if 'network_input_today' in overview_report['pies']:
         response_dict['pies']['transmission_inflow'] = stats.inflow_per_transmission_line(thirty_days_ago, today, res)
@@ -559,10 +725,16 @@ def overview_report_data(request):
         response_dict['narrated_charts']['narrated_network_input'] = stats.narrated_input(thirty_days_ago, today, res)
     if 'narrated_zone_consumption' in overview_report['narration_charts']:
         response_dict['narrated_charts']['narrated_zone_consumption'] = stats.narrated_consumption(thirty_days_ago, today, 'days')
+        response_dict['annotations']['narrated_zone_consumption'] = annotations_to_json(
+            annotations_of(Annotation.ZONE_CONSUMPTION, thirty_days_ago, today), wants_columnar(request))
 
-    return JsonResponse(json.dumps(response_dict, cls=DatesToStrings), safe=False)
+    if wants_columnar(request):
+        response_dict['narrated_charts'] = {
+            name: narrated_to_columns(narration) for name, narration in response_dict['narrated_charts'].items()}
+    return JsonResponse(response_dict, encoder=DatesToStrings)
 
 
+@gzip_page
 def narrated_pressure_levels_overview_data(request):
     today = dt.datetime.combine(localtime().date(), dt.time.min).replace(tzinfo=pytz.utc)
     thirty_days_ago = today - dt.timedelta(days=30)
@@ -592,9 +764,10 @@ def narrated_pressure_levels_overview_data(request):
             dataset['data'].append(PressurePulse.objects.filter(time__gte=start_of_day, time__lte=end_of_day, transmitter=pressure_sensor).aggregate(Avg('normalized_reading'))['normalized_reading__avg'])
         response_dict['datasets'].append(dataset)
 
-    return JsonResponse(json.dumps(response_dict, cls=DatesToStrings), safe=False)
+    return JsonResponse(response_dict, encoder=DatesToStrings)
 
 @csrf_exempt
+@gzip_page
 def overview_stats(request):
     post = json.loads(request.body)
 
@@ -611,7 +784,8 @@ def overview_stats(request):
     from fl_dashboard.customization import overview_report
     response_dict = {
         'pies': {},
-        'narrated_charts': {}
+        'narrated_charts': {},
+        'annotations': {},
     }
     if 'network_input_today' in overview_report['pies']:
         response_dict['pies']['transmission_inflow'] = stats.inflow_per_transmission_line(since_this_day, until_this_day, res)
@@ -623,10 +797,16 @@ def overview_stats(request):
         response_dict['narrated_charts']['narrated_network_input'] = stats.narrated_input(since_last_24h, until_last_24h, res)
     if 'narrated_zone_consumption' in overview_report['narration_charts']:
         response_dict['narrated_charts']['narrated_zone_consumption'] = stats.narrated_consumption(since_last_24h, until_last_24h, res)
+        response_dict['annotations']['narrated_zone_consumption'] = annotations_to_json(
+            annotations_of(Annotation.ZONE_CONSUMPTION, since_last_24h, until_last_24h), wants_columnar(request))
 
-    return JsonResponse(json.dumps(response_dict, cls=DatesToStrings), safe=False)
+    if wants_columnar(request):
+        response_dict['narrated_charts'] = {
+            name: narrated_to_columns(narration) for name, narration in response_dict['narrated_charts'].items()}
+    return JsonResponse(response_dict, encoder=DatesToStrings)
 
 @csrf_exempt
+@gzip_page
 def narrated_chlorine_level(request):
     post = json.loads(request.body)
     su = SinceUntilSerializer(data=post)
@@ -635,17 +815,47 @@ def narrated_chlorine_level(request):
     until = su.validated_data['until']
     aggregation_period = post['res']
     sensors = post['sensors']
-    return JsonResponse(json.dumps(stats.narrated_chlorine_level(since, until, sensors, aggregation_period), cls=DatesToStrings), safe=False)
+    narration = stats.narrated_chlorine_level(since, until, sensors, aggregation_period)
+    if wants_columnar(request):
+        return JsonResponse(narrated_to_columns(narration))
+    return JsonResponse(narration, encoder=DatesToStrings)
 
 
+@gzip_page
 def flow_pulses_history(request):
+    try:
+        max_points, method = clean_downsampling(request)
+    except ValueError:
+        return HttpResponseBadRequest(DOWNSAMPLING_ERROR)
+
+    def get_columnar_response(since, until):
+        pulses = list(Pulse.objects.filter(time__gte=since, time__lte=until).order_by('time', 'id')
+                      .values_list('time', 'normalized_reading', 'meter_id', 'anomaly'))
+        if max_points:
+            # anomalies are always kept
+            pulses = downsampling.downsample_rows(
+                pulses, max_points, method, time=lambda pulse: pulse[0].timestamp(), series=itemgetter(2),
+                keep=itemgetter(3))
+        response = to_columns([pulse[:3] for pulse in pulses], ['meter_id'])
+        response['meters'] = {
+            meter_id: {'key': key, 'input_zone_name': input_zone, 'output_zone_name': output_zone}
+            for meter_id, key, input_zone, output_zone in Meter.objects.filter(id__in=set(response['series']['meter_id']))
+            .values_list('id', 'key', 'input_for__name', 'output_for__name')
+        }
+        return response
+
     def get_json_response(since, until):
         server_timezone = localtime().tzinfo
         since = since.replace(tzinfo=server_timezone)
         until = until.replace(tzinfo=server_timezone)
         pulses = Pulse.objects.filter(time__gte=since, time__lte=until)\
             .select_related('meter', 'meter__input_for', 'meter__output_for')\
-            .only('id', 'reading', 'time', 'meter_id', 'meter__key', 'meter__input_for__name', 'meter__output_for__name')
+            .only('id', 'reading', 'normalized_reading', 'time', 'anomaly', 'meter_id', 'meter__key',
+                  'meter__input_for__name', 'meter__output_for__name')
+        if max_points:
+            pulses = downsampling.downsample_rows(
+                list(pulses.order_by('time', 'id')), max_points, method, time=lambda pulse: pulse.time.timestamp(),
+                value=attrgetter('normalized_reading'), series=attrgetter('meter_id'), keep=attrgetter('anomaly'))
 
         def transform_pulse_to_response(entry: Pulse):
             return {
@@ -662,13 +872,36 @@ def transform_pulse_to_response(entry: Pulse):
 
         return {'data': list(map(transform_pulse_to_response, pulses))}
 
-    return generic_filtered_json_response(request, get_json_response)
+    return generic_filtered_json_response(
+        request, get_columnar_response if wants_columnar(request) else get_json_response)
 
 
+@gzip_page
 def pressure_pulses_history(request):
+    try:
+        max_points, method = clean_downsampling(request)
+    except ValueError:
+        return HttpResponseBadRequest(DOWNSAMPLING_ERROR)
+
+    def get_columnar_response(since, until):
+        pulses = list(PressurePulse.objects.filter(time__gte=since, time__lte=until).order_by('time', 'id')
+                      .values_list('time', 'normalized_reading', 'transmitter_id'))
+        if max_points:
+            pulses = downsampling.downsample_rows(
+                pulses, max_points, method, time=lambda pulse: pulse[0].timestamp(), series=itemgetter(2))
+        response = to_columns(pulses, ['transmitter_id'])
+        response['transmitters'] = dict(PressureTransmitter.objects.filter(
+            id__in=set(response['series']['transmitter_id'])).values_list('id', 'key'))
+        return response
+
     def get_json_response(since, until):
         pulses = PressurePulse.objects.filter(time__gte=since, time__lte=until)\
-            .select_related('transmitter').only('id', 'reading', 'time', 'transmitter_id', 'transmitter__key')
+            .select_related('transmitter')\
+            .only('id', 'reading', 'normalized_reading', 'time', 'transmitter_id', 'transmitter__key')
+        if max_points:
+            pulses = downsampling.downsample_rows(
+                list(pulses.order_by('time', 'id')), max_points, method, time=lambda pulse: pulse.time.timestamp(),
+                value=attrgetter('normalized_reading'), series=attrgetter('transmitter_id'))
 
         def pulse_to_json(entry: PressurePulse):
             return {
@@ -682,7 +915,139 @@ def pulse_to_json(entry: PressurePulse):
 
         return {'data': list(map(pulse_to_json, pulses))}
 
-    return generic_filtered_json_response(request, get_json_response)
+    return generic_filtered_json_response(
+        request, get_columnar_response if wants_columnar(request) else get_json_response)
+
+
+class _Echo:
+    """ A file-like object that returns what's written to it, for `csv.writer` to format rows one at a time. """
+    def write(self, value):
+        return value
+
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def streaming_export_response(request, queryset, columns, filename):
+    """
+    Streams the rows of `queryset`, a `values_list` queryset or an iterator of rows, as CSV or NDJSON depending on
+    the `format` parameter. Rows are read through a server-side cursor and written in chunks, so memory use doesn't
+    grow with the period.
+    """
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest(f"Unknown format `{export_format}`. Use one of: {', '.join(EXPORT_FORMATS)}")
+
+    rows = queryset.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE) if hasattr(queryset, 'iterator') else queryset
+    if export_format == 'csv':
+        writer = csv.writer(_Echo())
+        lines = itertools.chain([writer.writerow(columns)], map(writer.writerow, rows))
+    else:
+        encoder = DjangoJSONEncoder()
+        lines = (encoder.encode(dict(zip(columns, row))) + "\n" for row in rows)
+
+    def chunks():
+        while True:
+            chunk = "".join(itertools.islice(lines, settings.EXPORT_CHUNK_SIZE))
+            if not chunk:
+                return
+            yield chunk
+
+    response = StreamingHttpResponse(chunks(), content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
+
+
+def clean_export_period(request):
+    """ Returns the `since` and `until` of an export request. Raises `ValueError` if they are invalid or reversed. """
+    since, until = clean_since_until_date(request.GET.get('since'), request.GET.get('until'))
+    if since > until:
+        raise ValueError("Time period is reversed. `Since` is after `Until`")
+    return since, until
+
+
+@require_GET
+def flow_pulses_export(request):
+    """
+    Exports the flow pulses of a period, optionally of a single `meter`, with no limit on the period's length.
+    Readings are exported as stored: the `reading` sent by the meter, and its `normalized_reading`.
+    """
+    try:
+        since, until = clean_export_period(request)
+    except (ValueError, ValidationError):
+        return HttpResponseBadRequest("Invalid date parameter(s). Send date values in ISO 8601 format, with `since` "
+                                      "before `until`")
+
+    pulses = Pulse.objects.filter(time__gte=since, time__lte=until)
+    if request.GET.get('meter'):
+        try:
+            pulses = pulses.filter(meter_id=int(request.GET['meter']))
+        except ValueError:
+            return HttpResponseBadRequest("Send the id of a meter in `meter`")
+    pulses = pulses.order_by('time', 'id').values_list(
+        'id', 'time', 'meter_id', 'meter__key', 'reading', 'normalized_reading')
+
+    return streaming_export_response(
+        request, pulses, ['id', 'time', 'meter_id', 'meter_key', 'reading', 'normalized_reading'],
+        f"flow-pulses-{since.date()}-{until.date()}")
+
+
+@require_GET
+def pressure_pulses_export(request):
+    """ Exports the pressure pulses of a period, optionally of a single `transmitter`. """
+    try:
+        since, until = clean_export_period(request)
+    except (ValueError, ValidationError):
+        return HttpResponseBadRequest("Invalid date parameter(s). Send date values in ISO 8601 format, with `since` "
+                                      "before `until`")
+
+    pulses = PressurePulse.objects.filter(time__gte=since, time__lte=until)
+    if request.GET.get('transmitter'):
+        try:
+            pulses = pulses.filter(transmitter_id=int(request.GET['transmitter']))
+        except ValueError:
+            return HttpResponseBadRequest("Send the id of a transmitter in `transmitter`")
+    pulses = pulses.order_by('time', 'id').values_list(
+        'id', 'time', 'transmitter_id', 'transmitter__key', 'reading', 'normalized_reading')
+
+    return streaming_export_response(
+        request, pulses, ['id', 'time', 'transmitter_id', 'transmitter_key', 'reading', 'normalized_reading'],
+        f"pressure-pulses-{since.date()}-{until.date()}")
+
+
+@require_GET
+def billing_export(request):
+    """
+    Exports the consumption of every customer meter over a `month` (YYYY-MM). Nothing is saved: months are billed by
+    the `export_billing` command.
+    """
+    try:
+        month = dt.datetime.strptime(request.GET.get('month', ''), '%Y-%m').date()
+    except ValueError:
+        return HttpResponseBadRequest("Send the `month` to bill in the YYYY-MM format")
+
+    return streaming_export_response(request, billing_rows(month), BILLING_COLUMNS, f"billing-{month:%Y-%m}")
+
+
+@require_GET
+def water_balance_report(request):
+    """
+    Returns the water balance of every zone and transmission line over the months `since` to `until` (YYYY-MM), by
+    default from the start of the year to the current month.
+    """
+    this_month = get_now().date().replace(day=1)
+    try:
+        since = dt.datetime.strptime(request.GET.get('since', f"{this_month:%Y}-01"), '%Y-%m').date()
+        until = dt.datetime.strptime(request.GET.get('until', f"{this_month:%Y-%m}"), '%Y-%m').date()
+    except ValueError:
+        return HttpResponseBadRequest("Send `since` and `until` months in the YYYY-MM format")
+    if since > until:
+        return HttpResponseBadRequest("Time period is reversed. `Since` is after `Until`")
+
+    return JsonResponse(water_balance(since, until))
 
 
 def unix_time(request):
@@ -697,7 +1062,14 @@ class UnixStampedPulse(APIView):
     def post(self, request):
         pulse = TimestampedPulseSerializer(data=request.data)
         if pulse.is_valid():
-            pulse.save()
+            if settings.INGEST_WRITE_BEHIND:
+                try:
+                    get_pulse_writer().submit(pulse.validated_data)
+                except SpoolFull:
+                    return Response({'detail': "Too many pulses are waiting to be saved, retry later"},
+                                    status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '5'})
+            else:
+                pulse.save()
             return Response(pulse.validated_data)
         return Response(pulse.errors, status=400)
 
@@ -713,6 +1085,45 @@ def post(self, request):
         return Response(pulse.errors, status=400)
 
 
+@csrf_exempt
+@require_POST
+def binary_pulses(request):
+    """
+    Ingests the pulses of a single meter packed in a binary frame, see `ingest.decode_pulse_frame`. The frame is
+    rejected as a whole if any of its readings would be rejected when sent as JSON.
+    """
+    try:
+        pulses = decode_pulse_frame(request.body)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    meter = Meter.objects.filter(id=pulses[0]['meter_id']).only('reading_factor', 'reading_offset').first()
+    if meter is None:
+        return HttpResponseNotFound(f"Meter ({pulses[0]['meter_id']}) does not exist")
+    try:
+        validate_device_readings(meter, [pulse['reading'] for pulse in pulses])
+    except serializers.ValidationError as e:
+        return HttpResponseBadRequest(e.detail[0])
+
+    if settings.INGEST_WRITE_BEHIND:
+        try:
+            get_pulse_writer().submit_many(pulses)
+        except SpoolFull:
+            response = HttpResponse(status=503)
+            response['Retry-After'] = '5'
+            return response
+    else:
+        insert_pulses(pulses)
+    return HttpResponse(status=204)
+
+
+@require_GET
+def pipeline_metrics(request):
+    """ Serves the metrics of the pulse analytics pipeline in the Prometheus text format, to staff and scrapers. """
+    if not metrics.authorized(request):
+        raise PermissionDenied
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def recent_qh(request):
     just_now = localtime().replace(minute=0, second=0, microsecond=0, tzinfo=pytz.utc)
     before_36_hours = just_now - dt.timedelta(hours=36)
@@ -730,7 +1141,22 @@ def recent_qh(request):
     return response
 
 
+# the flow rate series each resolution is narrated from, the field of their periods, and how they're bucketed
+FLOW_RATE_RESOLUTIONS = {
+    'minutes': (MeterFlowRate, 'time', F('time')),
+    'hours': (HourlyMeterFlowRate, 'datetime', F('datetime')),
+    'days': (DailyMeterFlowRate, 'date', F('date')),
+    'months': (DailyMeterFlowRate, 'date', TruncMonth('date')),
+    'years': (DailyMeterFlowRate, 'date', TruncYear('date')),
+}
+
+
+@gzip_page
 def flow_meter_narrate(request):
+    """
+    Narrates the flow rate of meters, in volume per hour: of the `meters[]` given, or of all meters but the
+    `exclude-meters[]`. The flow rate of a period is summed over meters, each flowing at its own average rate.
+    """
     since = request.GET.get('from')
     until = request.GET.get('to')
     if not all((since, until)):
@@ -749,46 +1175,38 @@ def flow_meter_narrate(request):
     if meters and exclude_meters:
         return HttpResponseBadRequest("Request must include either `meters` or `exclude_meters` parameter, but not both.")
 
+    resolution = request.GET.get('resolution') or 'hours'
+    if resolution not in FLOW_RATE_RESOLUTIONS:
+        return HttpResponseBadRequest(f"Resolution must be one of {', '.join(FLOW_RATE_RESOLUTIONS)}")
+    model, field, bucket = FLOW_RATE_RESOLUTIONS[resolution]
+    period_range = (since.date(), until.date()) if field == 'date' else (since, until)
 
-    resolution = request.GET.get('resolution')
-    if not resolution:
-        def guess_resolution(since, until):
-            return 'hours'
-
-        resolution = guess_resolution(since, until)
-
-    # TODO: Replace with a flowrate table instead of this crap
-    pulses_qs = QuarterHourlyZoneConsumption.objects.filter(datetime__range=(since, until)).order_by('datetime')
-
-    if exclude_meters:
-        pulses_qs = pulses_qs.exclude(meter_id__in=list(map(int, exclude_meters)))
-    elif meters:
-        pulses_qs = pulses_qs.filter(zone_id__input_meters__in=list(map(int, meters)))
-
-    def time_resolution(datetime: dt.datetime, resolution):
-        if resolution == 'hours':
-            resolution = "%Y-%m-%dT%H:00"
-        elif resolution == 'days':
-            resolution = "%Y-%m-%dT00:00"
-        elif resolution == 'months':
-            resolution = "%Y-%m-01T00:00"
-        elif resolution == 'years':
-            resolution = "%Y-01-01T00:00"
-
-        return datetime.strftime(resolution)
-
-    if resolution == 'minutes':
-        return_list = pulses_qs.values('time', reading=F('normalized_reading'))
-    else:
-        pulse_chunks = itertools.groupby(pulses_qs, lambda pulse: time_resolution(pulse.datetime - dt.timedelta(minutes=15), resolution))
-        return_list = []
-        for resolution_group, pulses in pulse_chunks:
-            return_list.append({
-                'time': resolution_group,
-                'reading': sum([pulse.consumption for pulse in pulses])
-            })
-
-    return JsonResponse(json.dumps(return_list, cls=DatesToStrings), safe=False)
+    records = model.objects.filter(**{f'{field}__range': period_range})
+    try:
+        if exclude_meters:
+            records = records.exclude(meter_id__in=list(map(int, exclude_meters)))
+        elif meters:
+            records = records.filter(meter_id__in=list(map(int, meters)))
+    except ValueError:
+        return HttpResponseBadRequest("Meters must be given by their IDs")
+
+    # a single query, grouped by period and meter; meters' rates are then summed in each period
+    records = records.values('meter_id', period=bucket).annotate(volume=Sum('volume'), seconds=Sum('seconds'))\
+        .order_by('period')
+    narration = []
+    for period, rows in itertools.groupby(records, itemgetter('period')):
+        rows = [row for row in rows if row['seconds']]
+        narration.append((period, float(sum(row['volume'] * 3600 / row['seconds'] for row in rows)),
+                          float(sum(row['volume'] for row in rows))))
+
+    if wants_columnar(request):
+        # annotations are only returned along with columns, a list of points has no room for them
+        annotations = annotations_of(Annotation.METER_FLOWRATE, since, until,
+                                     list(map(int, meters)) if meters else None, list(map(int, exclude_meters)))
+        return JsonResponse({**to_columns(narration, ('volume',)),
+                             'annotations': annotations_to_json(annotations, columnar=True)})
+    return JsonResponse([{'time': period, 'flow_rate': flow_rate, 'volume': volume}
+                         for period, flow_rate, volume in narration], encoder=DatesToStrings, safe=False)
 
 
 def detected_anomalies(request):
@@ -801,6 +1219,10 @@ def detected_anomalies(request):
     since = request.GET.get('since')
     until = request.GET.get('until')
     meters_ids = list(map(int, request.GET.getlist('metersIds[]')))
+    try:
+        max_points, method = clean_downsampling(request)
+    except ValueError:
+        return HttpResponseBadRequest(DOWNSAMPLING_ERROR)
 
     since = parse_datetime(since)
     org_since = since
@@ -840,6 +1262,7 @@ def detected_anomalies(request):
             'flow': [],
             'anomalies': [],
         }
+        flow_times = []
 
         for flow_series, anomaly_series in zip(pulses_df.iterrows(), anomalies.iterrows()):
             if flow_series[0] < org_since:
@@ -858,6 +1281,20 @@ def detected_anomalies(request):
 
             return_dict['metersData'][meter_id]['flow'].append(None if pd.isnull(flow_value) else flow_value)
             return_dict['metersData'][meter_id]['anomalies'].append(is_anomaly)
+            flow_times.append(flow_series[0])
+
+        if max_points:
+            # downsampled series don't line up with the shared timestamps anymore, so each gets its own.
+            # anomalies are always kept
+            meter_data = return_dict['metersData'][meter_id]
+            kept = set(downsampling.downsample_indices(
+                [time.timestamp() for time in flow_times], meter_data['flow'], max_points, method))
+            kept = sorted(kept.union(idx for idx, is_anomaly in enumerate(meter_data['anomalies']) if is_anomaly))
+            return_dict['metersData'][meter_id] = {
+                'timestamps': [flow_times[idx].isoformat() for idx in kept],
+                'flow': [meter_data['flow'][idx] for idx in kept],
+                'anomalies': [meter_data['anomalies'][idx] for idx in kept],
+            }
 
     return JsonResponse(return_dict)
 
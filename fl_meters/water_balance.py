@@ -0,0 +1,123 @@
+import datetime as dt
+from typing import Dict, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Sum
+
+from .models import Zone, TransmissionLine, MonthlyZoneConsumption, LossRecord, MonthlyTSMInflow, \
+    MonthlyTSMLossRecord, WaterBalanceRevision
+from .tools import get_now
+
+""" IWA WATER BALANCE """
+
+# Components of the balance, following the IWA standard water balance. Unbilled authorized consumption isn't
+# metered, so it's taken as zero: billed consumption is all of the authorized consumption.
+COMPONENTS = ('system_input', 'billed_consumption', 'water_losses', 'real_losses', 'apparent_losses',
+              'non_revenue_water')
+
+
+def _balance(system_input, billed_consumption, real_losses) -> Dict:
+    """
+    Balances the volumes of an entity. Real losses come from the minimum night flow analysis, and apparent losses
+    (metering errors, unauthorized consumption) are what's left of the water losses. Volumes that depend on billed
+    consumption are None until the period is billed.
+    """
+    if system_input is None and billed_consumption is None:
+        billed_consumption = 0  # nothing entered, nothing to bill
+    balance = dict.fromkeys(COMPONENTS)
+    balance.update(system_input=system_input or 0, billed_consumption=billed_consumption, real_losses=real_losses or 0)
+    if billed_consumption is not None:
+        balance['water_losses'] = balance['non_revenue_water'] = balance['system_input'] - billed_consumption
+        balance['apparent_losses'] = balance['water_losses'] - balance['real_losses']
+    return balance
+
+
+def _sums(queryset, group_field, sum_field) -> Dict[int, object]:
+    return dict(queryset.values(group_field).annotate(total=Sum(sum_field)).values_list(group_field, 'total'))
+
+
+def compute_water_balance(since: dt.date, until: dt.date) -> Dict:
+    """
+    Computes the water balance of every zone and transmission line over the months from `since` to `until`,
+    inclusive, from the monthly rollups. Runs eight queries, however many zones, lines and months there are.
+
+    :return: The balance of each zone and transmission line, keyed by name and key, and the utility-wide `total`:
+             the balance of all zones, plus the real losses of the transmission lines feeding them.
+    """
+    months = {'date__gte': since.replace(day=1), 'date__lte': until.replace(day=1)}
+    next_month = (until.replace(day=1) + dt.timedelta(days=32)).replace(day=1)
+
+    zone_records = MonthlyZoneConsumption.objects.filter(**months)
+    zone_input = _sums(zone_records, 'zone_id', 'consumption')
+    zone_billed = _sums(zone_records.filter(billed_consumption__isnull=False), 'zone_id', 'billed_consumption')
+    zone_losses = _sums(LossRecord.objects.filter(date__gte=since.replace(day=1), date__lt=next_month),
+                        'zone_id', 'amount')
+
+    tsm_records = MonthlyTSMInflow.objects.filter(**months)
+    tsm_input = _sums(tsm_records, 'transmission_line_id', 'consumption')
+    tsm_billed = _sums(tsm_records.filter(billed_consumption__isnull=False), 'transmission_line_id',
+                       'billed_consumption')
+    tsm_losses = _sums(MonthlyTSMLossRecord.objects.filter(**months), 'transmission_line_id', 'loss')
+
+    result = {
+        'since': since.replace(day=1).isoformat(),
+        'until': until.replace(day=1).isoformat(),
+        'zones': {
+            name: _balance(zone_input.get(zone_id), zone_billed.get(zone_id), zone_losses.get(zone_id))
+            for zone_id, name in Zone.objects.values_list('id', 'name')
+        },
+        'transmission_lines': {
+            key: _balance(tsm_input.get(tsm_id), tsm_billed.get(tsm_id), tsm_losses.get(tsm_id))
+            for tsm_id, key in TransmissionLine.objects.values_list('id', 'key')
+        },
+    }
+
+    # water lost on transmission lines entered the system without reaching a zone
+    zones = result['zones'].values()
+    line_losses = sum(balance['real_losses'] for balance in result['transmission_lines'].values())
+    total = {component: None if any(balance[component] is None for balance in zones)
+             else sum(balance[component] for balance in zones)
+             for component in COMPONENTS}
+    for component in ('system_input', 'real_losses', 'water_losses', 'non_revenue_water'):
+        if total[component] is not None:
+            total[component] += line_losses
+    result['total'] = total
+    return result
+
+
+def water_balance(since: dt.date, until: dt.date) -> Dict:
+    """
+    Returns the `compute_water_balance` of a period, cached once the period is closed: once its last month is over,
+    its balance only changes when the figures of one of its months are revised, see `revise_months`.
+
+    Cached balances are keyed by the revisions of their months, which are read from the database, so a revision made
+    by any process is seen by all of them, whatever the cache backend.
+    """
+    current_month = get_now().date().replace(day=1)
+    if until.replace(day=1) >= current_month:
+        return compute_water_balance(since, until)
+
+    revisions = WaterBalanceRevision.objects.filter(month__gte=since.replace(day=1),
+                                                    month__lte=until.replace(day=1)).aggregate(Sum('revision'))
+    key = f"water-balance:{since:%Y-%m}:{until:%Y-%m}:{revisions['revision__sum'] or 0}"
+    balance = cache.get(key)
+    if balance is None:
+        balance = compute_water_balance(since, until)
+        cache.set(key, balance, settings.WATER_BALANCE_CACHE_TIMEOUT)
+    return balance
+
+
+def revise_months(months: Iterable[dt.date]) -> None:
+    """
+    Marks the figures of the closed months among `months` as changed, so the cached balances of the periods holding
+    them are recomputed. Months still open aren't cached, and are skipped without a query.
+    """
+    current_month = get_now().date().replace(day=1)
+    closed = {month.replace(day=1) for month in months if month.replace(day=1) < current_month}
+    if not closed:
+        return
+    # months revised for the first time are created alongside those created concurrently, then all are bumped
+    WaterBalanceRevision.objects.bulk_create([WaterBalanceRevision(month=month) for month in closed],
+                                             ignore_conflicts=True)
+    WaterBalanceRevision.objects.filter(month__in=closed).update(revision=F('revision') + 1)
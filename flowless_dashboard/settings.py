@@ -25,10 +25,12 @@
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'fl_meters.capture.IngestCaptureMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'fl_meters.profiling.RequestProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -119,6 +121,77 @@
 VERBOSE_DATE_FORMAT = "%d/%m/%Y"
 VERBOSE_DATETIME_FORMAT = VERBOSE_DATE_FORMAT + ", " + VERBOSE_TIME_FORMAT
 
+# Number of serials each process reserves per round-trip when generating device keys. Serials left unused in a
+# reserved block are skipped once the process exits, so keys have gaps of up to a block per process and restart.
+# Blocks reserved within a transaction are only reused once it commits. 1 reserves a serial per key, without gaps.
+SERIAL_BLOCK_SIZE = 20
+
+# Write-behind ingest: accepted pulses are appended to a local spool, then saved in batches by a background thread
+# every INGEST_BATCH_SIZE pulses or INGEST_FLUSH_INTERVAL_MS milliseconds. Pulses keep being accepted while the
+# database is unreachable, until the spool of a process holds INGEST_SPOOL_MAX_BYTES; ingest is refused with a 503 then.
+INGEST_WRITE_BEHIND = False
+INGEST_SPOOL_DIR = os.path.join(BASE_DIR, 'spool')
+INGEST_BATCH_SIZE = 500
+INGEST_FLUSH_INTERVAL_MS = 200
+INGEST_SPOOL_MAX_BYTES = 256 * 1024 * 1024
+# Pulses the database refuses to store, even on their own, are appended to this file as JSON lines, so the batch they
+# came in can still be saved.
+INGEST_DEAD_LETTER_FILE = os.path.join(INGEST_SPOOL_DIR, 'dead-letter.jsonl')
+# Number of frames the ingest gateway queues before it stops reading device connections.
+INGEST_GATEWAY_MAX_PENDING_FRAMES = 5000
+# Datagrams the ingest gateway handles at once; further ones are answered with RETRY_LATER.
+INGEST_GATEWAY_MAX_DATAGRAMS = 1000
+# Seconds the ingest gateway remembers the meter of a token, or that it has none. A revoked token is refused within it.
+INGEST_GATEWAY_TOKEN_TTL = 300
+# Seconds a device has to send its token once connected to the ingest gateway, before it's hung up on.
+INGEST_GATEWAY_AUTH_TIMEOUT = 10
+
+# Number of rows fetched per round-trip, and written per chunk, by the streaming pulse exports.
+EXPORT_CHUNK_SIZE = 2000
+
+# Number of days before the reported one that meters' average daily consumption is taken over.
+METER_AVERAGE_CONSUMPTION_DAYS = 30
+
+# Seconds the water balance of a closed period stays cached. Revising one of its months (billing it again, or a
+# late figure landing in it) makes it recomputed.
+WATER_BALANCE_CACHE_TIMEOUT = 7 * 24 * 3600
+
+# Days of a zone's history its daily consumption profile is averaged over, for the `profile` gap interpolation.
+GAP_PROFILE_DAYS = 28
+
+# Hour of the day (UTC) each time-of-day partition of the daily zone consumption starts at, in order. A partition runs
+# until the next one starts, and the last one wraps around midnight.
+DAY_PARTITIONS = (('dawn', 4), ('noon', 10), ('afternoon', 14), ('evening', 18), ('nighttime', 22))
+
+# Time and queries of each stage of the pulse analytics pipeline are kept in per-process histograms, served in the
+# Prometheus text format at /metrics to staff users, and to scrapers sending `Authorization: Bearer <METRICS_TOKEN>`.
+PIPELINE_METRICS = True
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Ingest traffic capture, for replaying real traffic offline with `manage.py replay_ingest`. POST requests to the
+# INGEST_CAPTURE_PATHS are appended to gzip files in INGEST_CAPTURE_DIR, rotated once they hold
+# INGEST_CAPTURE_MAX_BYTES or are INGEST_CAPTURE_ROTATE_SECONDS old. Only the INGEST_CAPTURE_KEEP_FILES newest are kept.
+# Captures are flushed to disk every INGEST_CAPTURE_FLUSH_SECONDS.
+INGEST_CAPTURE = False
+INGEST_CAPTURE_DIR = os.path.join(BASE_DIR, 'captures')
+INGEST_CAPTURE_PATHS = ['/api/pulse/', '/api/pressure/', '/api/chlorine/', '/api/unix-pulse/',
+                        '/api/unix-pressure-pulse/', '/api/binary-pulses/']
+INGEST_CAPTURE_MAX_BYTES = 64 * 1024 * 1024
+INGEST_CAPTURE_ROTATE_SECONDS = 3600
+INGEST_CAPTURE_KEEP_FILES = 48
+INGEST_CAPTURE_FLUSH_SECONDS = 1
+
+# Request profiling: the queries of a request, its duplicated queries and its database and Python time, returned in a
+# Server-Timing header listing the REQUEST_PROFILING_DUPLICATES most repeated queries. REQUEST_PROFILING profiles
+# every request, otherwise only requests with an X-Profile header are, from staff or bearing the METRICS_TOKEN.
+# The REQUEST_PROFILING_TOP slowest requests of the last REQUEST_PROFILING_DAYS are kept, viewable in the admin. The
+# table is pruned once per REQUEST_PROFILING_PRUNE_SECONDS, and requests faster than those kept aren't written.
+REQUEST_PROFILING = False
+REQUEST_PROFILING_DUPLICATES = 3
+REQUEST_PROFILING_TOP = 50
+REQUEST_PROFILING_DAYS = 7
+REQUEST_PROFILING_PRUNE_SECONDS = 60
+
 # == Machine-specific Settings ==
 try:
     from .local_settings import *
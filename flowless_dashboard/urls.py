@@ -4,6 +4,7 @@
 from django.views.generic.base import RedirectView
 
 import fl_meters.urls as fl_meters_urls
+import fl_meters.views as fl_meters_views
 
 router = routers.DefaultRouter()
 router.registry.extend(fl_meters_urls.router.registry)
@@ -19,6 +20,7 @@
     path('api/', include(router.urls)),       # DRF API endpoints
     path('api/', include('fl_meters.urls')),  # Custom API endpoints
     path('dashboard/', include('fl_dashboard.urls'), name='index'),
+    path('metrics', fl_meters_views.pipeline_metrics, name='metrics'),  # Prometheus scrape endpoint
     path('', include('fl_dashboard.auth_urls'), name='auth'),
     path('', RedirectView.as_view(url='/dashboard/', permanent=True))
 ]